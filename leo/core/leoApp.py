@@ -47,6 +47,7 @@ class LeoApp:
         # Command-line arguments...
         self.batchMode = False          # True: run in batch mode.
         self.enablePlugins = True       # True: run start1 hook to load plugins. --no-plugins
+        self.enableHooks = True         # False: g.doHook does nothing. Set by leoBridge.
         self.gui = None                 # The gui class.
         self.guiArgName = None          # The gui name given in --gui option.
         self.ipython_inited = False     # True if leoIpython.py imports succeeded.
@@ -100,6 +101,7 @@ class LeoApp:
         # Global controller/manager objects...
         self.config = None              # The singleton leoConfig instance.
         self.db = None                  # The singleton leoCacher instance.
+        self.gnxIndex = None            # The singleton gnxIndex instance.
         self.loadManager = None         # The singleton LoadManager instance.
         # self.logManager = None        # The singleton LogManager instance.
         # self.openWithManager = None   # The singleton OpenWithManager instance.
@@ -2050,6 +2052,7 @@ class LoadManager:
         g.app.recentFilesManager = RecentFilesManager()
         g.app.config = leoConfig.GlobalConfigManager()
         g.app.nodeIndices = leoNodes.nodeIndices(g.app.leoID)
+        g.app.gnxIndex = leoNodes.gnxIndex()
         g.app.sessionManager = leoSessions.SessionManager()
         # Complete the plugins class last.
         g.app.pluginsController.finishCreate()
@@ -1525,6 +1525,7 @@ class atFile:
             else:
                 v = leoNodes.vnode(context=c)
                 v._headString = headline # Allowed use of v._headString.
+                c.headlineVersion += 1 # Invalidate c.unlCache.
                 v.fileIndex = gnx
                 gnxDict[gnxString] = v
 
@@ -1566,6 +1567,7 @@ class atFile:
         else:
             v = leoNodes.vnode(context=c)
             v._headString = headline # Allowed use of v._headString.
+            c.headlineVersion += 1 # Invalidate c.unlCache.
             v.fileIndex = gnx
             gnxDict[gnxString] = v
             child = v
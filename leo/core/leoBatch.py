@@ -0,0 +1,378 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20140219061533.16763: * @file leoBatch.py
+'''
+Run batch jobs on .leo files using a single, long-lived leoBridge.
+
+Settings, plugins and mode tables are loaded once. Each job opens its
+outline, runs a command and closes the outline again.
+
+Usage:
+
+    python leoBatch.py --manifest=<file> [--workers=n] [--no-settings]
+        Run all the jobs in the manifest, then exit.
+
+    python leoBatch.py --serve [--socket=<path>] [--workers=n]
+        Accept jobs on a local socket until a client sends 'quit'.
+
+    python leoBatch.py --send=<job> [--socket=<path>]
+        Send one job to a running server and print the result.
+
+A job is a line of the form::
+
+    <command> <path to .leo file>
+
+The commands are: read, write-all, write-dirty, tangle and rst. A line
+containing only a path means 'write-all <path>'. Blank lines and lines
+starting with '#' are ignored.
+
+Each job reports its timings; a summary reports the throughput of all jobs.
+
+Like leoBridge, leoBatch reads leoSettings.leo and myLeoSettings.leo, so jobs
+see the same @<file> and rst3 settings as Leo itself. --no-settings skips
+reading them, which starts the bridge faster.
+'''
+
+#@+<< imports >>
+#@+node:ekr.20140219061533.16764: ** << imports >> (leoBatch.py)
+import leo.core.leoBridge as leoBridge
+
+import json
+import optparse
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+#@-<< imports >>
+
+# Do not define g here.  Use the g returned by the bridge.
+
+default_socket_name = os.path.expanduser('~/.leo/leobatch_sockname')
+
+# The bridge for this process: one per worker process.
+gBridge = None
+
+#@+others
+#@+node:ekr.20140219061533.16765: ** main
+def main ():
+
+    options = scanOptions()
+    if options.send:
+        print(send(options.send,options.socket))
+    elif options.serve:
+        serve(options)
+    elif options.manifest:
+        jobs = readManifest(options.manifest)
+        results = runJobs(jobs,options)
+        report(results)
+    else:
+        print('nothing to do: use --manifest, --serve or --send')
+#@+node:ekr.20140219061533.16766: ** Jobs
+#@+node:ekr.20140219061533.16767: *3* initBridge
+def initBridge (readSettings=True):
+
+    '''Create this process's bridge, if it does not already exist.'''
+
+    global gBridge
+    if not gBridge:
+        gBridge = leoBridge.controller(gui='nullGui',
+            loadPlugins=False,readSettings=readSettings,
+            silent=True,verbose=False)
+    return gBridge
+#@+node:ekr.20140219061533.16768: *3* parseJob
+def parseJob (line):
+
+    '''Return (command,path) for one line of a manifest, or None.'''
+
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    aList = line.split(None,1)
+    if len(aList) == 2 and aList[0] in commandsDict:
+        return aList[0],aList[1].strip()
+    else:
+        return 'write-all',line
+#@+node:ekr.20140219061533.16769: *3* readManifest
+def readManifest (fn):
+
+    '''Return the list of jobs (command,path) in the manifest file fn.'''
+
+    f = open(fn)
+    try:
+        return [z for z in [parseJob(s) for s in f.readlines()] if z]
+    finally:
+        f.close()
+#@+node:ekr.20140219061533.16770: *3* runJob
+def runJob (job):
+
+    '''
+    Run one job, a tuple (command,path).
+
+    Return a dict describing the results and timings of the job.
+    '''
+
+    command,path = job
+    result = {'command':command,'path':path,'ok':False,'pid':os.getpid()}
+    bridge = initBridge()
+    g = bridge.globals()
+    func = commandsDict.get(command)
+    if not func:
+        result['error'] = 'unknown command: %s' % command
+        return result
+    if not g.os_path_exists(path):
+        result['error'] = 'file not found: %s' % path
+        return result
+    c = None
+    t1 = t2 = time.time()
+    try:
+        c = bridge.openLeoFile(path)
+        t2 = time.time()
+        func(c)
+        result['nodes'] = len(list(c.all_unique_nodes()))
+        result['ok'] = True
+    except Exception:
+        result['error'] = traceback.format_exc()
+    t3 = time.time()
+    if c:
+        # Don't prompt for saves: jobs never change the outline itself.
+        c.setChanged(False)
+        g.app.destroyWindow(c.frame)
+    t4 = time.time()
+    result['open'] = t2-t1
+    result['run'] = t3-t2
+    result['close'] = t4-t3
+    result['total'] = t4-t1
+    return result
+#@+node:ekr.20140219061533.16771: *3* runJobs
+def runJobs (jobs,options):
+
+    '''Run all jobs, in worker processes if options.workers > 1.'''
+
+    n = options.workers
+    if n > 1 and multiprocessing and len(jobs) > 1:
+        pool = multiprocessing.Pool(n,initBridge,(options.readSettings,))
+        try:
+            return pool.map(runJob,jobs,chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        initBridge(options.readSettings)
+        return [runJob(job) for job in jobs]
+#@+node:ekr.20140219061533.16772: *3* commands
+def readCommand (c):
+    pass # Opening the outline is the job.
+
+def rstCommand (c):
+    c.rstCommands.rst3()
+
+def tangleCommand (c):
+    c.tangleCommands.tangleAll()
+
+def writeAllCommand (c):
+    # Force the write of all @<file> nodes.
+    at = c.atFileCommands
+    for p in c.rootPosition().self_and_siblings():
+        c.selectPosition(p)
+        at.writeAll(writeAtFileNodesFlag=True)
+
+def writeDirtyCommand (c):
+    c.atFileCommands.writeAll(writeDirtyAtFileNodesFlag=True)
+
+# Keys are job commands, values are functions f(c).
+commandsDict = {
+    'read': readCommand,
+    'rst': rstCommand,
+    'tangle': tangleCommand,
+    'write-all': writeAllCommand,
+    'write-dirty': writeDirtyCommand,
+}
+#@+node:ekr.20140219061533.16773: ** report & helper
+def report (results):
+
+    '''Print the results of jobs and a summary of their throughput.'''
+
+    for result in results:
+        print(formatResult(result))
+    ok = [z for z in results if z.get('ok')]
+    total = sum([z.get('total',0) for z in results])
+    nodes = sum([z.get('nodes',0) for z in ok])
+    print('%s jobs, %s failed. job time: %5.2f sec, %5.2f jobs/sec, %d nodes/sec' % (
+        len(results),len(results)-len(ok),total,
+        len(results)/total if total else 0,
+        nodes/total if total else 0))
+#@+node:ekr.20140219061533.16774: *3* formatResult
+def formatResult (result):
+
+    '''Return a one-line summary of a job's result.'''
+
+    if result.get('ok'):
+        return '%-11s open %5.2f run %5.2f close %5.2f sec %6d nodes %s' % (
+            result['command'],result['open'],result['run'],result['close'],
+            result['nodes'],result['path'])
+    else:
+        return '%-11s FAILED %s\n%s' % (
+            result['command'],result['path'],result.get('error',''))
+#@+node:ekr.20140219061533.16775: ** Server
+#@+node:ekr.20140219061533.16776: *3* send
+def send (line,socketName=None):
+
+    '''Send one job to a running server and return the server's reply.'''
+
+    sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    try:
+        sock.connect(socketName or default_socket_name)
+        f = sock.makefile('rw')
+        f.write(line.strip() + '\n')
+        f.flush()
+        return f.readline().rstrip('\n')
+    finally:
+        sock.close()
+#@+node:ekr.20140219061533.16777: *3* serve
+def serve (options):
+
+    '''
+    Run jobs sent to a local socket, one job per line.
+
+    Each connection is handled in its own thread, so the worker processes
+    run jobs from several clients at once. Without worker processes, jobs
+    run one at a time in this process.
+
+    The reply to each job is one line: the job's result as json.
+    The reply to 'stats' is a summary of all jobs run so far.
+    The server exits when it receives 'quit', after replying to all jobs.
+    '''
+
+    fn = options.socket or default_socket_name
+    if os.path.exists(fn):
+        os.remove(fn)
+    server = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    server.bind(fn)
+    server.listen(5)
+    server.settimeout(0.5) # Check for 'quit' twice a second.
+    if options.workers > 1 and multiprocessing:
+        # Pool workers are daemonic processes, so the tangle and rst
+        # commands don't start worker processes of their own.
+        pool = multiprocessing.Pool(options.workers,initBridge,(options.readSettings,))
+    else:
+        pool = None
+        initBridge(options.readSettings) # Start the bridge now, not for the first job.
+    bridgeLock = threading.Lock() # Protects this process's bridge.
+    lock = threading.Lock() # Protects results.
+    quit = threading.Event()
+    results = []
+
+    def handle (conn):
+
+        '''Reply to the one line sent on conn.'''
+
+        try:
+            f = conn.makefile('rw')
+            line = f.readline().strip()
+            if line == 'quit':
+                quit.set()
+                f.write('bye\n')
+                f.flush()
+                return
+            elif line == 'stats':
+                lock.acquire()
+                try:
+                    reply = summarize(results)
+                finally:
+                    lock.release()
+            else:
+                job = parseJob(line)
+                if not job:
+                    reply = {'ok':False,'error':'no job: %r' % line}
+                elif pool:
+                    reply = pool.apply_async(runJob,(job,)).get()
+                else:
+                    bridgeLock.acquire()
+                    try:
+                        reply = runJob(job)
+                    finally:
+                        bridgeLock.release()
+                if job:
+                    lock.acquire()
+                    try:
+                        results.append(reply)
+                    finally:
+                        lock.release()
+            f.write(json.dumps(reply) + '\n')
+            f.flush()
+        except Exception:
+            traceback.print_exc()
+        finally:
+            conn.close()
+
+    print('leoBatch: serving on %s' % fn)
+    threads = []
+    try:
+        while not quit.is_set():
+            try:
+                conn,addr = server.accept()
+            except socket.timeout:
+                continue
+            conn.settimeout(None)
+            t = threading.Thread(target=handle,args=(conn,))
+            t.daemon = True
+            t.start()
+            threads = [z for z in threads if z.is_alive()]
+            threads.append(t)
+        for t in threads:
+            t.join()
+    finally:
+        server.close()
+        os.remove(fn)
+        if pool:
+            pool.close()
+            pool.join()
+#@+node:ekr.20140219061533.16778: *3* summarize
+def summarize (results):
+
+    '''Return a dict summarizing the throughput of all results.'''
+
+    ok = [z for z in results if z.get('ok')]
+    total = sum([z.get('total',0) for z in results])
+    d = {'jobs':len(results),'failed':len(results)-len(ok),'total':total}
+    for key in ('open','run','close'):
+        d[key] = sum([z.get(key,0) for z in ok])
+    d['jobs_per_sec'] = len(results)/total if total else 0
+    return d
+#@+node:ekr.20140219061533.16779: ** scanOptions
+def scanOptions():
+
+    '''Handle all options and remove them from sys.argv.'''
+
+    parser = optparse.OptionParser()
+    parser.add_option('--manifest',dest='manifest',
+        help='a file containing jobs, one per line')
+    parser.add_option('--no-settings',action='store_false',dest='readSettings',
+        default=True,
+        help="don't read leoSettings.leo and myLeoSettings.leo")
+    parser.add_option('--read-settings',action='store_true',dest='readSettings',
+        help='read leoSettings.leo and myLeoSettings.leo (the default)')
+    parser.add_option('--send',dest='send',
+        help='send a job to a running server')
+    parser.add_option('--serve',action='store_true',dest='serve',
+        help='run jobs sent to a local socket')
+    parser.add_option('--socket',dest='socket',
+        help='the name of the socket (default: %s)' % default_socket_name)
+    parser.add_option('--workers',dest='workers',type='int',default=1,
+        help='the number of worker processes')
+
+    # Parse the options, and remove them from sys.argv.
+    options, args = parser.parse_args()
+    sys.argv = [sys.argv[0]] ; sys.argv.extend(args)
+    return options
+#@-others
+
+if __name__ == '__main__':
+    main()
+#@-leo
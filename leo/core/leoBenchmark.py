@@ -0,0 +1,372 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20140219061533.16720: * @file leoBenchmark.py
+'''
+A program to measure the speed of Leo's core using the leoBridge module.
+
+Usage: python leoBenchmark.py --benchmark=<name> [options]
+
+--benchmark=keys  Replay keystrokes through k.masterKeyHandler in the body
+                  of a null-gui commander and report per-keystroke latency.
+
+--benchmark=ua    Write a generated outline containing many uA's with the
+                  hexlified and the compact uA encodings. Report the size
+                  of the outline and the time to read it in each encoding.
+
+--benchmark=organizers
+                  Recreate the organizer nodes of a generated @auto tree
+                  (20,000 nodes by default) from its @organizers node
+                  (1,000 @organizer: nodes by default), as happens after
+                  reading the @auto file. Report the time of each phase.
+
+--benchmark=http  Serve the outline with mod_http's threaded server and
+                  request its pages from several client threads, each using
+                  a keep-alive connection. Report the latency and throughput
+                  of first requests, cached requests and revalidations.
+'''
+
+#@+<< imports >>
+#@+node:ekr.20140219061533.16721: ** << imports >> (leoBenchmark.py)
+import leo.core.leoBridge as leoBridge
+
+import optparse
+import sys
+import threading
+import time
+
+try:
+    import http.client as httplib # Python 3
+except ImportError:
+    import httplib # Python 2
+#@-<< imports >>
+
+# Do not define g here.  Use the g returned by the bridge.
+
+#@+others
+#@+node:ekr.20140219061533.16722: ** main
+def main ():
+
+    options = scanOptions()
+    func = benchmarksDict.get(options.benchmark)
+    if not func:
+        print('unknown benchmark: %s. Use one of: %s' % (
+            options.benchmark,', '.join(sorted(benchmarksDict.keys()))))
+        return
+    bridge = leoBridge.controller(gui='nullGui',
+        loadPlugins=False,readSettings=options.readSettings,
+        silent=True,verbose=False)
+    if bridge.isOpen():
+        g = bridge.globals()
+        path = options.path or g.os_path_finalize_join(
+            g.app.loadDir,'..','test','unitTest.leo')
+        c = bridge.openLeoFile(path)
+        func(c,g,options)
+#@+node:ekr.20140219061533.16723: ** benchmarks
+#@+node:ekr.20140219061533.16724: *3* benchmark_keys & helpers
+def benchmark_keys (c,g,options):
+
+    '''Replay a keystroke stream through k.masterKeyHandler.'''
+
+    k = c.k
+    settings = read_strokes(options.strokes) if options.strokes else default_strokes()
+    data = [(char_for_setting(z),k.strokeFromSetting(z)) for z in settings]
+    w = c.frame.body.bodyCtrl
+    times = []
+    for n in range(options.repeat):
+        # Type into an empty node at the end of the outline.
+        p = c.lastTopLevel().insertAfter()
+        p.h = 'leoBenchmark keys'
+        c.selectPosition(p)
+        for char,stroke in data:
+            event = g.app.gui.create_key_event(c,char,stroke.s,w)
+            t1 = time.time()
+            k.masterKeyHandler(event)
+            c.outerUpdate()
+            times.append(time.time()-t1)
+        p.doDelete()
+    c.setChanged(False)
+    report('keys',times)
+#@+node:ekr.20140219061533.16725: *4* char_for_setting
+def char_for_setting (setting):
+
+    '''Return the char a gui would report for the key setting.'''
+
+    if len(setting) == 1:
+        return setting
+    return {
+        'BackSpace':'\b',
+        'Return':'\n',
+        'Tab':'\t',
+        'space':' ',
+    }.get(setting,'')
+#@+node:ekr.20140219061533.16726: *4* default_strokes
+def default_strokes ():
+
+    '''Return a list of key settings simulating typing and navigation.'''
+
+    line = 'def spam(self,a,b): return a + b'
+    result = []
+    for i in range(20):
+        result.extend(['space' if ch == ' ' else ch for ch in line])
+        result.append('Return')
+        result.extend(['BackSpace']*3)
+        result.extend(['Left','Left','Right','Right','Up','Down','Home','End'])
+        result.append('Return')
+    return result
+#@+node:ekr.20140219061533.16727: *4* read_strokes
+def read_strokes (fn):
+
+    '''
+    Return the list of key settings in file fn.
+
+    The file contains one setting per line, written as in @shortcuts nodes:
+    a, Ctrl-f, Return, Shift-Tab, etc. Lines starting with '#' are ignored.
+    '''
+
+    f = open(fn)
+    try:
+        return [z.strip() for z in f.readlines()
+            if z.strip() and not z.startswith('#')]
+    finally:
+        f.close()
+#@+node:ekr.20140219061533.16887: *3* benchmark_organizers & helper
+def benchmark_organizers (c,g,options):
+
+    '''Time the phases of vc.create_organizer_nodes for a generated @auto tree.'''
+
+    vc = c.viewController
+    times = {'precompute':[],'demote':[],'move_nodes':[],'total':[]}
+    for n in range(options.repeat):
+        root = c.lastTopLevel().insertAfter()
+        root.h = '@auto leoBenchmark_organizers.py'
+        make_organizers_tree(vc,root,options.nodes or 20000,options.organizers)
+        at_organizers = vc.has_at_organizers_node(root)
+        organizers = at_organizers.numberOfChildren()
+        vc.init()
+        vc.root = root.copy()
+        t1 = time.time()
+        vc.precompute_all_data(at_organizers,root)
+        t2 = time.time()
+        vc.demote(root)
+        t3 = time.time()
+        vc.move_nodes()
+        t4 = time.time()
+        moved = len(vc.work_list)
+        times['precompute'].append(t2-t1)
+        times['demote'].append(t3-t2)
+        times['move_nodes'].append(t4-t3)
+        times['total'].append(t4-t1)
+        root.doDelete()
+        vc.has_at_views_node().doDelete()
+    print('%s organizers, %s nodes moved' % (organizers,moved))
+    for name in ('precompute','demote','move_nodes','total'):
+        report(name,times[name])
+    c.setChanged(False)
+#@+node:ekr.20140219061533.16888: *4* make_organizers_tree
+def make_organizers_tree (vc,root,n,n_organizers):
+
+    '''
+    Create an imported tree of about n nodes in root, an @auto node, and the
+    @organizers node describing n_organizers organizers of that tree.
+    '''
+
+    n_classes = max(1,n_organizers//10)
+    n_methods = max(20,n//n_classes)
+    per_organizer = n_methods // 20 # Organize half of the methods.
+    at_organizers = vc.find_at_organizers_node(root)
+    for i in range(n_classes):
+        p = root.insertAsLastChild()
+        p.h = 'class C%s' % i
+        p.b = 'class C%s:\n    @others\n' % i
+        for j in range(n_methods):
+            child = p.insertAsLastChild()
+            child.h = 'm%s' % j
+            child.b = 'def m%s(self):\n    pass\n' % j
+        for j in range(10):
+            h = 'organizer %s.%s' % (i,j)
+            organizer = at_organizers.insertAsLastChild()
+            organizer.h = '@organizer: %s' % h
+            first = 2 * j * per_organizer
+            organizer.b = '\n'.join(['unl: %s-->%s-->m%s' % (p.h,h,k)
+                for k in range(first,first+per_organizer)])
+#@+node:ekr.20140219061533.16934: *3* benchmark_http & helper
+def benchmark_http (c,g,options):
+
+    '''Measure the throughput of mod_http's threaded server.'''
+
+    import leo.plugins.mod_http as mod_http
+    server = mod_http.ThreadedServer('127.0.0.1',0)
+    # The bridge does not add its frames to the window list.
+    server.refresh(c)
+    server.start()
+    try:
+        port = server.server_address[1]
+        paths = ['/']
+        for window in server.windows:
+            paths.append('/' + window.fileName)
+            nodes = list(window.roots)
+            while nodes:
+                node = nodes.pop(0)
+                paths.append('/' + '/'.join([window.fileName] + node.nameparts()))
+                nodes.extend(node.children)
+        if options.nodes:
+            paths = paths[:options.nodes]
+        print('%s pages, %s clients' % (len(paths),options.clients))
+        # The first requests render the pages.
+        times,elapsed,etags = http_load(port,paths,options.clients)
+        report('first requests (%d/sec)' % (len(times)/elapsed),times)
+        # Later requests get the pages from the cache.
+        times,elapsed,etags = http_load(port,paths*options.repeat,options.clients)
+        report('cached requests (%d/sec)' % (len(times)/elapsed),times)
+        # Revalidations get empty 304 replies.
+        times,elapsed,etags = http_load(port,paths*options.repeat,options.clients,etags)
+        report('revalidations (%d/sec)' % (len(times)/elapsed),times)
+    finally:
+        server.shutdown()
+        server.server_close()
+#@+node:ekr.20140219061533.16935: *4* http_load
+def http_load (port,paths,clients,etags=None):
+
+    '''
+    Request all paths from the server on port, using n client threads, each
+    with its own keep-alive connection. If etags is given, send the etag of
+    each path in an If-None-Match header.
+
+    Return (times,elapsed,etags): the latencies of all requests, the total
+    time, and a dict giving the etag of each path.
+    '''
+
+    times,errors,result = [],[],{}
+    def client(paths):
+        conn = httplib.HTTPConnection('127.0.0.1',port)
+        try:
+            for path in paths:
+                headers = {'If-None-Match':etags[path]} if etags and etags.get(path) else {}
+                t = time.time()
+                conn.request('GET',path,headers=headers)
+                response = conn.getresponse()
+                response.read()
+                times.append(time.time()-t)
+                if response.status in (200,304):
+                    result[path] = response.getheader('ETag')
+                else:
+                    errors.append('%s %s' % (response.status,path))
+        finally:
+            conn.close()
+    threads = [threading.Thread(target=client,args=(paths[i::clients],))
+        for i in range(clients)]
+    t1 = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time()-t1
+    for s in errors[:10]:
+        print('error: %s' % s)
+    return times,elapsed,result
+#@+node:ekr.20140219061533.16843: *3* benchmark_ua & helper
+def benchmark_ua (c,g,options):
+
+    '''Compare the hexlified and compact encodings of uA's.'''
+
+    fc = c.fileCommands
+    root = c.lastTopLevel().insertAfter()
+    root.h = 'leoBenchmark ua'
+    make_ua_tree(root,options.nodes or 10000)
+    for compact in (False,True):
+        name = 'compact' if compact else 'hex'
+        c.config.set(None,'bool','compact_unknown_attributes',compact)
+        c.selectPosition(root)
+        t1 = time.time()
+        s = fc.putLeoOutline()
+        t2 = time.time()
+        times = []
+        for n in range(options.repeat):
+            c.selectPosition(root)
+            t = time.time()
+            p = fc.getLeoOutlineFromClipboard(s,reassignIndices=True)
+            times.append(time.time()-t)
+            p.doDelete()
+        print('%s: %s bytes, written in %5.2f sec.' % (name,len(s),t2-t1))
+        report('%s read' % name,times)
+    root.doDelete()
+    c.setChanged(False)
+#@+node:ekr.20140219061533.16844: *4* make_ua_tree
+def make_ua_tree (root,n):
+
+    '''Create n children of root with uA's like those written by plugins.'''
+
+    icons = [{
+        'file':'Icons/Tango/16x16/actions/add.png',
+        'on':'vnode',
+        'relPath':'Tango/16x16/actions/add.png',
+        'type':'file',
+        'where':'beforeHeadline',
+        'xoffset':2,'xpad':1,'yoffset':0,
+    }]
+    for i in range(n):
+        p = root.insertAsLastChild()
+        p.h = 'node %s' % i
+        p.b = 'body %s\n' % i
+        p.v.u = {
+            # The todo, backlink and icon plugins.
+            'annotate':{'priority':i % 10,'duedate':'2014-02-%02d' % (1 + i % 28)},
+            '_bklnk':{'links':[('S','ekr.20140219061533.%s' % j) for j in range(i % 5)]},
+            'icons':icons,
+        }
+#@+node:ekr.20140219061533.16728: ** report
+def report (name,times):
+
+    '''Print statistics about a list of timings, in seconds.'''
+
+    if not times:
+        print('%s: no data' % name)
+        return
+    times = sorted(times)
+    n = len(times)
+    def ms(t):
+        return '%7.3f' % (1000.0*t)
+    print('%s: %s samples, total %s sec.' % (name,n,'%5.2f' % sum(times)))
+    print('  mean   %s ms' % ms(sum(times)/n))
+    print('  median %s ms' % ms(times[n//2]))
+    print('  95%%    %s ms' % ms(times[min(n-1,int(n*0.95))]))
+    print('  max    %s ms' % ms(times[-1]))
+#@+node:ekr.20140219061533.16729: ** scanOptions
+def scanOptions():
+
+    '''Handle all options and remove them from sys.argv.'''
+
+    parser = optparse.OptionParser()
+    parser.add_option('--benchmark',dest='benchmark',default='keys',
+        help='the benchmark to run')
+    parser.add_option('--clients',dest='clients',type='int',default=8,
+        help='http: the number of client threads')
+    parser.add_option('--nodes',dest='nodes',type='int',
+        help='organizers, ua: the number of generated nodes. http: the number of pages')
+    parser.add_option('--organizers',dest='organizers',type='int',default=1000,
+        help='organizers: the number of generated organizers')
+    parser.add_option('--path',dest='path',
+        help='the outline to open (default: unitTest.leo)')
+    parser.add_option('--read-settings',action='store_true',dest='readSettings',
+        help='read leoSettings.leo and myLeoSettings.leo')
+    parser.add_option('--repeat',dest='repeat',type='int',default=5,
+        help='the number of times to repeat the benchmark')
+    parser.add_option('--strokes',dest='strokes',
+        help='keys: a file containing recorded keystrokes')
+
+    # Parse the options, and remove them from sys.argv.
+    options, args = parser.parse_args()
+    sys.argv = [sys.argv[0]] ; sys.argv.extend(args)
+    return options
+#@-others
+
+# Keys are benchmark names, values are functions f(c,g,options).
+benchmarksDict = {
+    'http': benchmark_http,
+    'keys': benchmark_keys,
+    'organizers': benchmark_organizers,
+    'ua': benchmark_ua,
+}
+
+if __name__ == '__main__':
+    main()
+#@-leo
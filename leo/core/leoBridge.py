@@ -143,6 +143,7 @@ class bridgeController:
         if not self.getLeoID(): return
         g.app.inBridge = True # Added 2007/10/21: support for g.getScript.
         g.app.nodeIndices = leoNodes.nodeIndices(g.app.leoID)
+        g.app.gnxIndex = leoNodes.gnxIndex()
         g.app.config = leoConfig.GlobalConfigManager()
 
         if self.readSettings:
@@ -165,6 +166,7 @@ class bridgeController:
             def dummyDoHook(tag,*args,**keys):
                 pass
             g.doHook = dummyDoHook
+            g.app.enableHooks = False
         g.doHook("start1") # Load plugins.
         g.app.computeSignon()
         g.app.initing = False
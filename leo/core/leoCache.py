@@ -172,6 +172,7 @@ class cacher:
         if h is not None:
             v = parent_v
             v._headString = h    
+            c.headlineVersion += 1 # Invalidate c.unlCache.
             v._bodyString = b
 
         for z in children:
@@ -0,0 +1,187 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20140219061533.16865: * @file leoCommandStats.py
+'''
+Statistics about the commands executed by c.doCommand.
+
+c.commandStats is None unless @bool record_command_stats = True, or the
+toggle-command-stats command has enabled it. When enabled, c.doCommand
+records the following for each command:
+
+- the elapsed (wall clock) time,
+- the number of full redraws of the outline and the number of nodes drawn,
+- the number of characters examined by the colorizers of all body editors,
+- the number of characters added to the undo beads.
+
+The most recent records are kept in a ring buffer. The totals and a
+histogram of elapsed times are kept for each command name.
+
+The print-command-stats command prints the statistics.
+The write-command-stats command writes them to a json file.
+'''
+
+#@@language python
+#@@tabwidth -4
+#@@pagewidth 70
+
+import leo.core.leoGlobals as g
+
+import collections
+import json
+import time
+
+#@+others
+#@+node:ekr.20140219061533.16866: ** class CommandStats
+class CommandStats:
+    '''Record the costs of all commands executed by c.doCommand.'''
+    #@+others
+    #@+node:ekr.20140219061533.16867: *3*  stats.ctor
+    # The upper bounds of the histogram's buckets, in milliseconds.
+    bounds = (1,2,5,10,20,50,100,200,500,1000,2000,5000)
+
+    # The fields of each record, after the command name.
+    fields = ('time','redraws','nodes','chars','undo')
+
+    def __init__ (self,c,size=1000):
+
+        self.c = c
+        self.recent = collections.deque(maxlen=size)
+            # A ring buffer of the most recent records.
+        self.commandsDict = {}
+            # Keys are command names; values are dicts of totals.
+    #@+node:ekr.20140219061533.16868: *3* stats.start & finish
+    def start (self):
+
+        '''Return a snapshot of all counters before a command executes.'''
+
+        return (time.time(),) + self.counters() + self.undoSnapshot()
+
+    def finish (self,commandName,snapshot):
+
+        '''Record the costs of a command that started at snapshot.'''
+
+        t2 = time.time()
+        t1,redraws,nodes,chars,bead,size = snapshot
+        redraws2,nodes2,chars2 = self.counters()
+        record = (commandName or '<no name>',
+            t2-t1,
+            max(0,redraws2-redraws),
+            max(0,nodes2-nodes),
+            max(0,chars2-chars),
+            max(0,self.undoSize(bead)-size))
+        self.recent.append(record)
+        self.addToTotals(record)
+    #@+node:ekr.20140219061533.16869: *3* stats.addToTotals
+    def addToTotals (self,record):
+
+        name = record[0]
+        d = self.commandsDict.get(name)
+        if not d:
+            d = {'count':0,'max':0.0,'histogram':[0]*(len(self.bounds)+1)}
+            for field in self.fields:
+                d[field] = 0
+            self.commandsDict[name] = d
+        d['count'] += 1
+        for field,val in zip(self.fields,record[1:]):
+            d[field] += val
+        elapsed = record[1]
+        d['max'] = max(d['max'],elapsed)
+        ms = 1000.0 * elapsed
+        i = 0
+        while i < len(self.bounds) and ms >= self.bounds[i]:
+            i += 1
+        d['histogram'][i] += 1
+    #@+node:ekr.20140219061533.16870: *3* stats.counters
+    def counters (self):
+
+        '''Return the totals (redraws,nodes,chars) of the tree and the colorizers.'''
+
+        c = self.c
+        frame = c.frame
+        tree = frame and getattr(frame,'tree',None)
+        body = frame and getattr(frame,'body',None)
+        return (
+            getattr(tree,'redrawCount',0),
+            getattr(tree,'totalNodeDrawCount',0),
+            getattr(body,'totalChars',0))
+    #@+node:ekr.20140219061533.16871: *3* stats.undoSnapshot & undoSize
+    def undoSnapshot (self):
+
+        '''Return (bead,size) describing the present undo bead.'''
+
+        bead = self.c.undoer.bead
+        return bead,self.undoSize(bead)
+
+    def undoSize (self,bead):
+
+        '''Return the number of characters in all undo beads from bead on.'''
+
+        u = self.c.undoer
+        if bead > u.bead:
+            return 0 # Undo or redo.
+        n = 0
+        for bunch in u.beads[max(0,bead):u.bead+1]:
+            n += self.beadSize(bunch)
+        return n
+
+    def beadSize (self,bunch):
+
+        n = 0
+        for val in bunch.__dict__.values():
+            if g.isString(val):
+                n += len(val)
+            elif isinstance(val,list):
+                # The items of a group.
+                for z in val:
+                    if isinstance(z,g.Bunch):
+                        n += self.beadSize(z)
+        return n
+    #@+node:ekr.20140219061533.16872: *3* stats.print_stats
+    def print_stats (self):
+
+        '''Print the totals and histograms of all commands, slowest first.'''
+
+        def ms(t):
+            return '%8.1f' % (1000.0*t)
+
+        aList = sorted(self.commandsDict.items(),key=lambda z: -z[1]['time'])
+        print('\n%-32s %6s %8s %8s %8s %7s %7s %9s %9s' % (
+            'command','count','total ms','mean ms','max ms',
+            'redraws','nodes','chars','undo'))
+        for name,d in aList:
+            print('%-32s %6s %s %s %s %7s %7s %9s %9s' % (
+                name[:32],d['count'],ms(d['time']),ms(d['time']/d['count']),
+                ms(d['max']),d['redraws'],d['nodes'],d['chars'],d['undo']))
+        print('\nhistograms (ms)...')
+        labels = ['<%s' % z for z in self.bounds] + ['>=%s' % self.bounds[-1]]
+        for name,d in aList:
+            print('%-32s %s' % (name[:32],' '.join(['%s:%s' % (label,n)
+                for label,n in zip(labels,d['histogram']) if n])))
+        print('\n%s commands recorded, %s recent records' % (
+            sum([d['count'] for d in self.commandsDict.values()]),
+            len(self.recent)))
+    #@+node:ekr.20140219061533.16873: *3* stats.toJson & write
+    def toJson (self):
+
+        '''Return a json string describing all statistics.'''
+
+        fields = ('command',) + self.fields
+        return json.dumps({
+            'bounds': list(self.bounds),
+            'commands': self.commandsDict,
+            'recent': [dict(zip(fields,z)) for z in self.recent],
+        },sort_keys=True,indent=1)
+
+    def write (self,fn=None):
+
+        '''Write the json statistics to fn, by default ~/.leo/command_stats.json.'''
+
+        fn = fn or g.os_path_finalize_join(g.app.homeLeoDir,'command_stats.json')
+        f = open(fn,'w')
+        try:
+            f.write(self.toJson())
+        finally:
+            f.close()
+        return fn
+    #@-others
+#@-others
+#@-leo
@@ -168,6 +168,8 @@ class Commands (object):
             # The expansion level of this outline.
         self.expansionNode = None
             # The last node we expanded or contracted.
+        self.headlineVersion = 0
+            # Incremented whenever v.setHeadString changes a headline.
         self.nodeConflictList = []
             # List of nodes with conflicting read-time data.
         self.nodeConflictFileName = None
@@ -279,6 +281,7 @@ class Commands (object):
             print('g.initObjects %s %s' % (c.shortFileName(),g.app.gui))
         self.hiddenRootNode = leoNodes.vnode(context=c)
         self.hiddenRootNode.setHeadString('<hidden root vnode>')
+        self.unlCache = leoNodes.unlCache(c)
         # Create the gui frame.
         title = c.computeWindowTitle(c.mFileName)
         if not g.app.initing:
@@ -347,6 +350,7 @@ class Commands (object):
             # Will be None for nullGui.
         # This costs little.
         c.commandsDict = c.editCommandsManager.finishCreateEditCommanders()
+        k.invalidateCommandNames()
         self.rstCommands.finishCreate()
         # copy global commands to this controller    
         for name,f in g.app.global_commands_dict.items():
@@ -470,6 +474,9 @@ class Commands (object):
         c.use_focus_border          = getBool('use_focus_border',default=True)
         c.vim_mode                  = getBool('vim_mode',default=False)
         c.write_script_file         = getBool('write_script_file')
+        if getBool('record_command_stats',default=False) and not c.commandStats:
+            import leo.core.leoCommandStats as leoCommandStats
+            c.commandStats = leoCommandStats.CommandStats(c)
 
         # g.trace('smart %s, tab_width %s' % (c.smart_tab, c.tab_width))
         # g.trace(c.sparse_move)
@@ -492,6 +499,7 @@ class Commands (object):
             c.windowPosition = 500,700,50,50 # width,height,left,top.
     #@+node:ekr.20031218072017.2817: *3*  c.doCommand
     command_count = 0
+    commandStats = None # A leoCommandStats.CommandStats instance, or None.
 
     def doCommand (self,command,label,event=None):
 
@@ -528,6 +536,9 @@ class Commands (object):
             if label == "cantundo": label = "undo"
             g.app.commandName = label
 
+        stats = c.commandStats
+        snapshot = stats and stats.start()
+
         if not g.doHook("command1",c=c,p=p,v=p,label=label):
             try:
                 c.inCommand = True
@@ -555,6 +566,9 @@ class Commands (object):
                     if trace: g.trace('calling outerUpdate')
                     c.outerUpdate()
 
+        if snapshot:
+            stats.finish(label or commandName,snapshot)
+
         # Be careful: the command could destroy c.
         if c and c.exists:
             p = c.p
@@ -3214,7 +3228,7 @@ class Commands (object):
 
         d = c.scanAllDirectives()
         tabWidth  = d.get("tabwidth")
-        count = 0 ; dirtyVnodeList = []
+        count = 0 ; dirtyVnodeList = [] ; changedVnodes = []
         u.beforeChangeGroup(current,undoType)
         for p in current.self_and_subtree():
             # g.trace(p.h,tabWidth)
@@ -3236,11 +3250,16 @@ class Commands (object):
                     result.append(s)
                 if changed:
                     count += 1
-                    dirtyVnodeList2 = p.setDirty()
-                    dirtyVnodeList.extend(dirtyVnodeList2)
+                    # Mark ancestors dirty once, after the loop.
+                    if not p.v.isDirty():
+                        p.v.setDirty()
+                        dirtyVnodeList.append(p.v)
+                    changedVnodes.append(p.v)
                     result = '\n'.join(result)
                     p.setBodyString(result)
                     u.afterChangeNodeContents(p,undoType,innerUndoData)
+        dirtyVnodeList.extend(c.setAllAncestorAtFileNodesDirtyInList(
+            changedVnodes,setDescendentsDirty=True))
         u.afterChangeGroup(current,undoType,dirtyVnodeList=dirtyVnodeList)
         if not g.unitTesting:
             g.es("blanks converted to tabs in",count,"nodes")
@@ -3260,7 +3279,7 @@ class Commands (object):
             return
         theDict = c.scanAllDirectives()
         tabWidth  = theDict.get("tabwidth")
-        count = 0 ; dirtyVnodeList = []
+        count = 0 ; dirtyVnodeList = [] ; changedVnodes = []
         u.beforeChangeGroup(current,undoType)
         for p in current.self_and_subtree():
             undoData = u.beforeChangeNodeContents(p)
@@ -3281,11 +3300,16 @@ class Commands (object):
                     result.append(s)
                 if changed:
                     count += 1
-                    dirtyVnodeList2 = p.setDirty()
-                    dirtyVnodeList.extend(dirtyVnodeList2)
+                    # Mark ancestors dirty once, after the loop.
+                    if not p.v.isDirty():
+                        p.v.setDirty()
+                        dirtyVnodeList.append(p.v)
+                    changedVnodes.append(p.v)
                     result = '\n'.join(result)
                     p.setBodyString(result)
                     u.afterChangeNodeContents(p,undoType,undoData)
+        dirtyVnodeList.extend(c.setAllAncestorAtFileNodesDirtyInList(
+            changedVnodes,setDescendentsDirty=True))
         u.afterChangeGroup(current,undoType,dirtyVnodeList=dirtyVnodeList)
         if not g.unitTesting:
             g.es("tabs converted to blanks in",count,"nodes")
@@ -4179,9 +4203,8 @@ class Commands (object):
         if pasteAsClone:
             # Set dirty bits for ancestors of *all* pasted nodes.
             # Note: the setDescendentsDirty flag does not do what we want.
-            for p in pasted.self_and_subtree():
-                p.setAllAncestorAtFileNodesDirty(
-                    setDescendentsDirty=False)
+            c.setAllAncestorAtFileNodesDirtyInList(
+                [p.v for p in pasted.self_and_subtree()])
         if undoFlag:
             c.undoer.afterInsertNode(pasted,undoType,undoData)
         if redrawFlag:
@@ -5220,6 +5243,8 @@ class Commands (object):
             current = c.p
 
             if self.changed:
+                self.dirtyVnodeList.extend(c.setAllAncestorAtFileNodesDirtyInList(
+                    self.changedVnodes,setDescendentsDirty=True))
                 # Tag the end of the command.
                 u.afterChangeGroup(current,undoType,dirtyVnodeList=self.dirtyVnodeList)
         #@+node:ekr.20040711135244.8: *8* get
@@ -5477,11 +5502,15 @@ class Commands (object):
                     # Start the group.
                     u.beforeChangeGroup(p,undoType)
                     self.changed = True
+                    self.changedVnodes = []
                     self.dirtyVnodeList = []
                 undoData = u.beforeChangeNodeContents(p)
                 c.setBodyString(p,body)
-                dirtyVnodeList2 = p.setDirty()
-                self.dirtyVnodeList.extend(dirtyVnodeList2)
+                # endUndo marks ancestors dirty.
+                if not p.v.isDirty():
+                    p.v.setDirty()
+                    self.dirtyVnodeList.append(p.v)
+                self.changedVnodes.append(p.v)
                 u.afterChangeNodeContents(p,undoType,undoData,dirtyVnodeList=self.dirtyVnodeList)
         #@-others
     #@+node:ekr.20040712053025: *7* prettyPrintAllPythonCode
@@ -6054,13 +6083,19 @@ class Commands (object):
         c = self ; p = c.rootPosition()
 
         c.endEditing()
+        aList = []
         while p:
             if p.isAtFileNode() and not p.isDirty():
-                p.setDirty()
-                c.setChanged(True)
+                aList.append(p.v)
                 p.moveToNodeAfterTree()
             else:
                 p.moveToThreadNext()
+        if aList:
+            for v in aList:
+                v.setDirty()
+            # Like p.setDirty, but visit each ancestor only once.
+            c.setAllAncestorAtFileNodesDirtyInList(aList,setDescendentsDirty=True)
+            c.setChanged(True)
 
         c.redraw_after_icons_changed()
 
@@ -6075,13 +6110,19 @@ class Commands (object):
 
         c.endEditing()
         after = p.nodeAfterTree()
+        aList = []
         while p and p != after:
             if p.isAtFileNode() and not p.isDirty():
-                p.setDirty()
-                c.setChanged(True)
+                aList.append(p.v)
                 p.moveToNodeAfterTree()
             else:
                 p.moveToThreadNext()
+        if aList:
+            for v in aList:
+                v.setDirty()
+            # Like p.setDirty, but visit each ancestor only once.
+            c.setAllAncestorAtFileNodesDirtyInList(aList,setDescendentsDirty=True)
+            c.setChanged(True)
 
         c.redraw_after_icons_changed()
 
@@ -6116,15 +6157,19 @@ class Commands (object):
 
         c.endEditing()
         u.beforeChangeGroup(current,undoType)
-        dirtyVnodeList = []
+        dirtyVnodeList = [] ; aList = []
         for p in current.children():
             if not p.isMarked():
                 bunch = u.beforeMark(p,undoType)
                 c.setMarked(p)
-                dirtyVnodeList2 = p.setDirty()
-                dirtyVnodeList.extend(dirtyVnodeList2)
+                if not p.v.isDirty():
+                    p.v.setDirty()
+                    dirtyVnodeList.append(p.v)
+                aList.append(p.v)
                 c.setChanged(True)
                 u.afterMark(p,undoType,bunch)
+        dirtyVnodeList.extend(c.setAllAncestorAtFileNodesDirtyInList(
+            aList,setDescendentsDirty=True))
         u.afterChangeGroup(current,undoType,dirtyVnodeList=dirtyVnodeList)
 
         c.redraw_after_icons_changed()
@@ -7988,20 +8033,19 @@ class Commands (object):
         assert (c == context)
         positions = []
         for immediate in v.parents:
-            if v in immediate.children:
-                n = immediate.children.index(v)
-            else:
+            n = immediate.indexOfChild(v)
+            if n < 0:
                 continue
             stack = [(v,n)]
             while immediate.parents:
                 parent = immediate.parents[0]
-                if immediate in parent.children:
-                    n = parent.children.index(immediate)
-                else:
+                n = parent.indexOfChild(immediate)
+                if n < 0:
                     break
-                stack.insert(0,(immediate,n),)
+                stack.append((immediate,n),)
                 immediate = parent
             else:
+                stack.reverse()
                 v,n = stack.pop()
                 p = leoNodes.position(v,n,stack)
                 positions.append(p)
@@ -8018,17 +8062,17 @@ class Commands (object):
         stack = []
         while v.parents:
             parent = v.parents[0]
-            if v in parent.children:
-                n = parent.children.index(v)
-            else:
+            n = parent.indexOfChild(v) # Usually O(1).
+            if n < 0:
                 return None
-            stack.insert(0,(v,n),)
+            stack.append((v,n),)
             v = parent
 
         # v.parents includes the hidden root node.
         if not stack:
             # a vnode not in the tree
             return c.nullPosition()
+        stack.reverse()
         v,n = stack.pop()
         p = leoNodes.position(v,n,stack)
         return p
@@ -8066,6 +8110,62 @@ class Commands (object):
         c = self
         p.v.clearMarked()
         g.doHook("clear-mark",c=c,p=p,v=p)
+    #@+node:ekr.20140219061533.16835: *5* c.setAllAncestorAtFileNodesDirtyInList & helper
+    def setAllAncestorAtFileNodesDirtyInList (self,aList,setDescendentsDirty=False):
+
+        '''
+        Mark dirty all @<file> nodes that are in aList, a list of vnodes, or
+        that are ancestors of any vnode in aList. Unlike calling
+        p.setAllAncestorAtFileNodesDirty for each node, this visits each
+        ancestor only once, regardless of clones.
+
+        setDescendentsDirty: also mark @<file> nodes in all subtrees dirty.
+
+        Return the list of vnodes that became dirty.
+        '''
+
+        c = self
+        nodes = c.findAllPotentiallyDirtyNodesInList(aList)
+        if setDescendentsDirty:
+            # Only mark direct descendents of nodes in aList, as in p.setAllAncestorAtFileNodesDirty.
+            # Ancestors may also be descendents of other nodes in aList,
+            # so the descendent walk has its own visited set.
+            inNodes = set(nodes)
+            seen = set()
+            todo = list(aList)
+            while todo:
+                v = todo.pop()
+                for child in v.children:
+                    if child not in seen:
+                        seen.add(child)
+                        todo.append(child)
+                        if child not in inNodes and child.isAnyAtFileNode():
+                            inNodes.add(child)
+                            nodes.append(child)
+        dirtyVnodeList = [v for v in nodes
+            if not v.isDirty() and v.isAnyAtFileNode()]
+        for v in dirtyVnodeList:
+            v.setDirty()
+        return dirtyVnodeList
+    #@+node:ekr.20140219061533.16836: *6* c.findAllPotentiallyDirtyNodesInList
+    def findAllPotentiallyDirtyNodesInList (self,aList):
+
+        '''
+        Return the list of all vnodes in aList and all their ancestors,
+        excluding the hidden root node. Each vnode appears only once.
+        '''
+
+        c = self
+        seen = set([c.hiddenRootNode])
+        nodes = []
+        todo = list(aList)
+        while todo:
+            v = todo.pop()
+            if v not in seen:
+                seen.add(v)
+                nodes.append(v)
+                todo.extend(v.parents)
+        return nodes
     #@+node:ekr.20040305223522: *5* c.setBodyString
     def setBodyString (self,p,s):
 
@@ -8,9 +8,15 @@
 
 import leo.core.leoGlobals as g
 import filecmp
+import hashlib
 import os
 # import string
 
+try:
+    import multiprocessing.pool
+except ImportError:
+    multiprocessing = None
+
 #@+others
 #@+node:ekr.20031218072017.3631: ** choose
 def choose(cond, a, b): # warning: evaluates all arguments
@@ -54,9 +60,42 @@ def go ():
         name1 = "c:\\prog\\test\\compare1.txt"
         name2 = "c:\\prog\\test\\compare2.txt"
         compare.compare_files(name1,name2)
+#@+node:ekr.20140219061533.16899: ** hashFile & hashPair
+# Threads call these functions: they must not touch the gui.
+
+def hashFile (fileName):
+
+    """Return the md5 digest of the file, or None if it can not be read."""
+
+    try:
+        h = hashlib.md5()
+        f = open(fileName,'rb')
+        try:
+            while True:
+                s = f.read(65536)
+                if not s: break
+                h.update(s)
+        finally:
+            f.close()
+        return h.digest()
+    except (IOError,OSError):
+        return None
+
+def hashPair (names):
+
+    """Return the digests of a pair of files, or None if names is None."""
+
+    if names:
+        name1,name2 = names
+        return hashFile(name1),hashFile(name2)
+    else:
+        return None
 #@+node:ekr.20031218072017.3633: ** class leoCompare
 class baseLeoCompare:
     """The base class for Leo's compare code."""
+
+    workers = 8 # The number of threads that hash files in directory compares.
+
     #@+others
     #@+node:ekr.20031218072017.3634: *3* compare.__init__
     # All these ivars are known to the leoComparePanel class.
@@ -84,7 +123,8 @@ class baseLeoCompare:
         printMismatches = True,
         printTrailingMismatches = False,
 
-        outputFileName = None ):
+        outputFileName = None,
+        recursive = False ): # For directory compares.
 
         # It is more convenient for the leoComparePanel to set these directly.
         self.c = commands
@@ -100,6 +140,7 @@ class baseLeoCompare:
 
         self.limitCount = limitCount
         self.limitToExtension = limitToExtension
+        self.recursive = recursive
 
         self.makeWhitespaceVisible = makeWhitespaceVisible
 
@@ -119,6 +160,16 @@ class baseLeoCompare:
 
     def compare_directories (self,path1,path2):
 
+        """Compare all files in two directories, reporting each result as it is found.
+
+        Files with the same size and hash match. Other files are compared
+        line by line, using the same options as compare_files.
+
+        self.limitToExtension: compare only files with these extensions.
+        self.recursive: True: compare all subdirectories too.
+
+        Return (matches,mismatches,missing1,missing2), lists of relative paths."""
+
         # Ignore everything except the directory name.
         dir1 = g.os_path_dirname(path1)
         dir2 = g.os_path_dirname(path2)
@@ -127,13 +178,11 @@ class baseLeoCompare:
 
         if dir1 == dir2:
             return self.show("Please pick distinct directories.")
-        try:
-            list1 = os.listdir(dir1)
-        except:
+        d1 = self.listFiles(dir1)
+        if d1 is None:
             return self.show("invalid directory:" + dir1)
-        try:
-            list2 = os.listdir(dir2)
-        except:
+        d2 = self.listFiles(dir2)
+        if d2 is None:
             return self.show("invalid directory:" + dir2)
 
         if self.outputFileName:
@@ -141,62 +190,53 @@ class baseLeoCompare:
         ok = self.outputFileName == None or self.outputFile
         if not ok: return None
 
-        # Create files and files2, the lists of files to be compared.
-        files1 = []
-        files2 = []
-        for f in list1:
-            junk, ext = g.os_path_splitext(f)
-            if self.limitToExtension:
-                if ext == self.limitToExtension:
-                    files1.append(f)
-            else:
-                files1.append(f)
-        for f in list2:
-            junk, ext = g.os_path_splitext(f)
-            if self.limitToExtension:
-                if ext == self.limitToExtension:
-                    files2.append(f)
-            else:
-                files2.append(f)
-
-        # Compare the files and set the yes, no and missing lists.
-        yes = [] ; no = [] ; missing1 = [] ; missing2 = []
-        for f1 in files1:
-            head,f2 = g.os_path_split(f1)
-            if f2 in files2:
-                try:
-                    name1 = g.os_path_join(dir1,f1)
-                    name2 = g.os_path_join(dir2,f2)
-                    val = filecmp.cmp(name1,name2,0)
-                    if val: yes.append(f1)
-                    else:    no.append(f1)
-                except:
-                    self.show("exception in filecmp.cmp")
-                    g.es_exception()
-                    missing1.append(f1)
-            else:
-                missing1.append(f1)
-        for f2 in files2:
-            head,f1 = g.os_path_split(f2)
-            if f1 not in files1:
-                missing2.append(f1)
-
-        # Print the results.
-        for kind, files in (
-            ("----- matches --------",yes),
-            ("----- mismatches -----",no),
-            ("----- not found 1 ------",missing1),
-            ("----- not found 2 ------",missing2),
-        ):
-            self.show(kind)
+        yes = [] ; no = []
+        missing1 = sorted([z for z in d1 if z not in d2])
+        missing2 = sorted([z for z in d2 if z not in d1])
+        for kind,files in (("not found 1:",missing1),("not found 2:",missing2)):
             for f in files:
-                self.show(f)
+                self.show('%-12s %s' % (kind,f))
+
+        # Hash both files only if their sizes match.
+        common = sorted([z for z in d1 if z in d2])
+        jobs = []
+        for f in common:
+            name1,size1 = d1[f]
+            name2,size2 = d2[f]
+            jobs.append(g.choose(size1 == size2,(name1,name2),None))
+        if multiprocessing and self.workers > 1 and len(jobs) > 1:
+            pool = multiprocessing.pool.ThreadPool(self.workers)
+            digests = pool.imap(hashPair,jobs,chunksize=16)
+        else:
+            pool = None
+            digests = (hashPair(z) for z in jobs)
+        try:
+            for i,pair in enumerate(digests):
+                f = common[i]
+                if pair and pair[0] and pair[0] == pair[1]:
+                    match = True
+                else:
+                    match = self.equivalentFiles(d1[f][0],d2[f][0])
+                if match:
+                    yes.append(f)
+                    if self.printMatches:
+                        self.show('%-12s %s' % ("match:",f))
+                else:
+                    no.append(f)
+                    self.show('%-12s %s' % ("mismatch:",f))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        self.show("%s matches, %s mismatches, %s not found 1, %s not found 2" % (
+            len(yes),len(no),len(missing1),len(missing2)))
 
         if self.outputFile:
             self.outputFile.close()
             self.outputFile = None
 
-        return None # To keep pychecker happy.
+        return yes,no,missing1,missing2
     #@+node:ekr.20031218072017.3636: *3* compare_files (entry)
     def compare_files (self, name1, name2):
 
@@ -412,6 +452,49 @@ class baseLeoCompare:
 
         self.show(tag + str(trailingLines) + " trailing lines")
         return trailingLines
+    #@+node:ekr.20140219061533.16900: *4* equivalentFiles & readSignificantLines
+    def equivalentFiles (self,name1,name2):
+
+        """Return True if the files match when compared line by line.
+
+        This uses the same options as compare_open_files, but prints nothing."""
+
+        lines1 = self.readSignificantLines(name1,self.ignoreFirstLine1)
+        lines2 = self.readSignificantLines(name2,self.ignoreFirstLine2)
+        if lines1 is None or lines2 is None or len(lines1) != len(lines2):
+            return False
+        for s1,s2 in zip(lines1,lines2):
+            if not self.compare_lines(s1,s2):
+                return False
+        return True
+
+    def readSignificantLines (self,name,ignoreFirstLine):
+
+        """Return the lines of the file that compare_open_files would compare."""
+
+        try:
+            f = open(name,'rb')
+            try:
+                s = g.toUnicode(f.read())
+            finally:
+                f.close()
+        except (IOError,OSError):
+            return None
+        lines = g.splitLines(s.replace('\r\n','\n').replace('\r','\n'))
+        sentinelComment = None
+        if self.ignoreSentinelLines and lines:
+            sentinelComment = self.isLeoHeader(lines[0])
+        if ignoreFirstLine:
+            lines = lines[1:]
+        result = []
+        for s in lines:
+            if self.ignoreBlankLines and len(s.strip()) == 0:
+                pass
+            elif sentinelComment and self.isSentinel(s,sentinelComment):
+                pass
+            else:
+                result.append(s)
+        return result
     #@+node:ekr.20031218072017.3649: *4* isLeoHeader & isSentinel
     #@+at These methods are based on atFile.scanHeader(). They are simpler
     # because we only care about the starting sentinel comment: any line
@@ -433,6 +516,41 @@ class baseLeoCompare:
 
         i = g.skip_ws(s,0)
         return g.match(s,i,sentinelComment)
+    #@+node:ekr.20140219061533.16901: *4* listFiles
+    def listFiles (self,theDir):
+
+        """Return a dict describing the files to be compared in theDir.
+
+        Keys are paths relative to theDir; values are tuples (path,size).
+        Return None if theDir is not a directory."""
+
+        if not g.os_path_isdir(theDir):
+            return None
+        exts = self.limitToExtension
+        if exts:
+            # A list of extensions, separated by spaces or commas.
+            exts = [g.choose(z.startswith('.'),z,'.'+z)
+                for z in exts.replace(',',' ').split()]
+        if self.recursive:
+            aList = []
+            for root,dirs,files in os.walk(theDir):
+                for name in files:
+                    path = os.path.join(root,name)
+                    aList.append(os.path.relpath(path,theDir))
+        else:
+            aList = [z for z in os.listdir(theDir)
+                if os.path.isfile(os.path.join(theDir,z))]
+        d = {}
+        for f in aList:
+            junk, ext = g.os_path_splitext(f)
+            if exts and ext not in exts:
+                continue
+            path = os.path.join(theDir,f)
+            try:
+                d[f] = path,os.path.getsize(path)
+            except OSError:
+                pass # The file vanished.
+        return d
     #@+node:ekr.20031218072017.1144: *4* openOutputFile (compare)
     def openOutputFile (self):
 
@@ -1487,6 +1487,11 @@ class debugCommandsClass (baseEditCommandsClass):
             'pdb':          self.pdb,
             'print-focus':  self.printFocus,
 
+            # Command statistics.
+            'print-command-stats':  self.printCommandStats,
+            'toggle-command-stats': self.toggleCommandStats,
+            'write-command-stats':  self.writeCommandStats,
+
             # Tracing of garbase collecor.
             'gc-collect-garbage':       self.collectGarbage,
             'gc-dump-all-objects':      self.dumpAllObjects,
@@ -1504,6 +1509,11 @@ class debugCommandsClass (baseEditCommandsClass):
             'run-selected-unit-tests-externally':   self.runSelectedUnitTestsExternally,
                 # was 'run-unit-tests.
 
+            # Unit tests run in worker processes.
+            'run-all-unit-tests-in-parallel':       self.runAllUnitTestsInParallel,
+            'run-marked-unit-tests-in-parallel':    self.runMarkedUnitTestsInParallel,
+            'run-selected-unit-tests-in-parallel':  self.runSelectedUnitTestsInParallel,
+
             # Unit tests run locally.
             'run-all-unit-tests-locally':       self.runAllUnitTestsLocally,
             'run-marked-unit-tests-locally':    self.runMarkedUnitTestsLocally,
@@ -1655,6 +1665,40 @@ class debugCommandsClass (baseEditCommandsClass):
         g.es_print('      hasFocusWidget:',c.widget_name(c.hasFocusWidget))
         g.es_print('requestedFocusWidget:',c.widget_name(c.requestedFocusWidget))
         g.es_print('           get_focus:',c.widget_name(c.get_focus()))
+    #@+node:ekr.20140219061533.16874: *3* command stats
+    def printCommandStats (self,event=None):
+
+        '''Print the time and other costs of all commands executed so far.'''
+
+        c = self.c
+        if c.commandStats:
+            c.commandStats.print_stats()
+        else:
+            g.es_print('command stats are disabled: use toggle-command-stats')
+
+    def toggleCommandStats (self,event=None):
+
+        '''Enable or disable recording the costs of all commands.'''
+
+        c = self.c
+        if c.commandStats:
+            c.commandStats = None
+            g.es_print('command stats disabled')
+        else:
+            import leo.core.leoCommandStats as leoCommandStats
+            c.commandStats = leoCommandStats.CommandStats(c)
+            g.es_print('command stats enabled')
+
+    def writeCommandStats (self,event=None):
+
+        '''Write the command stats to ~/.leo/command_stats.json.'''
+
+        c = self.c
+        if c.commandStats:
+            fn = c.commandStats.write()
+            g.es_print('wrote %s' % fn)
+        else:
+            g.es_print('command stats are disabled: use toggle-command-stats')
     #@+node:ekr.20060205043324.3: *3* printGcSummary
     def printGcSummary (self,event=None):
 
@@ -1701,6 +1745,23 @@ class debugCommandsClass (baseEditCommandsClass):
         '''Run all unit tests contained in the presently selected outline
         Tests are run in an external process, so tests *cannot* change the outline.'''
         self.c.testManager.runTestsExternally(all=False,marked=False)
+
+    # Tests run in parallel...
+
+    def runAllUnitTestsInParallel (self,event=None):
+        '''Run all unit tests contained in the entire outline.
+        Tests are run in worker processes, so tests *cannot* change the outline.'''
+        self.c.testManager.runTestsInParallel(all=True,marked=False)
+
+    def runMarkedUnitTestsInParallel (self,event=None):
+        '''Run all marked unit tests in the outline.
+        Tests are run in worker processes, so tests *cannot* change the outline.'''
+        self.c.testManager.runTestsInParallel(all=True,marked=True)
+
+    def runSelectedUnitTestsInParallel (self,event=None):
+        '''Run all unit tests contained in the presently selected outline.
+        Tests are run in worker processes, so tests *cannot* change the outline.'''
+        self.c.testManager.runTestsInParallel(all=False,marked=False)
     #@-others
 #@+node:ekr.20050920084036.53: ** editCommandsClass
 class editCommandsClass (baseEditCommandsClass):
@@ -9236,6 +9297,7 @@ class macroCommandsClass (baseEditCommandsClass):
             g.es_print('loaded: %s' % (name))
 
         c.commandsDict [name] = func
+        c.k.invalidateCommandNames()
         self.namedMacros [name] = macro
     #@+node:ekr.20050920084036.206: *3* endMacro
     def endMacro (self,event=None):
@@ -14,6 +14,7 @@ import leo.core.leoGlobals as g
     # except ImportError: pass
 
 import leo.core.leoNodes as leoNodes
+import base64
 import binascii
 import difflib
 
@@ -27,11 +28,13 @@ else:
 
 import os
 import pickle
+import re
 import string
 import sys
 import tempfile
 import types
 import zipfile
+import zlib
 
 try:
     # IronPython has problems with this.
@@ -44,6 +47,9 @@ except Exception:
 # import time
 #@-<< imports >>
 
+# Matches the prefix of uA's written by fc.compactUaString.
+compact_ua_pattern = re.compile(r'^ua([0-9]*)(:|$)')
+
 #@+<< define exception classes >>
 #@+node:ekr.20060918164811: ** << define exception classes >>
 class BadLeoFile(Exception):
@@ -572,6 +578,10 @@ class baseFileCommands:
         self.forbiddenTnodes = []
         self.descendentTnodeUaDictList = []
         self.descendentVnodeUaDictList = []
+        self.compactUaDict = {}
+            # Keys are ids of compact uA's; values are their encoded data.
+        self.compactUaRefs = []
+            # Tuples (aDict,attr,id) for references to compact uA's not yet seen.
         self.ratio = 0.5
         self.currentVnode = None
         self.rootVnode = None
@@ -582,6 +592,11 @@ class baseFileCommands:
         self.outputFile = None
         self.openDirectory = None
         self.putCount = 0
+        self.compactUas = False
+            # True: write uA's using the compact encoding.
+        self.compactUaIds = None
+            # Keys are encoded uA's; values are their ids.
+            # None: don't deduplicate uA's.
         # self.topVnode = None
         self.toString = False
         self.usingClipboard = False
@@ -760,6 +775,8 @@ class baseFileCommands:
             fc.propegateDirtyNodes()
         c.setChanged(c.changed) # Refresh the changed marker.
         fc.initReadIvars()
+        if ok and c.undoer.journal:
+            c.undoer.journal.open()
         return ok, c.frame.ratio
     #@+node:ekr.20090526081836.5841: *5* fc.getLeoFileHelper
     def getLeoFileHelper(self,theFile,fileName,silent):
@@ -976,6 +993,8 @@ class baseFileCommands:
         '''Unhexlify and unpickle t/v.descendentUnknownAttribute field.'''
 
         try:
+            if g.toUnicode(s).startswith('ua:'):
+                return self.decodeCompactUa('descendentUnknownAttributes',g.toUnicode(s)[3:])
             # Changed in version 3.2: Accept only bytestring or bytearray objects as input.
             s = g.toEncodedString(s) # 2011/02/22
             bin = binascii.unhexlify(s) # Throws a TypeError if val is not a hex string.
@@ -1162,7 +1181,7 @@ class baseFileCommands:
         aDict = {}
         for key in d:
             val = g.toUnicode(d.get(key)) # 2011/02/22
-            val2 = self.getSaxUa(key,val)
+            val2 = self.getSaxUa(key,val,aDict=aDict)
             # g.trace(key,val,val2)
             aDict[key] = val2
 
@@ -1233,7 +1252,7 @@ class baseFileCommands:
                     '****ignoring***',key,d.get(key))
             else:
                 val = d.get(key)
-                val2 = self.getSaxUa(key,val)
+                val2 = self.getSaxUa(key,val,aDict=aDict)
                 aDict[key] = val2
                 # g.trace(key,val,val2)
         if aDict:
@@ -1250,12 +1269,16 @@ class baseFileCommands:
         for child in root.children:
             self.dumpSaxTree(child,dummy=False)
     #@+node:ekr.20061003093021: *4* getSaxUa
-    def getSaxUa(self,attr,val,kind=None): # Kind is for unit testing.
+    def getSaxUa(self,attr,val,kind=None,aDict=None): # Kind is for unit testing.
 
         """Parse an unknown attribute in a <v> or <t> element.
-        The unknown tag has been pickled and hexlify'd.
+        The unknown tag has been pickled and hexlify'd,
+        or encoded with fc.compactUaString.
         """
 
+        m = compact_ua_pattern.match(g.toUnicode(val))
+        if m and not attr.startswith('str_'):
+            return self.getCompactUa(attr,g.toUnicode(val),m,aDict)
         try:
             # val = str(val)
             val = g.toEncodedString(val) # 2011/02/22.
@@ -1297,6 +1320,52 @@ class baseFileCommands:
         except (pickle.UnpicklingError,ImportError,AttributeError,ValueError,TypeError):
             g.trace('can not unpickle %s=%s' % (attr,val))
             return val
+    #@+node:ekr.20140219061533.16838: *5* fc.getCompactUa & helpers
+    def getCompactUa (self,attr,val,m,aDict):
+
+        '''
+        Return the value of a uA written by fc.compactUaString.
+
+        ua<n>:<data> defines uA n; ua<n> refers to it; ua:<data> is not shared.
+        '''
+
+        n,data = m.group(1),val[m.end():]
+        if m.group(2):
+            if n: self.compactUaDict[n] = data
+        else:
+            data = self.compactUaDict.get(n)
+            if data is None:
+                # The definition follows: resolveCompactUaRefs will set aDict[attr].
+                if aDict is not None:
+                    self.compactUaRefs.append((aDict,attr,n),)
+                return None
+        return self.decodeCompactUa(attr,data)
+    #@+node:ekr.20140219061533.16839: *6* fc.decodeCompactUa
+    def decodeCompactUa (self,attr,data):
+
+        '''Decode the data written by fc.compactUaData.'''
+
+        try:
+            s = base64.b64decode(g.toEncodedString(data[1:]))
+            if data[:1] == 'z':
+                s = zlib.decompress(s)
+            return pickle.loads(s)
+        except Exception:
+            g.trace('can not decode %s=%s' % (attr,data[:40]))
+            return None
+    #@+node:ekr.20140219061533.16840: *6* fc.resolveCompactUaRefs
+    def resolveCompactUaRefs (self):
+
+        '''Resolve references to compact uA's defined after the reference.'''
+
+        for aDict,attr,n in self.compactUaRefs:
+            data = self.compactUaDict.get(n)
+            if data is None:
+                g.trace('undefined uA: %s=ua%s' % (attr,n))
+                del aDict[attr]
+            else:
+                aDict[attr] = self.decodeCompactUa(attr,data)
+        self.compactUaRefs = []
     #@+node:ekr.20060919110638.14: *4* parse_leo_file
     def parse_leo_file (self,theFile,inputFileName,silent,inClipboard,s=None):
 
@@ -1339,6 +1408,8 @@ class baseFileCommands:
 
         dump = False and not g.unitTesting
         fc = self ; c = fc.c
+        fc.compactUaDict = {}
+        fc.compactUaRefs = []
 
         # Pass one: create the intermediate nodes.
         saxRoot = fc.parse_leo_file(theFile,fileName,
@@ -1351,6 +1422,7 @@ class baseFileCommands:
             parent_v = c.hiddenRootNode
             children = fc.createSaxChildren(saxRoot,parent_v)
             assert c.hiddenRootNode.children == children
+            fc.resolveCompactUaRefs()
             v = children and children[0] or None
             return v
         else:
@@ -1477,6 +1549,8 @@ class baseFileCommands:
                 if not silent:
                     self.putSavedMessage(fileName)
                 c.setChanged(False) # Clears all dirty bits.
+                if c.undoer.journal:
+                    c.undoer.journal.clear()
                 if c.config.save_clears_undo_buffer:
                     g.es("clearing undo")
                     c.undoer.clearUndoState()
@@ -1498,6 +1572,8 @@ class baseFileCommands:
             try:
                 if self.write_Leo_file(fileName,outlineOnlyFlag=False):
                     c.setChanged(False) # Clears all dirty bits.
+                    if c.undoer.journal:
+                        c.undoer.journal.clear()
                     self.putSavedMessage(fileName)
             finally:
                 c.ignoreChangedPaths = True
@@ -1750,6 +1826,7 @@ class baseFileCommands:
         c = self.c
 
         self.put("<tnodes>\n")
+        self.compactUaIds = {} # Share identical uA's between tnodes.
         #@+<< write only those tnodes that were referenced >>
         #@+node:ekr.20031218072017.1576: *5* << write only those tnodes that were referenced >>
         if self.usingClipboard: # write the current tree.
@@ -1790,6 +1867,7 @@ class baseFileCommands:
                 # This prevents the file from being written.
                 raise BadLeoFile('no vnode for %s' % repr(index))
         #@-<< write only those tnodes that were referenced >>
+        self.compactUaIds = None
         self.put("</tnodes>\n")
     #@+node:ekr.20031218072017.1863: *4* putVnode
     def putVnode (self,p,isIgnore=False):
@@ -1915,6 +1993,7 @@ class baseFileCommands:
         self.rootPosition    = c.rootPosition()
         # self.topPosition     = c.topPosition()
         self.vnodesDict = {}
+        self.compactUas = c.config.getBool('compact_unknown_attributes',default=False)
 
         if self.usingClipboard:
             self.putVnode(self.currentPosition) # Write only current tree.
@@ -2258,6 +2337,39 @@ class baseFileCommands:
                     result.append((torv,d),)
 
         return result
+    #@+node:ekr.20140219061533.16841: *4* fc.compactUaString & compactUaData
+    def compactUaString (self,val):
+
+        '''
+        Return the compact encoding of val.
+
+        Large uA's are written once: later copies refer to the first.
+        '''
+
+        data = self.compactUaData(val)
+        d = self.compactUaIds
+        if d is None or len(data) < 40:
+            return 'ua:' + data
+        n = d.get(data)
+        if n is None:
+            n = d[data] = len(d)
+            return 'ua%s:%s' % (n,data)
+        else:
+            return 'ua%s' % (n)
+
+    def compactUaData (self,val):
+
+        '''
+        Return val pickled with protocol 2 and base64 encoded, prefixed by
+        'z' if the pickle was compressed with zlib, 'p' otherwise.
+        '''
+
+        s = pickle.dumps(val,protocol=2)
+        z = zlib.compress(s)
+        if len(z) < len(s):
+            return 'z' + g.ue(base64.b64encode(z),'utf-8')
+        else:
+            return 'p' + g.ue(base64.b64encode(s),'utf-8')
     #@+node:ekr.20080805085257.2: *3* fc.pickle
     def pickle (self,torv,val,tag):
 
@@ -2265,9 +2377,13 @@ class baseFileCommands:
 
         trace = False and g.unitTesting
         try:
-            s = pickle.dumps(val,protocol=1)
-            s2 = binascii.hexlify(s)
-            s3 = g.ue(s2,'utf-8')
+            if self.compactUas:
+                s = s2 = None
+                s3 = self.compactUaString(val)
+            else:
+                s = pickle.dumps(val,protocol=1)
+                s2 = binascii.hexlify(s)
+                s3 = g.ue(s2,'utf-8')
             if trace: g.trace('\n',
                 type(val),val,'\n',type(s),repr(s),'\n',
                 type(s2),s2,'\n',type(s3),s3)
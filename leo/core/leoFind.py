@@ -162,6 +162,7 @@ class leoFind:
         self.change_text = ""
         self.radioButtonsChanged = False # Set by ftm.radio_button_callback
         # Ivars containing internal state...
+        self.changeAllVnodes = [] # Vnodes changed by changeAll.
         self.p = None # The position being searched.  Never saved between searches!
         self.in_headline = False # True: searching headline text.
         # For suboutline-only
@@ -1036,7 +1037,8 @@ class leoFind:
                 p.initHeadString(s)
                 if self.mark_changes:
                     p.setMarked()
-                p.setDirty()
+                p.v.setDirty() # changeAll marks ancestors dirty.
+                self.changeAllVnodes.append(p.v)
                 if not c.isChanged():
                     c.setChanged(True)
                 u.afterChangeNodeContents(p,'Change Headline',undoData)
@@ -1053,7 +1055,8 @@ class leoFind:
                 c.setBodyString(p,s)
                 if self.mark_changes:
                     p.setMarked()
-                p.setDirty()
+                p.v.setDirty() # changeAll marks ancestors dirty.
+                self.changeAllVnodes.append(p.v)
                 if not c.isChanged():
                     c.setChanged(True)
 
@@ -1078,6 +1081,7 @@ class leoFind:
         saveData = self.save()
         self.initBatchCommands()
         count = 0
+        self.changeAllVnodes = []
         u.beforeChangeGroup(current,undoType)
         while 1:
             pos1, pos2 = self.findNextMatch()
@@ -1087,6 +1091,10 @@ class leoFind:
             if trace: g.trace(pos1,pos2,self.p and self.p.h)
             count += 1
             self.batchChange(pos1,pos2)
+        # Mark the ancestors of all changed nodes dirty at once.
+        c.setAllAncestorAtFileNodesDirtyInList(
+            self.changeAllVnodes,setDescendentsDirty=True)
+        self.changeAllVnodes = []
         p = c.p
         u.afterChangeGroup(p,undoType,reportFlag=True)
         g.es("changed:",count,"instances")
@@ -500,6 +500,7 @@ class leoBody (HighLevelInterface):
         self.forceFullRecolorFlag = False
         self.frame = frame
         self.parentFrame = parentFrame # New in Leo 4.6.
+        self.totalChars = 0 # Characters examined by the colorizers of all editors.
         self.totalNumberOfEditors = 0
 
         # May be overridden in subclasses...
@@ -2340,7 +2341,9 @@ class nullFrame (leoFrame):
     #@+node:ekr.20041120073824: *3* destroySelf (nullFrame)
     def destroySelf (self):
 
-        pass
+        # Indicate that the commander is no longer valid, as qtFrame.destroySelf does.
+        if self.c:
+            self.c.exists = False
     #@+node:ekr.20040327105706.2: *3* finishCreate (nullFrame)
     def finishCreate(self):
         # This may be overridden in subclasses.
@@ -2613,7 +2616,7 @@ class nullTree (leoTree):
         if not w:
             d[p.v] = w = stringTextWidget(
                 c=self.c,
-                name='head-%d' % (1 + len(list(d.keys()))))
+                name='head-%d' % (1 + len(d)))
             w.setAllText(p.h)
         return w
     #@+node:ekr.20070228164730: *5* editLabel (nullTree)
@@ -70,6 +70,7 @@ if 0:
 # Don't import this here: it messes up Leo's startup code.
 # import leo.core.leoTest as leoTest
 
+import bisect
 import codecs
 
 try:
@@ -2235,13 +2236,13 @@ def recursiveUNLFind(unlList, c, depth=0, p=None, maxdepth=0, maxp=None):
     selected position or call c.frame.bringToFront()"""
 
     if depth == 0:
-        nds = c.rootPosition().self_and_siblings()
-        unlList = [i.replace('--%3E', '-->') for i in unlList if i.strip()]
-        # drop empty parts so "-->node name" works
-    else:
-        nds = p.children()
+        # c.unlCache resolves the UNL in O(depth) dict lookups.
+        found, maxdepth, maxp = c.unlCache.find(unlList)
+        if maxp and not found:  # inexact match
+            g.es('Partial UNL match')
+        return found, maxdepth, maxp
 
-    for i in nds:
+    for i in p.children():
 
         if unlList[depth] == i.h:
 
@@ -2255,11 +2256,7 @@ def recursiveUNLFind(unlList, c, depth=0, p=None, maxdepth=0, maxp=None):
                 found, maxdepth, maxp = g.recursiveUNLFind(unlList, c, depth+1, i, maxdepth, maxp)
                 if found:
                     return found, maxdepth, maxp
-                # else keep looking through nds
-
-    if depth == 0 and maxp:  # inexact match
-        #X moveToP(c, maxp)
-        g.es('Partial UNL match')
+                # else keep looking through p's children
 
     return False, maxdepth, maxp
 #@+node:ekr.20031218072017.3124: *3* g.sanitize_filename
@@ -3809,6 +3806,11 @@ def skip_python_string(s,i,verbose=True):
         # 2013/09/08: honor the verbose argument.
         return g.skip_string(s,i,verbose=verbose)
 #@+node:ekr.20031218072017.2369: *4* skip_string (leoGlobals)
+g_skip_string_pats = {
+    '"': re.compile(r'[^"\\]*(?:\\.[^"\\]*)*',re.DOTALL),
+    "'": re.compile(r"[^'\\]*(?:\\.[^'\\]*)*",re.DOTALL),
+}
+
 def skip_string(s,i,verbose=True):
 
     '''Scan forward to the end of a string.
@@ -3818,9 +3820,10 @@ def skip_string(s,i,verbose=True):
     assert(delim == '"' or delim == '\'')
 
     n = len(s)
-    while i < n and s[i] != delim:
-        if s[i] == '\\' : i += 2
-        else: i += 1
+    # Skip everything up to the closing delim, including escaped characters.
+    i = g_skip_string_pats[delim].match(s,i).end()
+    if i < n and s[i] == '\\':
+        i = n + 1 # s ends with a backslash: skip it and the missing escaped character.
 
     if i >= n:
         if verbose:
@@ -3978,12 +3981,19 @@ def skip_c_id(s,i):
         i += 1
     return i
 #@+node:ekr.20040705195048: *4* skip_id
+# Keys are strings of extra id chars, values are compiled patterns.
+g_skip_id_pats = {}
+
 def skip_id(s,i,chars=None):
 
     chars = chars and g.toUnicode(chars) or ''
-    n = len(s)
-    while i < n and (g.isWordChar(s[i]) or s[i] in chars):
-        i += 1
+    if 0 <= i < len(s):
+        pat = g_skip_id_pats.get(chars)
+        if not pat:
+            # \w matches exactly the characters for which g.isWordChar is True.
+            pat = re.compile(r'[\w%s]*' % re.escape(chars),re.UNICODE)
+            g_skip_id_pats[chars] = pat
+        i = pat.match(s,i).end()
     return i
 #@+node:ekr.20031218072017.3187: *4* skip_line, skip_to_start/end_of_line
 #@+at These methods skip to the next newline, regardless of whether the
@@ -4188,18 +4198,19 @@ def skip_to_char(s,i,ch):
     else:
         return j,s[i:j]
 #@+node:ekr.20031218072017.3194: *4* skip_ws, skip_ws_and_nl
+g_skip_ws_pat = re.compile(r'[ \t]*')
+g_skip_ws_and_nl_pat = re.compile(r'[ \t\r\n]*')
+
 def skip_ws(s,i):
 
-    n = len(s)
-    while i < n and g.is_ws(s[i]):
-        i += 1
+    if 0 <= i < len(s):
+        i = g_skip_ws_pat.match(s,i).end()
     return i
 
 def skip_ws_and_nl(s,i):
 
-    n = len(s)
-    while i < n and (g.is_ws(s[i]) or g.is_nl(s,i)):
-        i += 1
+    if 0 <= i < len(s):
+        i = g_skip_ws_and_nl_pat.match(s,i).end()
     return i
 #@+node:ekr.20031218072017.3195: *3* splitLines & joinLines
 def splitLines (s):
@@ -5755,13 +5766,11 @@ def longestCommonPrefix (s1,s2):
 
     '''Find the longest prefix common to strings s1 and s2.'''
 
-    prefix = ''
-    for ch in s1:
-        if s2.startswith(prefix + ch):
-            prefix = prefix + ch
-        else:
-            return prefix
-    return prefix
+    n = min(len(s1),len(s2))
+    for i in range(n):
+        if s1[i] != s2[i]:
+            return s1[:i]
+    return s1[:n]
 
 def itemsMatchingPrefixInList (s,aList,matchEmptyPrefix=False):
 
@@ -5777,12 +5786,37 @@ def itemsMatchingPrefixInList (s,aList,matchEmptyPrefix=False):
 
     if pmatches:
         pmatches.sort()
-        common_prefix = reduce(g.longestCommonPrefix,pmatches)
+        # The prefix common to the first and last items is common to all items.
+        common_prefix = g.longestCommonPrefix(pmatches[0],pmatches[-1])
     else:
         common_prefix = ''
 
     # g.trace(repr(s),len(pmatches))
     return pmatches,common_prefix
+
+def itemsMatchingPrefixInSortedList (s,aList,matchEmptyPrefix=False):
+
+    '''Like g.itemsMatchingPrefixInList, but aList must already be sorted.
+
+    Uses a binary search, so the time taken depends on the number of matches,
+    not on the size of aList.'''
+
+    if s:
+        i = bisect.bisect_left(aList,s)
+        j = i
+        n = len(aList)
+        while j < n and aList[j].startswith(s):
+            j += 1
+        pmatches = aList[i:j]
+    elif matchEmptyPrefix:
+        pmatches = aList[:]
+    else: pmatches = []
+
+    if pmatches:
+        common_prefix = g.longestCommonPrefix(pmatches[0],pmatches[-1])
+    else:
+        common_prefix = ''
+    return pmatches,common_prefix
 #@+node:ekr.20031218072017.3144: *3* g.makeDict
 # From the Python cookbook.
 
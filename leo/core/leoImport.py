@@ -103,6 +103,11 @@ new_gen = True
 import leo.core.leoGlobals as g
 
 docutils = g.importExtension('docutils',pluginName='leoImport.py')
+try:
+    import concurrent.futures as futures
+except ImportError:
+    futures = None # Python 2 without the futures backport.
+import functools
 import os
 import string
 if g.isPython3:
@@ -111,8 +116,17 @@ if g.isPython3:
 else:
     import StringIO
     StringIO = StringIO.StringIO
+import re
 import time
 #@-<< imports >>
+#@+<< patterns >>
+#@+node:ekr.20140219061533.16718: ** << patterns >> (leoImport)
+# Patterns used in the scanners' inner loops.
+g_ws_and_nl_pat = re.compile(r'[ \t\n]*')
+    # A run of blanks, tabs and newlines.
+g_ws_token_pat = re.compile(r'[^\S\n]*',re.UNICODE)
+    # A run of whitespace other than newlines: see skipWsToken.
+#@-<< patterns >>
 #@+<< class scanUtility >>
 #@+node:sps.20081112093624.1: ** << class scanUtility >>
 class scanUtility:
@@ -846,9 +860,13 @@ class leoImportCommands (scanUtility):
     #@+node:ekr.20031218072017.3209: *3* Import (leoImport)
     #@+node:ekr.20031218072017.3210: *4* ic.createOutline
     def createOutline (self,fileName,parent,
-        atAuto=False,atShadow=False,s=None,ext=None
+        atAuto=False,atShadow=False,s=None,ext=None,encoding=None
     ):
-        '''Create an outline by importing a file or string.'''
+        '''
+        Create an outline by importing a file or string.
+
+        encoding: the encoding found by g.readFileIntoString while reading s, if any.
+        '''
         c = self.c ; u = c.undoer
         w = c.frame.body
         at = c.atFileCommands
@@ -873,6 +891,8 @@ class leoImportCommands (scanUtility):
             s,e = g.readFileIntoString(fileName,encoding=self.encoding,kind=kind)
             if s is None: return None
             if e: self.encoding = e
+        elif encoding:
+            self.encoding = encoding
         if ext == '.otl':
             self.treeType = '@auto-otl'
             # atAuto = True
@@ -987,8 +1007,10 @@ class leoImportCommands (scanUtility):
         c.redraw(current)
         return p
     #@+node:ekr.20031218072017.3212: *4* importFilesCommand & helper
-    def importFilesCommand (self,files=None,treeType=None,redrawFlag=True):
+    def importFilesCommand (self,files=None,treeType=None,redrawFlag=True,contents=None):
         # Not a command.  It must *not* have an event arg.
+        # contents: None or a dict giving the (s,e) returned by
+        #           g.readFileIntoString for some already-read files.
         c = self.c ; current = c.p
         if not c or not current or not files: return
         self.tab_width = self.getTabWidth()
@@ -997,7 +1019,8 @@ class leoImportCommands (scanUtility):
             current = self.createImportParent(current,files)
         for fn in files:
             g.setGlobalOpenDir(fn)
-            p = self.createOutline(fn,current)
+            s,e = contents and contents.get(fn) or (None,None)
+            p = self.createOutline(fn,current,s=s,encoding=e)
             if p: # createOutline may fail.
                 if not g.unitTesting: g.blue("imported",fn)
                 p.contract()
@@ -1699,6 +1722,8 @@ class BaseScanner (scanUtility):
         self.file_s = ''
             # The complete text to be parsed.
         self.fullChecks = c.config.getBool('full_import_checks')
+        self.fullTrialWrites = c.config.getBool('full_import_trial_writes',default=False)
+            # True: checkTrialWrite always writes @auto trees with the atFile write code.
         self.functionSpelling = 'function'
             # for error message.
         self.importCommands = ic
@@ -1815,7 +1840,7 @@ class BaseScanner (scanUtility):
             g.error('line:',repr(line))
 
         return ok
-    #@+node:ekr.20070703122141.104: *4* checkTrialWrite
+    #@+node:ekr.20070703122141.104: *4* checkTrialWrite & helper
     def checkTrialWrite (self,s1=None,s2=None):
         '''Return True if a trial write produces the original file.'''
         # s1 and s2 are for unit testing.
@@ -1832,8 +1857,11 @@ class BaseScanner (scanUtility):
                 s1,s2 = self.file_s,outputFile.getvalue()
             elif self.atAuto:
                 # Special case for @auto.
-                at.writeOneAtAutoNode(self.root,toString=True,force=True,trialWrite=True)
-                s1,s2 = self.file_s,at.stringOutput
+                s2 = None if self.fullTrialWrites else self.writeGeneratedNodes(self.root)
+                if s2 is None:
+                    at.writeOneAtAutoNode(self.root,toString=True,force=True,trialWrite=True)
+                    s2 = at.stringOutput
+                s1 = self.file_s
             else:
                 # *Do* write sentinels in s2 to handle @others correctly.
                 # But we should not handle section references.
@@ -1893,6 +1921,77 @@ class BaseScanner (scanUtility):
             self.reportMismatch(lines1,lines2,bad_i1,bad_i2)
         if trace_time: g.trace(g.timeSince(t1))
         return ok
+    #@+node:ekr.20140219061533.16712: *5* writeGeneratedNodes
+    def writeGeneratedNodes (self,root):
+        '''
+        Return the text that writing the @auto tree root would produce,
+        computed directly from the generated nodes.
+
+        The scanners generate only plain code lines, @others lines and the
+        root's @language and @tabwidth directives, so the expansion done here
+        matches at.writeOneAtAutoNode without initing or running the write code.
+
+        Return None if any node contains anything else. The caller then does a
+        full trial write.
+        '''
+        at = self.c.atFileCommands
+        tab_width = self.tab_width
+        tag = at.underindentEscapeString
+        result = []
+        def put_indent(n,line):
+            if line.startswith(tag):
+                n2,junk = at.parseUnderindentTag(line)
+                if n2 >= n: return
+                elif n > 0: n -= n2
+                else:       n += n2
+            if n > 0:
+                if tab_width > 1:
+                    q,r = divmod(n,tab_width)
+                    result.append('\t'*q + ' '*r)
+                else:
+                    result.append(' '*n)
+        def put_body(p,indent):
+            # Return (ok,has_at_others).
+            has_at_others = False
+            for line in g.splitLines(p.b):
+                kind = at.directiveKind4(line,0)
+                if kind == at.noDirective:
+                    if len(line) > 1:
+                        put_indent(indent,line)
+                        if line.startswith(tag):
+                            junk,line = at.parseUnderindentTag(line)
+                    result.append(line)
+                elif kind == at.othersDirective and not has_at_others:
+                    has_at_others = True
+                    junk,delta = g.skip_leading_ws_with_indent(line,0,tab_width)
+                    if not put_others(p,indent+delta):
+                        return False,has_at_others
+                elif (kind == at.miscDirective and p == root and
+                    (g.match_word(line,0,'@language') or g.match_word(line,0,'@tabwidth'))
+                ):
+                    pass # Directives write nothing in @auto trees.
+                else:
+                    return False,has_at_others
+            return True,has_at_others
+        def put_others(p,indent):
+            # Same traversal as at.putAtOthersLine.
+            for child in p.children():
+                p2 = child.copy()
+                after = p2.nodeAfterTree()
+                while p2 and p2 != after:
+                    if at.isSectionName(p2.h,g.skip_ws(p2.h,0))[0]:
+                        p2.moveToNodeAfterTree()
+                        continue
+                    ok,has_at_others = put_body(p2,indent)
+                    if not ok:
+                        return False
+                    if has_at_others:
+                        p2.moveToNodeAfterTree()
+                    else:
+                        p2.moveToThreadNext()
+            return True
+        ok,junk = put_body(root,0)
+        return ''.join(result) if ok else None
     #@+node:ekr.20070730093735: *4* compareHelper & helpers
     def compareHelper (self,lines1,lines2,i,strict):
         '''
@@ -2627,7 +2726,8 @@ class BaseScanner (scanUtility):
         while i < len(s):
             progress = i
             if s[i] in (' ','\t','\n'):
-                i += 1 # Prevent lookahead below, and speed up the scan.
+                # Prevent lookahead below, and speed up the scan.
+                i = g_ws_and_nl_pat.match(s,i).end()
             elif self.startsComment(s,i):
                 i = self.skipComment(s,i)
             elif self.startsString(s,i):
@@ -2691,7 +2791,8 @@ class BaseScanner (scanUtility):
         while i < len(s):
             progress = i
             if s[i] in (' ','\t','\n'):
-                i += 1 # Prevent lookahead below, and speed up the scan.
+                # Prevent lookahead below, and speed up the scan.
+                i = g_ws_and_nl_pat.match(s,i).end()
             elif self.startsComment(s,i):
                 i = self.skipComment(s,i)
             elif self.startsString(s,i):
@@ -2793,7 +2894,8 @@ class BaseScanner (scanUtility):
         while i < end:
             progress = i
             if s[i] in (' ','\t','\n'):
-                i += 1 # Prevent lookahead below, and speed up the scan.
+                # Prevent lookahead below, and speed up the scan.
+                i = min(end,g_ws_and_nl_pat.match(s,i).end())
             elif self.startsComment(s,i):
                 i = self.skipComment(s,i)
             elif self.startsString(s,i):
@@ -2885,7 +2987,7 @@ class BaseScanner (scanUtility):
                                 self.errorLines.append(j)
                                 self.underindentedLine(line)
             elif s[i] in (' ','\t',):
-                i += 1 # speed up the scan.
+                i = g.skip_ws(s,i) # speed up the scan.
             elif self.startsComment(s,i):
                 i = self.skipComment(s,i)
             elif self.startsString(s,i):
@@ -2989,7 +3091,8 @@ class BaseScanner (scanUtility):
         while i < end:
             progress = i
             if s[i] in (' ','\t','\n'):
-                i += 1 # Prevent lookahead below, and speed up the scan.
+                # Prevent lookahead below, and speed up the scan.
+                i = min(end,g_ws_and_nl_pat.match(s,i).end())
             elif self.startsComment(s,i):
                 # Add the comment to the decl if it *doesn't* start the line.
                 i2,junk = g.getLine(s,i)
@@ -3378,10 +3481,8 @@ class BaseScanner (scanUtility):
         return j,s[i:j]
 
     def skipWsToken(self,s,i):
-        j = i
-        while i < len(s) and s[i] != '\n' and s[i].isspace():
-            i += 1
-        return i,s[j:i]
+        j = g_ws_token_pat.match(s,i).end()
+        return j,s[i:j]
 
     #@+node:ekr.20111030155153.16703: *4* tokenize
     def tokenize (self,s):
@@ -3393,8 +3494,8 @@ class BaseScanner (scanUtility):
         This is used only to verify the imported text.
         '''
 
-        result,i,line_number = [],0,0
-        while i < len(s):
+        result,i,line_number,n = [],0,0,len(s)
+        while i < n:
             progress = j = i
             ch = s[i]
             if ch == '\n':
@@ -3418,8 +3519,13 @@ class BaseScanner (scanUtility):
             assert progress < i and j == progress
             if val:
                 result.append((kind,val,line_number),)
-            # Use the raw token, s[j:i] to count newlines, not the munged val.
-            line_number += s[j:i].count('\n')
+            if kind == 'nl':
+                line_number += 1
+            elif kind in ('comment','string','other'):
+                # Only these tokens can contain newlines.
+                # Use the raw token, s[j:i] to count newlines, not the munged val.
+                # str.count with bounds avoids copying each token.
+                line_number += s.count('\n',j,i)
             # g.trace('%3s %7s %s' % (line_number,kind,repr(val[:20])))
         return result
     #@-others
@@ -3435,46 +3541,106 @@ class recursiveImportController:
     def __init__ (self,c,one_file=False,theTypes=None,safe_at_file=True,use_at_edit=False):
         
         self.c = c
+        self.contents = {}
+            # Keys are paths, values are the (s,e) read by read_files.
+        self.dirs_dict = {}
+            # Keys are directories, values are (dirs,files) as computed by list_dir.
         self.one_file = one_file
         self.recursive = not one_file
         self.safe_at_file = safe_at_file
         self.theTypes = theTypes
         self.use_at_edit = use_at_edit
-    #@+node:ekr.20130823083943.12597: *3* Pass 1: import_dir
+    #@+node:ekr.20130823083943.12597: *3* Pass 1: import_dir & helpers
     def import_dir(self,root,dir_):
 
         c = self.c
         g.es("dir: " + dir_,color="blue")
-        dirs,files,files2 = [],os.listdir(dir_),[]
-        for f in files:
-            path = g.os_path_join(dir_,f)
-            if g.os_path_isfile(path):
-                name, ext = g.os_path_splitext(f)
-                if ext in self.theTypes:
-                    files2.append(path)
-            elif self.recursive:
-                dirs.append(path)
+        dirs,files2 = self.list_dir(dir_)
         if files2 or dirs:
             child = root.insertAsLastChild()
             child.h = dir_
             c.selectPosition(child,enableRedrawFlag=False)
         if files2:
-            if self.one_file:
-                files2 = [files2[0]]
             if self.use_at_edit:
                 for fn in files2:
                     parent = child or root
                     p = parent.insertAsLastChild()
                     p.h = fn.replace('\\','/')
-                    s,e = g.readFileIntoString(fn,encoding='utf-8',kind='@edit')
+                    s,e = self.contents.get(fn) or (None,None)
+                    if s is None:
+                        s,e = g.readFileIntoString(fn,encoding='utf-8',kind='@edit')
                     p.b = s
             else:
-                c.importCommands.importFilesCommand(files2,'@file',redrawFlag=False)
+                c.importCommands.importFilesCommand(files2,'@file',
+                    redrawFlag=False,contents=self.contents)
                     # '@auto' causes problems.
         if dirs:
             for dir_ in sorted(dirs):
                 prefix = dir_
                 self.import_dir(child,dir_)
+    #@+node:ekr.20140219061533.16715: *4* find_files
+    def find_files(self,dir_):
+        '''Return the list of all files that import_dir(dir_) will import.'''
+        dirs,files = self.list_dir(dir_)
+        result = files[:]
+        for dir_ in sorted(dirs):
+            result.extend(self.find_files(dir_))
+        return result
+    #@+node:ekr.20140219061533.16716: *4* list_dir
+    def list_dir(self,dir_):
+        '''
+        Return (dirs,files) for dir_: the subdirectories to be imported
+        and the files of the requested types.
+        '''
+        data = self.dirs_dict.get(dir_)
+        if data: return data
+        dirs,files = [],[]
+        for f in os.listdir(dir_):
+            path = g.os_path_join(dir_,f)
+            if g.os_path_isfile(path):
+                name, ext = g.os_path_splitext(f)
+                if ext in self.theTypes:
+                    files.append(path)
+            elif self.recursive:
+                dirs.append(path)
+        if self.one_file:
+            files = files[:1]
+        data = self.dirs_dict[dir_] = dirs,files
+        return data
+    #@+node:ekr.20140219061533.16717: *4* read_files
+    def read_files(self,paths,encoding):
+        '''
+        Read and decode all files in the paths list, in worker processes if possible.
+
+        encoding is the default encoding, as computed by ic.setEncoding.
+        BOM's and Python coding lines override it, as in ic.createOutline.
+
+        Set self.contents to a dict whose keys are paths and whose values
+        are the (s,e) returned by g.readFileIntoString for each file. Files
+        that can not be read are omitted: importFilesCommand reads them again
+        and reports errors.
+        '''
+        # Workers must not use g.app, so they call g.readFileIntoString directly.
+        read = functools.partial(g.readFileIntoString,encoding=encoding,silent=True)
+        results = None
+        if futures and len(paths) > 1:
+            try:
+                executor = futures.ProcessPoolExecutor()
+                try:
+                    results = list(executor.map(read,paths))
+                finally:
+                    executor.shutdown()
+            except Exception:
+                # Worker processes may not be available (frozen or embedded Pythons).
+                results = None
+        if results is None:
+            results = []
+            for fn in paths:
+                try:
+                    results.append(read(fn))
+                except Exception:
+                    results.append((None,None))
+        self.contents = dict([(fn,(s,e)) for fn,(s,e) in zip(paths,results) if s is not None])
     #@+node:ekr.20130823083943.12598: *3* Pass 2: clean_all & helpers
     def clean_all (self,p):
 
@@ -3804,7 +3970,20 @@ class recursiveImportController:
             root = p.insertAfter()
             root.h = 'imported files'
             prefix = dir_
+            if self.use_at_edit:
+                encoding = 'utf-8'
+            else:
+                # The directory nodes contain no directives, so all files
+                # get the encoding that createOutline computes for root.
+                ic = c.importCommands
+                ic.setEncoding(p=root)
+                encoding = ic.encoding
+            # Only reading and decoding run in worker processes. The scanners
+            # create positions in c as they parse, so import_dir scans and
+            # checks each file on this thread.
+            self.read_files(self.find_files(dir_),encoding)
             self.import_dir(root.copy(),dir_)
+            self.contents = {}
             for p in root.self_and_subtree():
                 n += 1
             if not self.use_at_edit:
@@ -25,6 +25,7 @@ if not isPython3:
 
 import ast
 import glob
+import hashlib
 import imp
 import os
 import string
@@ -44,6 +45,7 @@ else:
 
 g_dumper = None     # Global, singleton instance of AstDumper.
 g_formatter = None  # Global, singleton instance of AstFormatter.
+g_module_cache = {} # Keys are full file names; values are (digest,ModuleContext).
 
 #@+<< to do >>
 #@+node:ekr.20120609070048.11216: **  << to do >> (leoInspect)
@@ -1385,8 +1387,16 @@ class Context(object):
 
 #@+others
 #@+node:ekr.20111116103733.10540: **  inspect.module (Entry point)
-def module (fn=None,s=None,sd=None,print_stats=False,print_times=False):
+def module (fn=None,s=None,sd=None,print_stats=False,print_times=False,use_cache=True):
 
+    '''Return the ModuleContext for file fn or source string s.
+
+    If use_cache is True and sd is None, module(fn) returns the previous
+    ModuleContext for fn if the contents of fn have not changed. The cache
+    is not used if print_stats or print_times is True: the statistics
+    describe the scan that created a ModuleContext.'''
+
+    key = None
     if s:
         fn = '<string file>'
     else:
@@ -1395,6 +1405,11 @@ def module (fn=None,s=None,sd=None,print_stats=False,print_times=False):
         if not s:
             print('file not found: %s' % (fn))
             return None
+        if use_cache and not sd:
+            key,digest = os.path.abspath(fn),g_digest(s)
+            data = g_module_cache.get(key)
+            if data and data[0] == digest and not print_stats and not print_times:
+                return data[1]
 
     t1 = time.time()
 
@@ -1408,6 +1423,8 @@ def module (fn=None,s=None,sd=None,print_stats=False,print_times=False):
     if print_times: sd.print_times()
     if print_stats: sd.print_stats()
 
+    if key and module:
+        g_module_cache[key] = digest,module
     return module
 #@+node:ekr.20111116103733.10539: **  Top-level utilities
 #@+node:ekr.20111116103733.10337: *3* g_chain_base
@@ -1474,6 +1491,14 @@ def g_files_in_dir (theDir,recursive=True,extList=None,excludeDirs=None):
             result.extend(glob.glob(theDir,'*%s' % (ext)))
 
     return sorted(list(set(result)))
+#@+node:ekr.20140219061533.16905: *3* g_digest
+def g_digest (s):
+
+    '''Return the md5 digest of the source string s.'''
+
+    if not isinstance(s,bytes):
+        s = s.encode('utf-8','replace')
+    return hashlib.md5(s).hexdigest()
 #@+node:ekr.20120611094414.10582: *3* g_find_function_call
 def g_find_function_call (tree):
 
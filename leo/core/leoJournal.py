@@ -0,0 +1,315 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20140219061533.16790: * @file leoJournal.py
+'''
+A write-ahead journal of outline changes.
+
+The undoer tells the journal about every change it records, and about every
+undo and redo. The journal appends one line of json per change to a file in
+~/.leo/journal. A background thread writes and fsyncs the lines in batches,
+so the gui thread never waits for the disk.
+
+Saving the outline clears the journal. If a journal newer than the .leo file
+exists when the .leo file is opened, the replay-journal command applies the
+journal to the outline.
+
+Each line of the journal is a list:
+
+    ['b', gnx, body]            The body of node gnx changed.
+    ['n', gnx, headline, body]  The headline or body of node gnx changed.
+    ['c', gnx, [child gnxs]]    The children of node gnx changed.
+
+The gnx of the hidden root node is ''.
+'''
+
+#@@language python
+#@@tabwidth -4
+#@@pagewidth 70
+
+import leo.core.leoGlobals as g
+import leo.core.leoNodes as leoNodes
+
+import hashlib
+import json
+import os
+import threading
+
+#@+others
+#@+node:ekr.20140219061533.16791: ** class Journal
+class Journal:
+    '''A write-ahead journal of the changes to one outline.'''
+    #@+others
+    #@+node:ekr.20140219061533.16792: *3*  journal.ctor
+    def __init__ (self,c):
+
+        self.c = c
+        self.event = threading.Event() # Set to flush immediately.
+        self.fn = None # The name of the journal file.
+        self.flushInterval = 1.0 # Seconds between flushes.
+        self.known = set() # gnx's of all nodes in the .leo file.
+        self.lock = threading.Lock() # Protects the journal file.
+        self.pending = [] # Records not yet written.
+        self.pendingLock = threading.Lock() # Protects self.pending.
+        self.thread = None # The writer thread.
+    #@+node:ekr.20140219061533.16793: *3* journal.clear
+    def clear (self):
+
+        '''Called after the outline has been saved: delete the journal.'''
+
+        c = self.c
+        self.lock.acquire()
+        try:
+            self.pendingLock.acquire()
+            try:
+                self.pending = []
+            finally:
+                self.pendingLock.release()
+            if self.fn and g.os_path_exists(self.fn):
+                os.remove(self.fn)
+            # Save As may change the file name.
+            self.fn = self.journalFileName()
+            if self.fn and g.os_path_exists(self.fn):
+                os.remove(self.fn)
+        finally:
+            self.lock.release()
+        self.known = set([v.gnx for v in c.all_unique_nodes()])
+    #@+node:ekr.20140219061533.16794: *3* journal.journalFileName
+    def journalFileName (self):
+
+        '''Return the name of the journal file for c.mFileName.'''
+
+        c = self.c
+        if not c.mFileName:
+            return None
+        path = g.os_path_normcase(g.os_path_abspath(c.mFileName))
+        key = hashlib.md5(g.toEncodedString(path,'utf-8')).hexdigest()[:8]
+        return g.os_path_finalize_join(g.app.homeLeoDir,'journal',
+            '%s-%s.journal' % (g.shortFileName(c.mFileName),key))
+    #@+node:ekr.20140219061533.16795: *3* journal.open
+    def open (self):
+
+        '''Called after the outline has been read.'''
+
+        c = self.c
+        self.fn = fn = self.journalFileName()
+        self.known = set([v.gnx for v in c.all_unique_nodes()])
+        if not fn or not g.os_path_exists(fn):
+            return
+        if g.os_path_getmtime(fn) > g.os_path_getmtime(c.mFileName):
+            # New changes are appended to the existing journal.
+            g.es('unsaved changes to %s found in' % (c.shortFileName()),color='red')
+            g.es('%s' % fn,color='red')
+            g.es('use replay-journal to recover them',color='red')
+        else:
+            os.remove(fn) # The journal is obsolete.
+    #@+node:ekr.20140219061533.16796: *3* journal.record...
+    # These methods are called from the gui thread.
+    # They must be fast: they only append to self.pending.
+    # The writer thread takes the pending records, so all changes to
+    # self.pending happen with self.pendingLock held. This lock is never
+    # held while writing to the disk.
+    #@+node:ekr.20140219061533.16797: *4* journal.append
+    def append (self,record):
+
+        if not self.fn:
+            self.fn = self.journalFileName()
+            if not self.fn:
+                return # An untitled outline.
+        self.pendingLock.acquire()
+        try:
+            self.pending.append(record)
+        finally:
+            self.pendingLock.release()
+        if not self.thread:
+            self.thread = t = threading.Thread(target=self.writer)
+            t.daemon = True
+            t.start()
+    #@+node:ekr.20140219061533.16798: *4* journal.recordBead
+    def recordBead (self,bunch):
+
+        '''Record the changes made by the operation described by the bunch.'''
+
+        kind = getattr(bunch,'kind',None)
+        p = getattr(bunch,'p',None)
+        if kind == 'typing':
+            self.recordBody(p.v,p.v.b)
+        elif kind == 'node':
+            self.recordNode(p.v)
+        elif kind == 'afterGroup':
+            for bunch2 in bunch.items:
+                self.recordBead(bunch2)
+        elif kind in ('clone','delete','demote','insert','move','promote','sort'):
+            aList = [p.v,p._parentVnode()]
+            for ivar in ('newP','newParent','oldParent'):
+                p2 = getattr(bunch,ivar,None)
+                if p2:
+                    aList.append(p2.v)
+                    aList.append(p2._parentVnode())
+            for ivar in ('newParent_v','oldParent_v'):
+                aList.append(getattr(bunch,ivar,None))
+            self.recordChildren(aList)
+        elif kind == 'tree':
+            for p2 in p.self_and_subtree():
+                self.recordNode(p2.v)
+            self.recordChildren([p2.v for p2 in p.self_and_subtree()])
+        elif kind in ('clone-marked-nodes','delete-marked-nodes','move-marked-nodes'):
+            c = self.c
+            self.recordChildren([c.hiddenRootNode] + list(c.all_unique_nodes()))
+        # Hoists, marks and other beads do not change the outline.
+    #@+node:ekr.20140219061533.16799: *4* journal.recordBody
+    def recordBody (self,v,s):
+
+        '''Record a change to v's body, coalescing consecutive changes.'''
+
+        gnx = v.gnx
+        self.pendingLock.acquire()
+        try:
+            pending = self.pending
+            if pending and pending[-1][0] == 'b' and pending[-1][1] == gnx:
+                pending[-1] = ['b',gnx,s]
+                return
+        finally:
+            self.pendingLock.release()
+        self.append(['b',gnx,s])
+    #@+node:ekr.20140219061533.16800: *4* journal.recordChildren
+    def recordChildren (self,aList):
+
+        '''Record the children of all vnodes in aList.'''
+
+        c = self.c
+        seen = set()
+        for v in aList:
+            if v and v not in seen:
+                seen.add(v)
+                gnx = '' if v == c.hiddenRootNode else v.gnx
+                self.append(['c',gnx,[z.gnx for z in v.children]])
+                for child in v.children:
+                    self.recordNewTree(child)
+    #@+node:ekr.20140219061533.16801: *4* journal.recordNewTree
+    def recordNewTree (self,v):
+
+        '''Record v's subtree if v is not in the .leo file.'''
+
+        if v.gnx in self.known:
+            return
+        self.known.add(v.gnx)
+        self.recordNode(v)
+        if v.children:
+            self.append(['c',v.gnx,[z.gnx for z in v.children]])
+            for child in v.children:
+                self.recordNewTree(child)
+    #@+node:ekr.20140219061533.16802: *4* journal.recordNode
+    def recordNode (self,v):
+
+        self.append(['n',v.gnx,v.h,v.b])
+    #@+node:ekr.20140219061533.16803: *3* journal.replay & helper
+    def replay (self):
+
+        '''Apply all changes in the journal to the outline.'''
+
+        c = self.c ; fn = self.fn
+        if not fn or not g.os_path_exists(fn):
+            g.es('no journal for %s' % c.shortFileName(),color='blue')
+            return
+        self.flush()
+        d = dict([(v.gnx,v) for v in c.all_unique_nodes()])
+        d[''] = c.hiddenRootNode
+        n = 0
+        f = open(fn,'rb')
+        try:
+            for line in f.readlines():
+                try:
+                    record = json.loads(g.toUnicode(line,'utf-8'))
+                except ValueError:
+                    break # A partially written last line.
+                self.replayRecord(record,d)
+                n += 1
+        finally:
+            f.close()
+        self.known = set([v.gnx for v in c.all_unique_nodes()])
+        c.setChanged(True)
+        c.selectPosition(c.rootPosition())
+        c.redraw()
+        g.es('replayed %s changes from %s' % (n,fn),color='blue')
+    #@+node:ekr.20140219061533.16804: *4* journal.replayRecord
+    def replayRecord (self,record,d):
+
+        c = self.c
+        def getNode(gnx):
+            v = d.get(gnx)
+            if not v:
+                v = leoNodes.vnode(context=c)
+                v.fileIndex = g.app.nodeIndices.scanGnx(gnx,0)
+                d[gnx] = c.fileCommands.gnxDict[gnx] = v
+            return v
+        kind = record[0]
+        if kind == 'b':
+            v = getNode(record[1])
+            v.setBodyString(record[2])
+            v.setDirty()
+        elif kind == 'n':
+            v = getNode(record[1])
+            v.initHeadString(record[2])
+            v.setBodyString(record[3])
+            v.setDirty()
+        elif kind == 'c':
+            parent = getNode(record[1])
+            children = [getNode(z) for z in record[2]]
+            # Use the low-level link methods so all parent links stay valid.
+            for i in range(len(parent.children)-1,-1,-1):
+                parent.children[i]._cutLink(i,parent)
+            for i,child in enumerate(children):
+                child._addLink(i,parent)
+    #@+node:ekr.20140219061533.16805: *3* journal.writer & flush
+    def writer (self):
+
+        '''The body of the writer thread.'''
+
+        while True:
+            self.event.wait(self.flushInterval)
+            self.event.clear()
+            self.flush()
+
+    def flush (self):
+
+        '''Append all pending records to the journal file and fsync it.'''
+
+        # Take self.lock first, so records are written in order.
+        self.lock.acquire()
+        try:
+            self.pendingLock.acquire()
+            try:
+                records,self.pending = self.pending,[]
+            finally:
+                self.pendingLock.release()
+            if not records or not self.fn:
+                return
+            theDir = g.os_path_dirname(self.fn)
+            if not g.os_path_exists(theDir):
+                os.makedirs(theDir)
+            s = ''.join([json.dumps(z) + '\n' for z in records])
+            f = open(self.fn,'ab')
+            try:
+                f.write(g.toEncodedString(s,'utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+        except Exception:
+            # Never touch the gui here: this may be the writer thread.
+            g.pr('can not write journal: %s' % self.fn)
+        finally:
+            self.lock.release()
+    #@-others
+#@+node:ekr.20140219061533.16806: ** replay-journal
+@g.command('replay-journal')
+def replayJournal (event):
+
+    '''Apply unsaved changes recorded in the journal to the outline.'''
+
+    c = event['c']
+    if c.undoer.journal:
+        c.undoer.journal.replay()
+    else:
+        g.es('@bool journal_outline_changes = False',color='blue')
+#@-others
+#@-leo
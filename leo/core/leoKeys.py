@@ -12,7 +12,8 @@ import leo.core.leoGlobals as g
 
 import leo.external.codewise as codewise
 
-import glob
+import bisect
+import hashlib
 import inspect
 import os
 import re
@@ -58,7 +59,7 @@ import time
 #    (which depends on the type of the widget).
 #    
 #    To do this, k.getPaneBinding uses a **binding priority table**. This
-#    table is defined within k.getPaneBinding itself. The table indicates
+#    table is defined within k.computePaneBindings. The table indicates
 #    which of several possible bindings should have priority. For instance,
 #    if the widget is a text widget, a user binding for a 'text' widget takes
 #    priority over a default key binding. Similarly, if the widget is Leo's
@@ -67,6 +68,10 @@ import time
 #    priority table are open to debate, but in practice the resulting
 #    bindings are as expeced.
 #    
+#    k.computePaneBindings applies the table once for each kind of widget,
+#    creating a dispatch dict that k.getPaneBinding consults for each
+#    keystroke. Changing any binding clears these dicts.
+#    
 # B. If k.getPaneBinding finds a command associated with the incoming
 #    keystroke, k.masterKeyHandler calls k.masterCommand to execute the
 #    command. k.masterCommand handles many complex. See the source code for
@@ -181,6 +186,11 @@ class AutoCompleterClass:
         self.use_qcompleter = c.config.getBool('use_qcompleter',False)
             # True: show results in autocompleter tab.
             # False: show results in a QCompleter widget.
+        self.use_symbol_index = c.config.getBool('use_symbol_index',True)
+            # True: complete names defined in the outline without using codewise.
+
+        # The index of names defined in the outline, created on first use.
+        self.symbolIndex = None
     #@+node:ekr.20061031131434.8: *3* Top level (autocompleter)
     #@+node:ekr.20061031131434.9: *4* autoComplete
     def autoComplete (self,event=None,force=False):
@@ -634,12 +644,6 @@ class AutoCompleterClass:
         verbose = False # True: report hits and misses.  False: report misses.
         d = self.completionsDict
 
-        # Precompute the codewise completions for '.self'.
-        if not self.codewiseSelfList:
-            aList = self.get_codewise_completions('self.')
-            self.codewiseSelfList = [z[5:] for z in aList]
-            d ['self.'] = self.codewiseSelfList
-
         # Use the cached list if it exists.
         aList = d.get(prefix)
         if aList:
@@ -652,11 +656,27 @@ class AutoCompleterClass:
             # aList = self.get_leo_completions(prefix)
 
         # Always try the Leo completions first.
+        aList = self.get_leo_completions(prefix)
+        if aList:
+            d [prefix] = aList
+            return aList
+
+        # Next, try the symbol index.
+        # Don't cache the results: the index is updated as the outline changes.
+        if self.use_symbol_index:
+            aList = self.get_symbol_completions(prefix)
+            if aList:
+                return aList
+
         # Fall back to the codewise completions.
-        aList = (
-            self.get_leo_completions(prefix) or
-            self.get_codewise_completions(prefix)
-        )
+        # Precompute the codewise completions for '.self'.
+        if not self.codewiseSelfList:
+            aList = self.get_codewise_completions('self.')
+            self.codewiseSelfList = [z[5:] for z in aList]
+            d ['self.'] = self.codewiseSelfList
+            aList = d.get(prefix)
+            if aList: return aList
+        aList = self.get_codewise_completions(prefix)
 
         if trace: g.trace('**cash miss: %s' % (prefix))
         d [prefix] = aList
@@ -805,6 +825,28 @@ class AutoCompleterClass:
                 g.trace('len(aList): %3s, prefix: %s' % (len(aList),repr(prefix)))
 
         return aList
+    #@+node:ekr.20140219061533.16751: *5* get_symbol_completions
+    def get_symbol_completions(self,prefix):
+
+        '''Return completions for names defined in the outline.'''
+
+        c = self.c
+        if not self.symbolIndex:
+            self.symbolIndex = SymbolIndex(c)
+        index = self.symbolIndex
+        # The body of c.p changes as the user types.
+        index.updatePosition(c.p)
+        aList = prefix.split('.')
+        if len(aList) > 1:
+            varname = aList[-2]
+            if index.classDict.get(varname):
+                klass = varname
+            else:
+                kind,classes = self.guess_class(c,varname)
+                klass = classes and classes[0] or None
+        else:
+            klass = None
+        return index.completions(prefix,klass)
     #@+node:ekr.20110512090917.14466: *4* get_leo_namespace
     def get_leo_namespace (self,prefix):
 
@@ -1048,6 +1090,11 @@ class AutoCompleterClass:
         # We don't need to clear this now that we don't use ContextSniffer.
         # self.completionsDict = {}
 
+        if self.use_symbol_index:
+            if not self.symbolIndex:
+                self.symbolIndex = SymbolIndex(self.c)
+            self.symbolIndex.update()
+
         if self.use_qcompleter:
             self.init_qcompleter(event)
         else:
@@ -1117,6 +1164,357 @@ class ContextSniffer:
 
         vars.append(klass)
     #@-others
+#@+node:ekr.20140219061533.16736: ** class SymbolIndex
+class SymbolIndex:
+
+    '''
+    An index of the classes, functions, methods and ivars defined in the
+    python and javascript nodes of an outline.
+
+    The index is updated node by node: update visits all nodes, but it
+    rescans only nodes whose body text is not the text last scanned. This
+    catches all changes, including changes made by scripts, undo and
+    replace-all. The index persists in c.db between sessions: it is written
+    when the outline is saved or closed.
+    '''
+
+    #@+others
+    #@+node:ekr.20140219061533.16737: *3*  ctor (SymbolIndex)
+    def __init__ (self,c):
+
+        self.c = c
+        self.db = c.db # A PickleShareDB when caching is enabled.
+        self.dbKey = '_leo_symbol_index'
+        self.loaded = False
+            # True: the persistent index has been read from c.db.
+        self.changed = False
+            # True: the index must be written to c.db.
+        self.registered = False
+            # True: self.onHook has been registered.
+        self.useHooks = g.app.enableHooks and bool(g.app.config.use_plugins)
+            # False: hooks never fire, so update saves the index.
+        self.nodesDict = {}
+            # Keys are gnx's, values are lists [s,key,language,nodeClass,symbols].
+            # s is the body text that was scanned.
+            # key is (language,nodeClass) for the node's parent.
+        self.hashDict = {}
+            # Keys are gnx's, values are md5 hashes of the scanned body text.
+        self.classDict = {}
+            # Keys are class names, values are dicts of member name counts.
+        self.memberCounts = {}
+        self.memberNames = []   # Sorted list of all members of all classes.
+        self.topCounts = {}
+        self.topNames = []      # Sorted list of all classes and functions.
+        if self.useHooks:
+            self.registerHandlers()
+    #@+node:ekr.20140219061533.16938: *3* hooks (SymbolIndex)
+    hookTags = ('close-frame','save2')
+
+    def registerHandlers (self):
+
+        if not self.registered:
+            g.registerHandler(self.hookTags,self.onHook)
+            self.registered = True
+
+    def unregisterHandlers (self):
+
+        if self.registered:
+            g.unregisterHandler(self.hookTags,self.onHook)
+            self.registered = False
+
+    def onHook (self,tag,keywords):
+
+        '''Save the index when self.c is saved or closed.'''
+
+        c = self.c
+        if keywords.get('c') is not c:
+            return
+        if tag == 'save2':
+            if self.changed:
+                self.save()
+        elif tag == 'close-frame':
+            if self.changed:
+                self.save()
+            self.unregisterHandlers()
+    #@+node:ekr.20140219061533.16738: *3* Patterns (SymbolIndex)
+    language_pat = re.compile(r'^@language\s+(\w+)',re.MULTILINE)
+
+    # Python.
+    py_def_pat = re.compile(r'^([ \t]*)(class|def)\s+(\w+)')
+    py_ivar_pat = re.compile(r'\bself\.(\w+)\s*=[^=]')
+    py_others_pat = re.compile(r'^[ \t]*@others\b')
+
+    # Javascript.
+    js_function_pat = re.compile(r'\bfunction\s+(\w+)')
+    js_member_pat = re.compile(r'\b(\w+)\s*[:=]\s*function\b')
+    js_prototype_pat = re.compile(r'\b(\w+)\.prototype\.(\w+)\s*=')
+    js_this_pat = re.compile(r'\bthis\.(\w+)\s*=[^=]')
+    #@+node:ekr.20140219061533.16739: *3* completions (SymbolIndex)
+    def completions (self,prefix,klass=None):
+
+        '''
+        Return the sorted list of completions of prefix.
+
+        If prefix contains a period, complete the last component using the
+        members of klass, or the members of all classes if klass is None or
+        unknown. Otherwise, complete prefix using all classes and functions.
+        '''
+
+        i = prefix.rfind('.')
+        if i == -1:
+            aList,junk = g.itemsMatchingPrefixInSortedList(prefix,self.topNames)
+            return aList
+        head,tail = prefix[:i],prefix[i+1:]
+        d = klass and self.classDict.get(klass)
+        if d:
+            aList = [z for z in d if z.startswith(tail)]
+            aList.sort()
+        else:
+            aList,junk = g.itemsMatchingPrefixInSortedList(
+                tail,self.memberNames,matchEmptyPrefix=True)
+        return ['%s.%s' % (head,z) for z in aList]
+    #@+node:ekr.20140219061533.16740: *3* scan & helpers (SymbolIndex)
+    def scan (self,s,language,inherited):
+
+        '''
+        Scan body text s.
+
+        Return (nodeClass,symbols), where nodeClass is the class in effect for
+        s's descendants and symbols is a list of tuples (name,klass,member).
+        '''
+
+        if language == 'python':
+            return self.scanPython(s,inherited)
+        elif language == 'javascript':
+            return self.scanJavascript(s,inherited)
+        else:
+            return inherited,[]
+    #@+node:ekr.20140219061533.16741: *4* scanJavascript
+    def scanJavascript (self,s,inherited):
+
+        result = []
+        for m in self.js_function_pat.finditer(s):
+            result.append((m.group(1),'',False),)
+        for m in self.js_prototype_pat.finditer(s):
+            result.append((m.group(2),m.group(1),True),)
+        for pat in (self.js_member_pat,self.js_this_pat):
+            for m in pat.finditer(s):
+                result.append((m.group(1),inherited,True),)
+        return inherited,result
+    #@+node:ekr.20140219061533.16742: *4* scanPython
+    def scanPython (self,s,inherited):
+
+        '''Scan python code. Nested functions are ignored.'''
+
+        nodeClass,result,stack = inherited,[],[]
+            # stack contains (indent,kind,name) for enclosing classes and defs.
+        for line in g.splitLines(s):
+            m = self.py_def_pat.match(line)
+            if m:
+                indent,kind,name = len(m.group(1)),m.group(2),m.group(3)
+                while stack and stack[-1][0] >= indent:
+                    stack.pop()
+                if stack:
+                    if stack[-1][1] == 'class':
+                        result.append((name,stack[-1][2],True),)
+                    # else a nested class or def.
+                elif kind == 'def' and inherited:
+                    result.append((name,inherited,True),)
+                else:
+                    result.append((name,'',False),)
+                stack.append((indent,kind,name),)
+                continue
+            if self.py_others_pat.match(line):
+                classes = [z[2] for z in stack if z[1] == 'class']
+                if classes: nodeClass = classes[-1]
+                continue
+            if line.find('self.') > -1:
+                classes = [z[2] for z in stack if z[1] == 'class']
+                klass = classes[-1] if classes else inherited
+                if klass:
+                    for m in self.py_ivar_pat.finditer(line):
+                        result.append((m.group(1),klass,True),)
+        return nodeClass,result
+    #@+node:ekr.20140219061533.16743: *3* update & helpers (SymbolIndex)
+    def update (self):
+
+        '''
+        Visit all nodes, rescanning those whose body text has changed since
+        the last update. Comparing each body with the text last scanned is
+        fast: updateNode compares the strings by identity first.
+        '''
+
+        if not self.loaded:
+            self.load()
+        self.updateAll()
+        if self.changed and not self.useHooks:
+            self.save()
+    #@+node:ekr.20140219061533.16939: *4* updateAll
+    def updateAll (self):
+
+        '''Visit all nodes, rescanning those whose body text has changed.'''
+
+        c = self.c
+        seen = set()
+        language = c.target_language and c.target_language.lower() or 'python'
+        stack = [(v,language,'') for v in reversed(c.hiddenRootNode.children)]
+        while stack:
+            v,language,inherited = stack.pop()
+            if v.gnx in seen: continue
+            seen.add(v.gnx)
+            language,nodeClass = self.updateNode(v,language,inherited)
+            for child in reversed(v.children):
+                stack.append((child,language,nodeClass),)
+        # Forget deleted nodes.
+        for gnx in list(self.nodesDict.keys()):
+            if gnx not in seen:
+                self.setSymbols(gnx,[])
+                del self.nodesDict[gnx]
+                self.hashDict.pop(gnx,None)
+                self.changed = True
+    #@+node:ekr.20140219061533.16744: *4* addName & removeName
+    def addName (self,d,aList,name):
+
+        n = d.get(name,0)
+        d[name] = n + 1
+        if n == 0 and aList is not None:
+            bisect.insort(aList,name)
+
+    def removeName (self,d,aList,name):
+
+        n = d.get(name,0)
+        if n > 1:
+            d[name] = n - 1
+        elif n == 1:
+            del d[name]
+            if aList is not None:
+                i = bisect.bisect_left(aList,name)
+                if i < len(aList) and aList[i] == name:
+                    del aList[i]
+    #@+node:ekr.20140219061533.16745: *4* languageForNode
+    def languageForNode (self,v,language):
+
+        '''Return the language in effect in v, given the language in effect in v's parent.'''
+
+        if v.isAnyAtFileNode():
+            junk,ext = g.os_path_splitext(v.anyAtFileNodeName())
+            language = g.app.extension_dict.get(ext[1:]) or language
+        m = self.language_pat.search(v.b)
+        if m:
+            language = m.group(1).lower()
+        return language
+    #@+node:ekr.20140219061533.16746: *4* load & save
+    def load (self):
+
+        '''Init self.hashDict and self.nodesDict from self.db.'''
+
+        self.loaded = True
+        try:
+            d = self.db.get(self.dbKey) or {}
+        except Exception:
+            d = {}
+        for gnx,data in d.items():
+            try:
+                h,key,language,nodeClass,symbols = data
+            except Exception:
+                continue # Ignore entries in old formats.
+            # The body text is not known: updateNode will compare hashes.
+            self.nodesDict[gnx] = [None,key,language,nodeClass,[]]
+            self.hashDict[gnx] = h
+            self.setSymbols(gnx,symbols)
+
+    def save (self):
+
+        '''Write the index to self.db.'''
+
+        d = {}
+        for gnx,data in self.nodesDict.items():
+            s,key,language,nodeClass,symbols = data
+            d[gnx] = self.hashDict.get(gnx),key,language,nodeClass,symbols
+        try:
+            self.db[self.dbKey] = d
+        except Exception:
+            pass # Caching may be disabled.
+        self.changed = False
+    #@+node:ekr.20140219061533.16747: *4* setSymbols
+    def setSymbols (self,gnx,symbols):
+
+        '''Replace the symbols for the node whose gnx is given.'''
+
+        data = self.nodesDict.get(gnx)
+        if data:
+            for name,klass,member in data[4]:
+                if member:
+                    self.removeName(self.memberCounts,self.memberNames,name)
+                    d = self.classDict.get(klass)
+                    if d is not None:
+                        self.removeName(d,None,name)
+                        if not d: del self.classDict[klass]
+                else:
+                    self.removeName(self.topCounts,self.topNames,name)
+            data[4] = symbols
+        for name,klass,member in symbols:
+            if member:
+                self.addName(self.memberCounts,self.memberNames,name)
+                if klass:
+                    d = self.classDict.get(klass)
+                    if d is None:
+                        d = self.classDict[klass] = {}
+                    self.addName(d,None,name)
+            else:
+                self.addName(self.topCounts,self.topNames,name)
+    #@+node:ekr.20140219061533.16748: *4* updateNode
+    def updateNode (self,v,language,inherited):
+
+        '''
+        Update the index for v if v's body text has changed.
+
+        language and inherited are the language and class in effect in v's parent.
+        Return (language,nodeClass) for v's children.
+        '''
+
+        s = v.b
+        key = language,inherited
+        data = self.nodesDict.get(v.gnx)
+        if data and data[1] == key:
+            if data[0] is s:
+                return data[2],data[3]
+            if data[0] is None and self.hash(s) == self.hashDict.get(v.gnx):
+                # The data came from c.db.
+                data[0] = s
+                return data[2],data[3]
+        language = self.languageForNode(v,language)
+        nodeClass,symbols = self.scan(s,language,inherited)
+        if data:
+            data[0:4] = [s,key,language,nodeClass]
+        else:
+            self.nodesDict[v.gnx] = [s,key,language,nodeClass,[]]
+        self.setSymbols(v.gnx,symbols)
+        self.hashDict[v.gnx] = self.hash(s)
+        self.changed = True
+        return language,nodeClass
+    #@+node:ekr.20140219061533.16749: *4* updatePosition
+    def updatePosition (self,p):
+
+        '''Update the index for p.v only, for example, after typing in p's body.'''
+
+        if not self.loaded:
+            self.update()
+            return
+        parent = p.parent()
+        data = parent and self.nodesDict.get(parent.v.gnx)
+        if data:
+            language,inherited = data[2],data[3]
+        else:
+            language = g.scanForAtLanguage(self.c,parent) if parent else None
+            language = language or self.c.target_language or 'python'
+            inherited = ''
+        self.updateNode(p.v,language.lower(),inherited)
+    #@+node:ekr.20140219061533.16750: *4* hash
+    def hash (self,s):
+
+        return hashlib.md5(g.toEncodedString(s,'utf-8')).hexdigest()
+    #@-others
 #@+node:ekr.20061031131434.74: ** class keyHandlerClass
 class keyHandlerClass:
 
@@ -1198,9 +1596,25 @@ class keyHandlerClass:
         # Previously defined binding tags.
         self.bindtagsDict = {}
             # Keys are strings (the tag), values are 'True'
+        self.special_keys = (
+            'Alt_L','Alt_R',
+            'Caps_Lock','Control_L','Control_R',
+            'Meta_L','Meta_R', # Meta support.
+            'Num_Lock',
+            'Shift_L','Shift_R',
+            'Win_L','Win_R',
+        )
+            # Keys ignored by k.masterKeyHandler.
         self.masterBindingsDict = {}
             # Keys are scope names: 'all','text',etc. or mode names.
             # Values are dicts: keys are strokes, values are ShortcutInfo's.
+        self.pane_names = ('body','head','canvas','log')
+            # The widget-name prefixes that affect k.getPaneBinding.
+        self.paneBindingsDict = {}
+            # The dispatch tables used by k.getPaneBinding.
+            # Keys are (pane names,unboundKeyAction,isTextWidget) tuples.
+            # Values are dicts: keys are strokes, values are ShortcutInfo's.
+            # Cleared whenever k.bindKeyToDict or k.makeAllBindings change bindings.
         self.masterGuiBindingsDict = {}
             # Keys are strokes; value is True;
 
@@ -1226,6 +1640,17 @@ class keyHandlerClass:
         self.mb_tabListIndex = -1
         self.mb_prompt = ''
 
+        # For tab completion...
+        self.commandNamesList = None
+            # A sorted list of all command names, computed by k.getCommandNames.
+        self.commandNamesKey = None
+            # The (id,len) of c.commandsDict when commandNamesList was computed.
+            # Code that changes c.commandsDict must call k.invalidateCommandNames.
+        self.mb_completionCache = None
+            # (aList,prefix,matches) for the last prefix completed.
+        self.fileNameCompletionDict = {}
+            # Keys are directories, values are sorted lists of their contents.
+
         self.func = None
         self.previous = []
         self.stroke = None
@@ -1347,6 +1772,7 @@ class keyHandlerClass:
         self.enable_calltips                = getBool('enable_calltips_initially')
         self.ignore_caps_lock               = getBool('ignore_caps_lock')
         self.ignore_unbound_non_ascii_keys  = getBool('ignore_unbound_non_ascii_keys')
+        self.minibuffer_substring_completion = getBool('minibuffer_substring_completion')
         self.minibuffer_background_color    = getColor('minibuffer_background_color') or 'lightblue'
         self.minibuffer_foreground_color    = getColor('minibuffer_foreground_color') or 'black'
         self.minibuffer_warning_color       = getColor('minibuffer_warning_color') or 'lightgrey'
@@ -1784,6 +2210,7 @@ class keyHandlerClass:
         d = k.masterBindingsDict.get(pane,{})
         d[stroke] = si
         k.masterBindingsDict [pane] = d
+        k.paneBindingsDict = {}
     #@+node:ekr.20061031131434.94: *5* k.bindOpenWith
     def bindOpenWith (self,d):
 
@@ -1887,6 +2314,7 @@ class keyHandlerClass:
             if func:
                 # g.trace(key,commandName,func.__name__)
                 c.commandsDict [key] = func
+                k.invalidateCommandNames()
                 # k.inverseCommandsDict[func.__name__] = key
             else:
                 g.warning('bad abbrev:',key,'unknown command name:',commandName)
@@ -1923,6 +2351,7 @@ class keyHandlerClass:
 
         k = self ; c = k.c
         k.bindingsDict = {}
+        k.paneBindingsDict = {}
         if g.new_modes:
             k.modeController.addModeCommands()
         else:
@@ -2054,11 +2483,11 @@ class keyHandlerClass:
                 k.callAltXFunction(k.mb_event)
         elif char in ('\t','Tab'):
             if trace and verbose: g.trace('***Tab')
-            k.doTabCompletion(list(c.commandsDict.keys()),allow_empty_completion=True)
+            k.doTabCompletion(k.getCommandNames(),allow_empty_completion=True)
             c.minibufferWantsFocus()
         elif char in ('\b','BackSpace'):
             if trace and verbose: g.trace('***BackSpace')
-            k.doBackSpace(list(c.commandsDict.keys()))
+            k.doBackSpace(k.getCommandNames())
             c.minibufferWantsFocus()
         elif k.ignore_unbound_non_ascii_keys and len(ch) > 1:
             # g.trace('non-ascii')
@@ -2100,7 +2529,7 @@ class keyHandlerClass:
         else:
             if 1: # Useful.
                 if trace: g.trace('*** tab completion')
-                k.doTabCompletion(list(c.commandsDict.keys()))
+                k.doTabCompletion(k.getCommandNames())
             else: # Annoying.
                 k.keyboardQuit()
                 k.setLabel('Command does not exist: %s' % commandName)
@@ -2466,7 +2895,7 @@ class keyHandlerClass:
             #@+node:ekr.20061031131434.129: *5* << init altX vars >> k.getArg
             k.argSelectedText = c.frame.body.bodyCtrl.getSelectedText()
                 # 2010/09/01: remember the selected text for abbreviations.
-            k.argTabList = tabList and tabList[:] or []
+            k.argTabList = tabList and sorted(tabList) or []
             k.arg_completion = completion
             # g.trace('completion',completion,'tabList',tabList)
 
@@ -2578,7 +3007,7 @@ class keyHandlerClass:
             # c.minibufferWantsFocus()
         elif char in ('\b','BackSpace'):
             if trace and verbose: g.trace('***BackSpace')
-            k.doBackSpace(list(c.commandsDict.keys()))
+            k.doBackSpace(k.getCommandNames())
         elif k.ignore_unbound_non_ascii_keys and len(ch) > 1:
             if trace: g.trace('non-ascii')
             if specialStroke:
@@ -2719,6 +3148,7 @@ class keyHandlerClass:
         assert not g.isStroke(shortcut)
 
         c.commandsDict [commandName] = func
+        k.invalidateCommandNames()
         fname = func.__name__
         k.inverseCommandsDict [fname] = commandName
         if trace and fname != 'minibufferCallback':
@@ -2762,6 +3192,7 @@ class keyHandlerClass:
                 for key in d:
                     if d.get(key) == commandName:
                         c.commandsDict [key] = c.commandsDict.get(commandName)
+                        k.invalidateCommandNames()
                         break
     #@+node:ekr.20061031131434.127: *4* k.simulateCommand
     def simulateCommand (self,commandName):
@@ -2949,20 +3380,10 @@ class keyHandlerClass:
         stroke = event and event.stroke or None
         # w_name = c.widget_name(w)
         state = k.state.kind
-        special_keys = (
-            'Alt_L','Alt_R',
-            'Caps_Lock','Control_L','Control_R',
-            'Meta_L','Meta_R', # Meta support.
-            'Num_Lock',
-            'Shift_L','Shift_R',
-            'Win_L','Win_R',
-        )
-
         self.master_key_count += 1
-        isPlain =  k.isPlainKey(stroke)
         #@-<< define vars >>
         assert g.isStrokeOrNone(stroke)
-        if char in special_keys:
+        if char in self.special_keys:
             if trace and verbose: g.trace('char',char)
             return None
 
@@ -2990,7 +3411,7 @@ class keyHandlerClass:
         if traceGC: g.printNewObjects('masterKey 2')
 
         # 2011/02/08: An important simplification.
-        if isPlain and k.unboundKeyAction != 'command':
+        if k.unboundKeyAction != 'command' and k.isPlainKey(stroke):
             if self.isAutoCompleteChar(stroke):
                 if trace: g.trace('autocomplete key',stroke)
             else:
@@ -3096,17 +3517,37 @@ class keyHandlerClass:
             else:
                 if trace: g.trace('No state handler for %s' % state)
             return True
-    #@+node:ekr.20091230094319.6240: *5* getPaneBinding
+    #@+node:ekr.20091230094319.6240: *5* getPaneBinding & helper
     def getPaneBinding (self,stroke,w):
 
+        '''
+        Return the ShortcutInfo bound to stroke in widget w, or None.
+
+        The result depends only on the kind of widget, so all lookups go
+        through a precomputed dispatch table for that kind.
+        '''
         trace = False and not g.unitTesting
-        verbose = True
         k = self ; w_name = k.c.widget_name(w)
-        # keyStatesTuple = ('command','insert','overwrite')
-        state = k.unboundKeyAction
         assert g.isStroke(stroke)
-        if trace: g.trace('w_name',repr(w_name),'stroke',stroke,'w',w,
-            'isTextWidget(w)',g.app.gui.isTextWidget(w))
+        names = tuple([z for z in self.pane_names if w_name.startswith(z)])
+        key = names,k.unboundKeyAction,g.app.gui.isTextWidget(w)
+        d = k.paneBindingsDict.get(key)
+        if d is None:
+            d = k.paneBindingsDict[key] = k.computePaneBindings(*key)
+        si = d.get(stroke)
+        if trace: g.trace('w_name',repr(w_name),'stroke',stroke,
+            'found',si and si.commandName)
+        return si
+    #@+node:ekr.20140219061533.16719: *6* computePaneBindings
+    def computePaneBindings (self,names,state,isTextWidget):
+
+        '''
+        Return a dict for k.getPaneBinding: keys are strokes, values are
+        ShortcutInfo's. names is a tuple of the pane names that the
+        widget's name starts with.
+        '''
+        k = self ; result = {}
+        table = ('previous-line','next-line',)
         for key,name in (
             # Order here is similar to bindtags order.
             ('command',None),
@@ -3123,32 +3564,23 @@ class keyHandlerClass:
             ('all',None),
         ):
             if (
-                # key in keyStatesTuple and isPlain and k.unboundKeyAction == key or
-                name and w_name.startswith(name) or
+                name and name in names or
                 key in ('command','insert','overwrite') and state == key or # 2010/02/09
-                key in ('text','all') and g.app.gui.isTextWidget(w) or
+                key in ('text','all') and isTextWidget or
                 key in ('button','all')
             ):
                 d = k.masterBindingsDict.get(key,{})
-                if trace and verbose:
-                    # g.trace('key',key,'name',name,'stroke',stroke,'stroke in d.keys',stroke in d)
-                    g.trace('key: %7s name: %6s stroke: %10s in keys: %s' %
-                        (key,name,stroke,stroke in d))
-                    # g.trace(key,'keys',g.listToString(list(d.keys()),sort=True)) # [:5])
-                if d:
-                    si = d.get(stroke)
-                    if si:
-                        assert si.stroke == stroke,'si: %s stroke: %s' % (si,stroke)
-                            # masterBindingsDict: keys are KeyStrokes
-                        assert g.isShortcutInfo(si),si
-                        table = ('previous-line','next-line',)
-                        if key == 'text' and name == 'head' and si.commandName in table:
-                            if trace: g.trace('***** special case',si.commandName)
-                        else:
-                            if trace: g.trace('key: %7s name: %6s  found %s = %s' % (
-                                key,name,repr(si.stroke),si.commandName))
-                            return si
-        return None
+                for stroke,si in d.items():
+                    assert si.stroke == stroke,'si: %s stroke: %s' % (si,stroke)
+                        # masterBindingsDict: keys are KeyStrokes
+                    assert g.isShortcutInfo(si),si
+                    if stroke in result:
+                        pass # An earlier scope takes precedence.
+                    elif key == 'text' and name == 'head' and si.commandName in table:
+                        pass # Special case: let tree bindings handle these.
+                    else:
+                        result[stroke] = si
+        return result
     #@+node:ekr.20061031131434.152: *5* handleMiniBindings
     def handleMiniBindings (self,event,state,stroke):
 
@@ -3446,6 +3878,7 @@ class keyHandlerClass:
                 k.enterNamedMode(event,name)
 
             c.commandsDict[key] = f = enterModeCallback
+            k.invalidateCommandNames()
             k.inverseCommandsDict [f.__name__] = key
             if trace: g.trace(f.__name__,key,'len(c.commandsDict.keys())',len(list(c.commandsDict.keys())))
     #@+node:ekr.20061031131434.157: *4* k.badMode
@@ -3761,17 +4194,23 @@ class keyHandlerClass:
                     # Careful: k.initMode can execute commands that will destroy a commander.
                     # if g.app.quitting or not c.exists: return
     #@+node:ekr.20061031131434.167: *3* k.Shared helpers
-    #@+node:ekr.20061031131434.175: *4* k.computeCompletionList
+    #@+node:ekr.20061031131434.175: *4* k.computeCompletionList & helper
     # Important: this code must not change mb_tabListPrefix.  Only doBackSpace should do that.
 
     def computeCompletionList (self,defaultTabList,backspace,allow_empty_completion=False):
 
+        '''
+        Compute k.mb_tabList, the items of defaultTabList that match the minibuffer.
+
+        defaultTabList must be sorted: see k.getCommandNames.
+        '''
+
         trace = False and not g.unitTesting
         k = self ; c = k.c ; s = k.getLabel() ; tabName = 'Completion'
         command = s [len(k.mb_prompt):]
             # s always includes prefix, so command is well defined.
 
-        k.mb_tabList,common_prefix = g.itemsMatchingPrefixInList(command,defaultTabList)
+        k.mb_tabList,common_prefix = k.computeCompletionMatches(command,defaultTabList)
         c.frame.log.clearTab(tabName)
 
         if trace:
@@ -3786,7 +4225,7 @@ class keyHandlerClass:
                 g.es('','\n',tabName=tabName)
             else:
                 # 2012/05/20: Return *all* completions if the command is empty.
-                k.mb_tabList = sorted(defaultTabList)
+                k.mb_tabList = defaultTabList[:]
                 common_prefix = ''
 
         if k.mb_tabList:
@@ -3809,6 +4248,32 @@ class keyHandlerClass:
             aList = ['%*s %s' % (-n,s1,s2) for s1,s2 in data]
             g.es('','\n'.join(aList),tabName=tabName)
         c.bodyWantsFocus()
+    #@+node:ekr.20140219061533.16731: *5* k.computeCompletionMatches
+    def computeCompletionMatches (self,prefix,aList):
+
+        '''
+        Return (matches,common_prefix) for the sorted list aList.
+
+        When prefix extends the previous prefix, search only the previous
+        matches. If nothing starts with prefix and
+        @bool minibuffer_substring_completion is True, return the items
+        containing prefix, earliest occurrences first.
+        '''
+
+        k = self
+        cache = k.mb_completionCache
+        if cache and cache[0] is aList and prefix.startswith(cache[1]):
+            matches = cache[2] # Still sorted.
+        else:
+            matches = aList
+        matches,common_prefix = g.itemsMatchingPrefixInSortedList(prefix,matches)
+        # An empty prefix matches nothing, so it can't be narrowed.
+        k.mb_completionCache = (aList,prefix,matches) if prefix else None
+        if not matches and prefix and k.minibuffer_substring_completion:
+            aList2 = [(z.find(prefix),z) for z in aList if prefix in z]
+            matches = [z for i,z in sorted(aList2)]
+            common_prefix = prefix # Don't change the minibuffer.
+        return matches,common_prefix
     #@+node:ekr.20061031131434.177: *4* k.doBackSpace
     # Used by getArg and fullCommand.
 
@@ -3865,6 +4330,30 @@ class keyHandlerClass:
                     allow_empty_completion=allow_empty_completion)
 
         c.minibufferWantsFocus()
+    #@+node:ekr.20140219061533.16733: *4* k.getCommandNames
+    def getCommandNames (self):
+
+        '''Return a sorted list of all command names.
+
+        Callers must not change the list. Code that changes c.commandsDict
+        must call k.invalidateCommandNames. As a fallback for plugins that
+        don't, the list is also recomputed when the size of c.commandsDict
+        changes.'''
+
+        k = self ; d = k.c.commandsDict
+        key = id(d),len(d)
+        if k.commandNamesList is None or k.commandNamesKey != key:
+            k.commandNamesList = sorted(d.keys())
+            k.commandNamesKey = key
+        return k.commandNamesList
+    #@+node:ekr.20140219061533.16957: *4* k.invalidateCommandNames
+    def invalidateCommandNames (self):
+
+        '''Recompute the list of command names the next time it is needed.
+
+        Call this after changing c.commandsDict.'''
+
+        self.commandNamesList = None
     #@+node:ekr.20061031131434.168: *4* k.getFileName & helpers
     def getFileName (self,event=None,handler=None,prefix='',filterExt='.leo'):
 
@@ -3882,6 +4371,7 @@ class keyHandlerClass:
             #@+<< init altX vars >>
             #@+node:ekr.20061031131434.169: *5* << init altX vars >>
             k.filterExt = filterExt
+            k.fileNameCompletionDict = {}
             k.mb_prefix = (prefix or k.getLabel())
             k.mb_prompt = prefix or k.getLabel()
             k.mb_tabList = []
@@ -3951,15 +4441,21 @@ class keyHandlerClass:
 
         if k.mb_tabList:
             k.setLabel(k.mb_prompt + common_prefix)
-    #@+node:ekr.20061031131434.173: *5* k.computeFileNameCompletionList
+    #@+node:ekr.20061031131434.173: *5* k.computeFileNameCompletionList & helper
     # This code must not change mb_tabListPrefix.
     def computeFileNameCompletionList (self):
 
         k = self ; c = k.c ; tabName = 'Completion'
         path = k.getLabel(ignorePrompt=True)
         sep = os.path.sep
+        theDir,prefix = os.path.split(path)
+        names,junk = g.itemsMatchingPrefixInSortedList(
+            prefix,k.listDirForCompletion(theDir),matchEmptyPrefix=True)
         tabList = []
-        for f in glob.glob(path+'*'):
+        for name in names:
+            if name.startswith('.') and not prefix.startswith('.'):
+                continue # As glob.glob does.
+            f = g.os_path_join(theDir,name) if theDir else name
             if g.os_path_isdir(f):
                 tabList.append(f + sep)
             else:
@@ -3972,6 +4468,20 @@ class keyHandlerClass:
             c.frame.log.clearTab(tabName)
             k.showFileNameTabList()
         return common_prefix
+    #@+node:ekr.20140219061533.16732: *6* k.listDirForCompletion
+    def listDirForCompletion (self,theDir):
+
+        '''Return the sorted contents of theDir, using k.fileNameCompletionDict.'''
+
+        k = self
+        aList = k.fileNameCompletionDict.get(theDir)
+        if aList is None:
+            try:
+                aList = sorted(os.listdir(theDir or os.curdir))
+            except OSError:
+                aList = []
+            k.fileNameCompletionDict[theDir] = aList
+        return aList
     #@+node:ekr.20061031131434.174: *5* k.showFileNameTabList
     def showFileNameTabList (self):
 
@@ -4768,6 +5278,7 @@ class ModeInfo:
             self.enterMode()
 
         c.commandsDict[key] = f = enterModeCallback
+        k.invalidateCommandNames()
         k.inverseCommandsDict [f.__name__] = key
 
         g.trace('(ModeInfo)',f.__name__,key,'len(c.commandsDict.keys())',len(list(c.commandsDict.keys())))
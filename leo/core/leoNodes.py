@@ -17,6 +17,7 @@ import copy
 import time
 import re
 import itertools
+import weakref
 
 if use_zodb:
     # It may be important to import ZODB first.
@@ -533,10 +534,7 @@ class position (object):
            with_proto=False - include 'file://'
         """
 
-        UNL = '-->'.join(reversed([
-            i.h.replace('-->', '--%3E')
-            for i in self.self_and_parents()
-        ]))  
+        UNL = self.v.context.unlCache.get_UNL(self)
 
         if with_proto:
             return ("file://%s#%s" % (self.v.context.fileName(), UNL)).replace(' ', '%20')
@@ -870,10 +868,12 @@ class position (object):
         if setDescendentsDirty:
             # **Important**: only mark _direct_ descendents of nodes.
             # Using the findAllPotentiallyDirtyNodes algorithm would mark way too many nodes.
+            seen = set(nodes)
             for p2 in p.subtree():
                 # Only @thin nodes need to be marked.
-                if p2.v not in nodes and p2.isAnyAtFileNode():
+                if p2.v not in seen and p2.isAnyAtFileNode():
                         # Bug fix: 2011/07/05: was p2.isAtThinFileNode():
+                    seen.add(p2.v)
                     nodes.append(p2.v)
         if trace and verbose:
             for v in nodes:
@@ -1133,6 +1133,7 @@ class position (object):
     def copyTreeFromSelfTo(self,p2):
         p = self
         p2.v._headString = p.h
+        p2.v.context.headlineVersion += 1 # Invalidate c.unlCache.
         p2.v._bodyString = p.b
         # 2013/09/08: Fix bug 1019794: p.copyTreeFromSelfTo, should deepcopy p.v.u.
         p2.v.u = copy.deepcopy(p.v.u)
@@ -1883,6 +1884,218 @@ class poslist(list):
         return res
 
     #@-others
+#@+node:ekr.20140219061533.16829: ** class unlCache
+class unlCache (object):
+
+    """
+    A class that resolves UNLs (headlines joined by '-->') for one commander.
+
+    For every vnode whose children have been searched, self.index maps the
+    headlines of the children to their child indices. Together these dicts
+    form a trie over headline paths, shared by all clones of a node, so
+    finding a UNL takes O(depth) dict lookups.
+    """
+
+    #@+others
+    #@+node:ekr.20140219061533.16830: *3*  unlCache.ctor
+    def __init__ (self,c):
+
+        self.c = c
+        self.headlineVersion = None
+            # The value of c.headlineVersion when the caches were computed.
+        self.index = {}
+            # Keys are vnodes, values are tuples (children,n,d).
+            # children is v.children and n is len(children) when d was computed.
+            # d is a dict: keys are headlines, values are lists of child indices.
+            # Like v.indexOfChild, childIndices checks the children at these
+            # indices before using them.
+        self.unls = {}
+            # Keys are tuples (v,stack), values are UNL's, without the file name.
+    #@+node:ekr.20140219061533.16831: *3* unlCache.check & childIndices
+    def check (self):
+
+        """Clear all caches if any headline has changed."""
+
+        c = self.c
+        if self.headlineVersion != c.headlineVersion:
+            self.headlineVersion = c.headlineVersion
+            self.index = {}
+            self.unls = {}
+
+    def childIndices (self,v,h):
+
+        """Return the list of indices of v's children whose headline is h."""
+
+        children = v.children
+        data = self.index.get(v)
+        if data and data[0] is children and data[1] == len(children):
+            aList = data[2].get(h,[])
+            for i in aList:
+                if children[i].h != h:
+                    break # A child has moved.
+            else:
+                return aList
+        # Links have changed: recompute the entry.
+        d = {}
+        for i,child in enumerate(children):
+            h2 = child.h
+            aList = d.get(h2)
+            if aList: aList.append(i)
+            else: d[h2] = [i]
+        self.index[v] = children,len(children),d
+        return d.get(h,[])
+    #@+node:ekr.20140219061533.16832: *3* unlCache.find & helper
+    def find (self,unlList):
+
+        """
+        Find the position matching unlList, a list of headlines.
+
+        Return (found,maxdepth,maxp), as g.recursiveUNLFind does. If found
+        is False, maxp is the first deepest partial match.
+        """
+
+        self.check()
+        unlList = [z.replace('--%3E','-->') for z in unlList if z.strip()]
+            # Drop empty parts so "-->node name" works.
+        if not unlList:
+            return False,0,None
+        partial = [0,None] # The maxdepth and maxp of partial matches.
+        p = self.findHelper(unlList,0,self.c.hiddenRootNode,[],partial)
+        if p:
+            return True,partial[0],p
+        else:
+            return False,partial[0],partial[1]
+
+    def findHelper (self,unlList,depth,parent_v,stack,partial):
+
+        h = unlList[depth]
+        for n in self.childIndices(parent_v,h):
+            v = parent_v.children[n]
+            if depth+1 == len(unlList):
+                return position(v,n,stack[:])
+            if partial[0] < depth+1:
+                partial[0] = depth+1
+                partial[1] = position(v,n,stack[:])
+            stack.append((v,n),)
+            p = self.findHelper(unlList,depth+1,v,stack,partial)
+            stack.pop()
+            if p: return p
+        return None
+    #@+node:ekr.20140219061533.16833: *3* unlCache.get_UNL
+    def get_UNL (self,p):
+
+        """Return the UNL of p, without the file name."""
+
+        self.check()
+        key = p.v,tuple(p.stack)
+        unl = self.unls.get(key)
+        if unl is None:
+            aList = [v.h for v,n in p.stack]
+            aList.append(p.v.h)
+            unl = self.unls[key] = '-->'.join([z.replace('-->','--%3E') for z in aList])
+        return unl
+    #@-others
+#@+node:ekr.20140219061533.16879: ** class gnxIndex
+class gnxIndex (object):
+
+    """
+    An index of the vnodes of all open commanders, keyed by gnx.
+
+    Setting v.fileIndex adds v to g.app.gnxIndex, so the index never needs
+    to be rebuilt. The index holds only weak references: deleted vnodes
+    disappear from the index when they are garbage collected.
+
+    Deleted vnodes may live on in undo beads, and several vnodes may share
+    a gnx while outlines are being read or pasted. find returns only vnodes
+    that are linked into an open outline, so the index is always safe.
+    Commanders opened with leoBridge are open outlines too, even though
+    their frames are not in g.app.windowList.
+    """
+
+    #@+others
+    #@+node:ekr.20140219061533.16880: *3*  gnxIndex.ctor
+    def __init__ (self):
+
+        self.d = weakref.WeakValueDictionary()
+            # Keys are gnx's, values are the most recently added vnode.
+        self.others = {}
+            # Keys are gnx's, values are WeakSets of other vnodes with that gnx.
+    #@+node:ekr.20140219061533.16881: *3* gnxIndex.add
+    def add (self,v):
+
+        """Add v to the index, using v's present gnx."""
+
+        gnx = v.gnx
+        v2 = self.d.get(gnx)
+        if v2 is not None and v2 is not v:
+            aSet = self.others.get(gnx)
+            if aSet is None:
+                aSet = self.others[gnx] = weakref.WeakSet()
+            aSet.add(v2)
+        self.d[gnx] = v
+    #@+node:ekr.20140219061533.16882: *3* gnxIndex.find & helpers
+    def find (self,gnx,c=None):
+
+        """
+        Return the vnode whose gnx is gnx, or None.
+
+        If c is given, return only a vnode in c's outline. Otherwise,
+        return a vnode in the outline of any open commander.
+        """
+
+        v = self.d.get(gnx)
+        if v is not None and self.isValid(v,gnx,c):
+            return v
+        aSet = self.others.get(gnx)
+        if aSet:
+            for v in list(aSet):
+                if self.isValid(v,gnx,c):
+                    return v
+            if not aSet:
+                del self.others[gnx]
+        return None
+
+    def isValid (self,v,gnx,c):
+
+        """Return True if v has the given gnx and is in an open outline."""
+
+        if v.gnx != gnx:
+            return False # The gnx has changed since v was added.
+        context = v.context
+        if c:
+            if context is not c:
+                return False
+        elif not context or not getattr(context,'exists',False):
+            return False # Closed frames clear c.exists.
+        return self.isInOutline(v)
+
+    def isInOutline (self,v):
+
+        """Return True if v is linked to the hidden root of its commander."""
+
+        root = v.context and v.context.hiddenRootNode
+        if not root or v is root:
+            return False
+        seen = set()
+        while v.parents:
+            if v in seen:
+                return False
+            seen.add(v)
+            v = v.parents[0]
+            if v is root:
+                return True
+        return False
+    #@+node:ekr.20140219061533.16883: *3* gnxIndex.findPosition
+    def findPosition (self,gnx,c=None):
+
+        """Return the first position whose gnx is gnx, or None."""
+
+        v = self.find(gnx,c)
+        if v:
+            p = v.context.vnode2position(v)
+            if p: return p
+        return None
+    #@-others
 #@+node:ekr.20031218072017.3341: ** class vnode
 if use_zodb and ZODB:
     class baseVnode (ZODB.Persistence.Persistent):
@@ -1925,10 +2138,12 @@ class vnode (baseVnode):
         # Structure data...
         self.children = [] # Ordered list of all children of this node.
         self.parents = [] # Unordered list of all parents of this node.
+        self._childIndexDict = None # Set by v.indexOfChild.
         # Other essential data...
         self.fileIndex = g.app.nodeIndices.getNewIndex()
             # The immutable file index for this vnode.
             # New in Leo 4.6 b2: allocate gnx (fileIndex) immediately.
+            # The fileIndex property adds the vnode to g.app.gnxIndex.
         self.iconVal = 0 # The present value of the node's icon.
         self.statusBits = 0 # status bits
         # Information that is never written to any file...
@@ -2154,6 +2369,33 @@ class vnode (baseVnode):
         return len(v.children) > 0
 
     hasFirstChild = hasChildren
+    #@+node:ekr.20140219061533.16877: *5* v.indexOfChild
+    def indexOfChild (self,child):
+
+        '''
+        Return the index of child in v.children, or -1.
+
+        A dict caches the indices of long lists of children. The dict is
+        rebuilt only when the cached index is wrong, so repeated lookups
+        take constant time.
+        '''
+
+        v = self
+        children = v.children
+        if len(children) < 32:
+            try:
+                return children.index(child)
+            except ValueError:
+                return -1
+        d = v._childIndexDict
+        n = d.get(child,-1) if d else -1
+        if n < 0 or n >= len(children) or children[n] is not child:
+            # Rebuild the dict. The first of several clones wins.
+            d = v._childIndexDict = {}
+            for i in range(len(children)-1,-1,-1):
+                d[children[i]] = i
+            n = d.get(child,-1)
+        return n
     #@+node:ekr.20031218072017.3364: *5* v.lastChild
     def lastChild (self):
 
@@ -2268,30 +2510,8 @@ class vnode (baseVnode):
     #@+node:ekr.20090830051712.6153: *5* v.findAllPotentiallyDirtyNodes
     def findAllPotentiallyDirtyNodes(self):
 
-        trace = False and not g.unitTesting
         v = self ; c = v.context
-
-        # Set the starting nodes.
-        nodes = []
-        newNodes = [v]
-
-        # Add nodes until no more are added.
-        while newNodes:
-            addedNodes = []
-            nodes.extend(newNodes)
-            for v in newNodes:
-                for v2 in v.parents:
-                    if v2 not in nodes and v2 not in addedNodes:
-                        addedNodes.append(v2)
-            newNodes = addedNodes[:]
-
-        # Remove the hidden vnode.
-        if c.hiddenRootNode in nodes:
-            if trace: g.trace('removing hidden root',c.hiddenRootNode)
-            nodes.remove(c.hiddenRootNode)
-
-        if trace: g.trace(nodes)
-        return nodes
+        return c.findAllPotentiallyDirtyNodesInList([v])
     #@+node:ekr.20090830051712.6157: *5* v.setAllAncestorAtFileNodesDirty
     # Unlike p.setAllAncestorAtFileNodesDirty,
     # there is no setDescendentsDirty arg.
@@ -2473,6 +2693,7 @@ class vnode (baseVnode):
     def setHeadString (self,s):
         v = self
         v._headString = g.toUnicode(s,reportErrors=True)
+        v.context.headlineVersion += 1 # Invalidate c.unlCache.
 
     initBodyString = setBodyString
     initHeadString = setHeadString
@@ -2648,6 +2869,19 @@ class vnode (baseVnode):
     gnx = property(
         __get_gnx, # __set_gnx,
         doc = "vnode gnx property")
+    #@+node:ekr.20140219061533.16884: *4* v.fileIndex Property
+    def __get_fileIndex(self):
+        return self._fileIndex
+
+    def __set_fileIndex(self,index):
+        v = self
+        v._fileIndex = index
+        if g.app and getattr(g.app,'gnxIndex',None):
+            g.app.gnxIndex.add(v)
+
+    fileIndex = property(
+        __get_fileIndex, __set_fileIndex,
+        doc = "vnode fileIndex property: setting it updates g.app.gnxIndex")
     #@-others
 #@-others
 #@-leo
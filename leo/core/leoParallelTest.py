@@ -0,0 +1,99 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20140219061533.16859: * @file leoParallelTest.py
+'''
+A program to run some of the unit tests in a .leo file with the leoBridge module.
+
+TM.runTestsInParallel runs one copy of this program in each worker process.
+
+Usage:
+
+    python leoParallelTest.py --path=<.leo file> --tests=<file> --results=<file>
+
+The tests file contains a json list of [gnx,setup_gnx] pairs. setup_gnx is
+the gnx of the @testsetup node for the test, or null. The program writes a
+json list of results to the results file, one dict per test.
+'''
+
+#@+<< imports >>
+#@+node:ekr.20140219061533.16860: ** << imports >> (leoParallelTest.py)
+import json
+import optparse
+import os
+import sys
+
+# Make sure the current directory is on sys.path.
+cwd = os.getcwd()
+if cwd not in sys.path:
+    sys.path.append(cwd)
+
+import leo.core.leoBridge as leoBridge
+#@-<< imports >>
+# Do not define g here. Use the g returned by the bridge.
+
+#@+others
+#@+node:ekr.20140219061533.16861: ** main
+def main ():
+
+    options = scanOptions()
+    f = open(options.tests)
+    try:
+        tests = json.load(f)
+    finally:
+        f.close()
+    # Plugins will fail when run externally.
+    bridge = leoBridge.controller(gui='nullGui',
+        loadPlugins=False,readSettings=True,
+        silent=True,verbose=False)
+    results = []
+    if bridge.isOpen():
+        g = bridge.globals()
+        g.app.silentMode = True
+        g.app.isExternalUnitTest = True
+        c = bridge.openLeoFile(options.path)
+        results = runTests(c,g,tests)
+    f = open(options.results,'w')
+    try:
+        json.dump(results,f)
+    finally:
+        f.close()
+#@+node:ekr.20140219061533.16862: ** runTests
+def runTests (c,g,tests):
+
+    '''Run the tests, a list of [gnx,setup_gnx], and return their results.'''
+
+    d = {}
+    for p in c.all_positions():
+        if p.gnx not in d:
+            d[p.gnx] = p.copy()
+    aList = []
+    for gnx,setup_gnx in tests:
+        p,setup = d.get(gnx),d.get(setup_gnx)
+        if p:
+            aList.append((p,setup and setup.b),)
+    try:
+        g.unitTesting = g.app.unitTesting = True
+        return c.testManager.runTestNodes(aList)
+    finally:
+        g.unitTesting = g.app.unitTesting = False
+#@+node:ekr.20140219061533.16863: ** scanOptions
+def scanOptions():
+
+    '''Handle all options and remove them from sys.argv.'''
+
+    parser = optparse.OptionParser()
+    parser.add_option('--path',dest='path',
+        help='the .leo file containing the tests')
+    parser.add_option('--results',dest='results',
+        help='the file to which the results are written')
+    parser.add_option('--tests',dest='tests',
+        help='a file containing the tests to run')
+
+    # Parse the options, and remove them from sys.argv.
+    options, args = parser.parse_args()
+    sys.argv = [sys.argv[0]] ; sys.argv.extend(args)
+    return options
+#@-others
+
+if __name__ == '__main__':
+    main()
+#@-leo
@@ -41,6 +41,11 @@ if docutils:
     except Exception:
         g.es_exception()
         docutils = None
+try:
+    import concurrent.futures as futures
+except ImportError:
+    futures = None # Python 2 without the futures backport.
+import hashlib
 if g.isPython3:
     import html.parser as HTMLParser
 else:
@@ -54,6 +59,10 @@ except Exception:
     # g.es_print('leoRst: can not import leo.plugins.mod_http')
     # g.es_exception()
     mod_http = None
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
 # import os
 import pprint
 import re
@@ -72,6 +81,26 @@ else:
 #@-<< imports >>
 
 #@+others
+#@+node:ekr.20140219061533.16820: ** publishInWorker
+def publishInWorker (source,writer_name,overrides):
+
+    '''Call docutils in a worker process.
+
+    Return (result,error), where error is None or an error message.'''
+
+    try:
+        result = docutils.core.publish_string(source=source,
+            reader_name='standalone',
+            parser_name='restructuredtext',
+            writer_name=writer_name,
+            settings_overrides=overrides)
+        if g.isBytes(result):
+            result = g.toUnicode(result)
+        return result,None
+    except docutils.ApplicationError as error:
+        return None,'Docutils error: %s' % error
+    except Exception as error:
+        return None,'Unexpected docutils exception: %s' % error
 #@+node:ekr.20090502071837.12: ** code_block
 def code_block (name,arguments,options,
     content,lineno,content_offset,block_text,state,state_machine):
@@ -170,6 +199,14 @@ class rstCommands:
         self.rst3_all = False
         # Set to True by the button which processes all @rst trees.
 
+        # Incremental writes...
+        self.docutilsJobs = None # A list of deferred calls to docutils, or None.
+        self.filesWritten = [] # The files written for the present @rst tree.
+        self.manifest = None # Keys are gnx's of @rst nodes, values are dicts.
+        self.manifestChanged = False
+        self.manifestKey = '_leo_rst3_manifest'
+        self.signature = None # (gnx,hash,nodes) for the present @rst tree.
+
         # For writing.
         self.atAutoWrite = False # True, special cases for writeAtAutoFile.
         self.atAutoWriteUnderlines = '' # Forced underlines for writeAtAutoFile.
@@ -198,6 +235,7 @@ class rstCommands:
         c = self.c
         d = self.getPublicCommands()
         c.commandsDict.update(d)
+        c.k.invalidateCommandNames()
     #@+node:ekr.20090502071837.38: *4* initHeadlineCommands
     def initHeadlineCommands (self):
 
@@ -501,6 +539,7 @@ class rstCommands:
         if trace: g.trace(p.h)
         self.preprocessTree(p)
         found = False ; self.stringOutput = ''
+        self.docutilsJobs = None if toString else []
         p = p.copy() ; after= p.nodeAfterTree()
         while p and p != after:
             h = p.h.strip()
@@ -510,7 +549,8 @@ class rstCommands:
                 if ((fn and fn[0] != '-') or (toString and not fn)):
                     if trace: g.trace('found: %s',p.h)
                     found = True
-                    self.write_rst_tree(p,ext,fn,toString=toString,justOneFile=justOneFile)
+                    if toString or not self.isUnchanged(p,fn):
+                        self.write_rst_tree(p,ext,fn,toString=toString,justOneFile=justOneFile)
                     self.scanAllOptions(p) # Restore the top-level verbose setting.
                     if toString:
                         return p.copy(),self.stringOutput
@@ -522,6 +562,10 @@ class rstCommands:
                 found = True
                 p.moveToNodeAfterTree()
             else: p.moveToThreadNext()
+        jobs,self.docutilsJobs = self.docutilsJobs,None
+        if jobs:
+            self.runDocutilsJobs(jobs)
+        self.saveManifest()
         if not found:
             g.warning('No @rst or @slides nodes in selected tree')
         return None,None
@@ -559,8 +603,150 @@ class rstCommands:
         self.outputFile = None
         self.stringOutput = None
 
+        self.filesWritten = []
         if callDocutils or writeIntermediateFile:
             self.write_files(ext,fn,callDocutils,toString,writeIntermediateFile)
+        if (not toString and self.filesWritten and
+            self.signature and self.signature[0] == p.gnx
+        ):
+            self.updateManifest(self.signature,self.filesWritten)
+    #@+node:ekr.20140219061533.16822: *5* Incremental writes
+    #@+node:ekr.20140219061533.16823: *6* computeSignature
+    def computeSignature (self,p,fn):
+
+        '''Return (gnx,hash,nodes) for the @rst tree p.
+
+        nodes is a dict: keys are gnx's, values are hashes of headline and body.
+        hash depends on all nodes of the tree, their order, all ancestors
+        (for @path directives and options), the top-level options and the
+        modification times of the stylesheet and of included files.'''
+
+        self.init_write(p)
+        self.scanAllOptions(p)
+        nodes = {}
+        aList = [fn,repr(sorted(self.optionsDict.items()))]
+        for p2 in p.parents():
+            aList.append(p2.h)
+            aList.append(p2.b)
+        for p2 in p.self_and_subtree():
+            s = '%s\n%s' % (p2.h,p2.b)
+            nodes[p2.gnx] = h = hashlib.md5(g.toEncodedString(s,'utf-8')).hexdigest()
+            aList.append('%s:%s:%s' % (p2.level(),p2.gnx,h))
+        for path in self.computeDependencies(p):
+            if g.os_path_exists(path):
+                aList.append('%s:%s' % (path,g.os_path_getmtime(path)))
+            else:
+                aList.append('%s:missing' % (path))
+        s = '\n'.join(aList)
+        return p.gnx,hashlib.md5(g.toEncodedString(s,'utf-8')).hexdigest(),nodes
+    #@+node:ekr.20140219061533.16956: *6* computeDependencies
+    include_pattern = re.compile(r'^\s*\.\.\s+include::\s*(\S.*?)\s*$',re.MULTILINE)
+    file_option_pattern = re.compile(r'^\s*:file:\s*(\S.*?)\s*$',re.MULTILINE)
+
+    def computeDependencies (self,p):
+
+        '''Return the sorted list of files, other than the outline itself,
+        that affect the output of the @rst tree p: the stylesheet and the
+        files named in include directives and :file: options.
+
+        Like docutils, resolve relative include paths against the current
+        directory. Files included by included files are not found.'''
+
+        paths = set()
+        path = g.os_path_finalize_join(self.c.frame.openDirectory,
+            self.getOption('stylesheet_path') or '',
+            self.getOption('stylesheet_name'))
+        paths.add(path)
+        for p2 in p.self_and_subtree():
+            for pattern in (self.include_pattern,self.file_option_pattern):
+                for m in pattern.finditer(p2.b):
+                    fn = m.group(1)
+                    if not fn.startswith('<'): # A standard include: <isonum.txt>.
+                        paths.add(g.os_path_finalize(fn))
+        return sorted(paths)
+    #@+node:ekr.20140219061533.16824: *6* isUnchanged
+    def isUnchanged (self,p,fn):
+
+        '''Return True if the files written for p's tree are up to date.
+
+        Sets self.signature as a side effect.'''
+
+        self.signature = gnx,h,nodes = self.computeSignature(p,fn)
+        if not self.getOption('incremental') or self.getOption('http_server_support'):
+            return False
+        d = self.loadManifest().get(gnx)
+        if not d or d.get('hash') != h:
+            return False
+        files = d.get('files') or []
+        if not files or [z for z in files if not g.os_path_exists(z)]:
+            return False
+        if self.getOption('verbose'):
+            g.blue('unchanged: %s' % (fn))
+        return True
+    #@+node:ekr.20140219061533.16825: *6* loadManifest, saveManifest & updateManifest
+    def loadManifest (self):
+
+        '''Return the manifest of all @rst trees written previously.'''
+
+        if self.manifest is None:
+            try:
+                self.manifest = self.c.db.get(self.manifestKey) or {}
+            except Exception:
+                self.manifest = {}
+        return self.manifest
+
+    def saveManifest (self):
+
+        if self.manifestChanged:
+            self.manifestChanged = False
+            try:
+                self.c.db[self.manifestKey] = self.manifest
+            except Exception:
+                pass # Caching may be disabled.
+
+    def updateManifest (self,signature,files):
+
+        '''Remember the signature of an @rst tree and the files written from it.'''
+
+        gnx,h,nodes = signature
+        d = self.loadManifest()
+        d[gnx] = {'files':list(files),'hash':h,'nodes':nodes}
+        self.manifestChanged = True
+    #@+node:ekr.20140219061533.16826: *6* runDocutilsJobs
+    def runDocutilsJobs (self,jobs):
+
+        '''Call docutils for all jobs, in worker processes, and write the results.'''
+
+        args = [(z.source,z.writer_name,z.overrides) for z in jobs]
+        # Daemonic processes, such as the workers of leoBatch, can't have children.
+        if (len(jobs) > 1 and multiprocessing and
+            not multiprocessing.current_process().daemon
+        ):
+            executor = futures.ProcessPoolExecutor()
+            try:
+                results = [z.result() for z in
+                    [executor.submit(publishInWorker,*z) for z in args]]
+            finally:
+                executor.shutdown()
+        else:
+            results = [publishInWorker(*z) for z in args]
+        for job,data in zip(jobs,results):
+            s,error = data
+            if error:
+                g.error(error)
+                continue
+            if not s:
+                continue
+            if job.isHtml:
+                s = self.addTitleToHtml(s)
+            f = open(job.fn,'wb')
+            f.write(g.toEncodedString(s,'utf-8'))
+            f.close()
+            if job.verbose:
+                g.blue('wrote: %s' % (g.os_path_finalize(job.fn)))
+            job.files.append(job.fn)
+            if job.signature:
+                self.updateManifest(job.signature,job.files)
     #@+node:ekr.20100822092546.5835: *5* write_slides & helper
     def write_slides (self,p,toString=False):
 
@@ -1243,6 +1429,7 @@ class rstCommands:
             # Global options...
             'call_docutils': True, # 2010/08/05
             'code_block_string': '',
+            'incremental': True, # True: don't rewrite unchanged @rst trees.
             'number_code_lines': True,
             'underline_characters': '''#=+*^~"'`-:><_''',
             'verbose':True,
@@ -1746,6 +1933,18 @@ class rstCommands:
                 self.createIntermediateFile(fn,self.source)
 
         if callDocutils and ext in ('.htm','.html','.tex','.pdf','.s5','.odt'):
+            if self.docutilsJobs is not None and futures and ext != '.pdf':
+                # Call docutils later, in a worker process.
+                data = self.computeDocutilsArgs(ext)
+                if data:
+                    writer,writer_name,overrides = data
+                    self.docutilsJobs.append(g.Bunch(
+                        fn=fn,isHtml=isHtml,
+                        files=self.filesWritten,signature=self.signature,
+                        source=self.source,verbose=self.getOption('verbose'),
+                        writer_name=writer_name,overrides=overrides))
+                    self.filesWritten = [] # Don't update the manifest yet.
+                return
             self.stringOutput = s = self.writeToDocutils(self.source,ext)
             if s and isHtml:
                 self.stringOutput = s = self.addTitleToHtml(s)
@@ -1762,6 +1961,7 @@ class rstCommands:
                 f.write(s)
                 f.close()
                 self.report(fn)
+                self.filesWritten.append(fn)
                 # self.http_endTree(fn,p,justOneFile=justOneFile)
     #@+node:ekr.20100813041139.5913: *5* addTitleToHtml
     def addTitleToHtml(self,s):
@@ -1823,12 +2023,42 @@ class rstCommands:
         f.write(s)
         f.close()
         self.report(fn)
-    #@+node:ekr.20090502071837.65: *5* writeToDocutils (sets argv) & helper
+        self.filesWritten.append(fn)
+    #@+node:ekr.20090502071837.65: *5* writeToDocutils (sets argv) & helpers
     def writeToDocutils (self,s,ext):
 
         '''Send s to docutils using the writer implied by ext and return the result.'''
 
         trace = False and not g.unitTesting
+        data = self.computeDocutilsArgs(ext)
+        if not data:
+            return None
+        writer,writer_name,overrides = data
+        try:
+            # All paths now come through here.
+            if trace: g.trace('overrides',overrides)
+            result = None # Ensure that result is defined.
+            result = docutils.core.publish_string(source=s,
+                    reader_name='standalone',
+                    parser_name='restructuredtext',
+                    writer=writer,
+                    writer_name=writer_name,
+                    settings_overrides=overrides)
+            if g.isBytes(result):
+                result = g.toUnicode(result)
+        except docutils.ApplicationError as error:
+            # g.error('Docutils error (%s):' % (error.__class__.__name__))
+            g.error('Docutils error:')
+            g.blue(error)
+        except Exception:
+            g.es_print('Unexpected docutils exception')
+            g.es_exception()
+        return result
+    #@+node:ekr.20140219061533.16821: *6* computeDocutilsArgs
+    def computeDocutilsArgs (self,ext):
+
+        '''Return (writer,writer_name,overrides) for a call to docutils, or None.'''
+
         if not docutils:
             g.error('writeToDocutils: docutils not present')
             return None
@@ -1897,26 +2127,7 @@ class rstCommands:
             g.es_print('open path:',openDirectory)
             if rel_stylesheet_path:
                 g.es_print('relative path:', rel_stylesheet_path)
-        try:
-            # All paths now come through here.
-            if trace: g.trace('overrides',overrides)
-            result = None # Ensure that result is defined.
-            result = docutils.core.publish_string(source=s,
-                    reader_name='standalone',
-                    parser_name='restructuredtext',
-                    writer=writer,
-                    writer_name=writer_name,
-                    settings_overrides=overrides)
-            if g.isBytes(result):
-                result = g.toUnicode(result)
-        except docutils.ApplicationError as error:
-            # g.error('Docutils error (%s):' % (error.__class__.__name__))
-            g.error('Docutils error:')
-            g.blue(error)
-        except Exception:
-            g.es_print('Unexpected docutils exception')
-            g.es_exception()
-        return result
+        return writer,writer_name,overrides
     #@+node:ekr.20090502071837.66: *6* handleMissingStyleSheetArgs
     def handleMissingStyleSheetArgs (self,s=None):
 
@@ -6,8 +6,15 @@
 
 # Tangle and Untangle.
 import leo.core.leoGlobals as g
+import io
 import os
 
+try:
+    import multiprocessing
+    import multiprocessing.pool
+except ImportError:
+    multiprocessing = None
+
 #@+<< about Tangle and Untangle >>
 #@+node:ekr.20031218072017.2411: ** << About Tangle and Untangle >>
 #@@root directive. The stack never becomes empty because of the entry
@@ -160,6 +167,7 @@ class tst_node:
         self.is_root = root_flag
         self.referenced = False
         self.parts = []
+        self.codes = set() # The code of all parts, for the duplicate check.
         self.delims = None
 
     #@+node:ekr.20031218072017.3451: *4* tst_node.__repr__
@@ -381,6 +389,8 @@ class baseTangleCommands:
         self.output_file = None # The file descriptor of the output file.
         self.start_mode = "doc" # "code" or "doc".  Use "doc" for compatibility.
         self.tangle_output = {} # For unit testing.
+        self.deferred_roots = None # Not None: pass 2 appends snapshots here.
+        self.messages = None # Not None: pass 2 appends error messages here.
 
         #@+at Symbol tables: the TST (Tangle Symbol Table) contains all section names in the outline.
         # The UST (Untangle Symbol Table) contains all sections defined in the derived file.
@@ -536,6 +546,7 @@ class baseTangleCommands:
         c = self.c
         self.initTangleCommand()
         has_roots = False
+        self.deferred_roots = []
 
         for p in c.rootPosition().self_and_siblings():
             ok = self.tangleTree(p,report_errors=False)
@@ -543,6 +554,7 @@ class baseTangleCommands:
             if self.path_warning_given:
                 break # Fatal error.
 
+        self.put_deferred_roots()
         self.errors += g.app.scanErrors
 
         if not has_roots:
@@ -559,6 +571,7 @@ class baseTangleCommands:
         c.clearAllVisited() # No roots have been tangled yet.
         self.initTangleCommand()
         any_marked = False
+        self.deferred_roots = []
         while p:
             is_ignore, i = g.is_special(p.b,0,"@ignore")
             # Only tangle marked and unvisited nodes.
@@ -572,6 +585,7 @@ class baseTangleCommands:
                 p.moveToNodeAfterTree()
             else: p.moveToThreadNext()
 
+        self.put_deferred_roots()
         self.errors += g.app.scanErrors
 
         if not any_marked:
@@ -622,6 +636,89 @@ class baseTangleCommands:
             self.warning("----- The outline contains no roots")
         else:
             self.put_all_roots() # pass 2 top level function.
+    #@+node:ekr.20140219061533.16892: *4* pass2_snapshot
+    # The ivars used by pass 2, in addition to the attributes of each root.
+    pass2_ivars = (
+        'encoding','head_root','output_doc_flag','output_newline',
+        'raw_cweb_flag','root_list','root_name','start_mode','tst',
+    )
+
+    def pass2_snapshot (self):
+
+        """Return a picklable dict containing everything pass 2 needs."""
+
+        c = self.c
+        d = dict([(ivar,getattr(self,ivar)) for ivar in self.pass2_ivars])
+        d['file_names'] = [c.os_path_finalize_join(self.tangle_directory,z.name)
+            for z in self.root_list]
+        d['outline_name'] = c.mFileName
+        d['textMode'] = c.config.output_newline == 'platform'
+        return d
+    #@+node:ekr.20140219061533.16893: *4* put_deferred_roots
+    def put_deferred_roots (self,workers=None):
+
+        """Run pass 2 for all snapshots in self.deferred_roots and write the files.
+
+        Worker processes expand the roots; threads write the files.
+        @int tangle_workers sets the number of workers, unless workers is given."""
+
+        c = self.c
+        snapshots,self.deferred_roots = self.deferred_roots,None
+        if not snapshots:
+            return
+        n = workers
+        if n is None:
+            n = c.config.getInt('tangle_workers') or 0
+        if n <= 0 and multiprocessing:
+            n = multiprocessing.cpu_count()
+        # Daemonic processes, such as the workers of leoBatch, can't have children.
+        if (n > 1 and multiprocessing and len(snapshots) > 1 and
+            not multiprocessing.current_process().daemon
+        ):
+            pool = multiprocessing.Pool(min(n,len(snapshots)))
+            try:
+                results = pool.map(tangleSnapshot,snapshots,chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [tangleSnapshot(z) for z in snapshots]
+        # Each snapshot was taken before any error was seen, so errors in pass 1
+        # of later trees don't matter here. As in the serial code, the first
+        # error in pass 2 stops all later roots from being written.
+        files = [] ; errors = 0
+        for d,(aList,messages) in zip(snapshots,results):
+            if errors > 0:
+                self.warning("----- No file written because of errors")
+                continue
+            for s in messages:
+                g.es_error(g.translateString(s))
+            for file_name,s,n_errors in aList:
+                errors = n_errors
+                if errors == 0:
+                    files.append((file_name,s,d['textMode']),)
+                else:
+                    g.es("unchanged:",file_name)
+        self.errors += errors
+        # Write the files in outline order.
+        for data in files:
+            head = g.os_path_dirname(data[0])
+            if head and not g.os_path_exists(head):
+                g.makeAllNonExistentDirectories(head,c=c)
+        if n > 1 and multiprocessing and len(files) > 1:
+            pool = multiprocessing.pool.ThreadPool(min(n,len(files)))
+            try:
+                kinds = pool.map(writeTangledFile,files)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            kinds = [writeTangledFile(z) for z in files]
+        for data,kind in zip(files,kinds):
+            if kind:
+                g.es('','%12s: %s' % (kind,data[0]))
+            else:
+                g.error("can not write:",data[0])
     #@+node:ekr.20031218072017.3477: *4* tangleTree (calls cleanup)
     # This function is called only from the top level, so there is no need to initialize globals.
 
@@ -1337,6 +1434,11 @@ class baseTangleCommands:
 
         c = self.c ; outline_name = c.mFileName
 
+        if self.deferred_roots is not None:
+            # tangleAll or tangleMarked will write all roots at once.
+            self.deferred_roots.append(self.pass2_snapshot())
+            return
+
         for section in self.root_list:
 
             # g.trace(section.name)
@@ -1351,48 +1453,7 @@ class baseTangleCommands:
             if not temp_name:
                 g.es("can not create temp file")
                 break
-            #@+<<Get root specific attributes>>
-            #@+node:ekr.20031218072017.1152: *6* <<Get root specific attributes>>
-            # Stephen Schaefer, 9/2/02
-            # Retrieve the full complement of state for the root node
-            self.language = section.root_attributes.language
-            self.use_header_flag = section.root_attributes.use_header_flag
-            self.print_mode = section.root_attributes.print_mode
-            self.path = section.root_attributes.path
-            self.page_width = section.root_attributes.page_width
-            self.tab_width = section.root_attributes.tab_width
-            # Stephen P. Schaefer, 9/13/2002
-            self.first_lines = section.root_attributes.first_lines
-            #@-<<Get root specific attributes>>
-            #@+<<Put @first lines>>
-            #@+node:ekr.20031218072017.1153: *6* <<Put @first lines>>
-            # Stephen P. Schaefer 9/13/2002
-            if self.first_lines:
-                self.os(self.first_lines)
-            #@-<<Put @first lines>>
-            if self.use_header_flag and self.print_mode == "verbose":
-                #@+<< Write a banner at the start of the output file >>
-                #@+node:ekr.20031218072017.1154: *6* <<Write a banner at the start of the output file>>
-                # a root section must have at least one part
-                assert len(section.parts)>0
-                delims=section.parts[0].delims
-                if delims[0]:
-                    self.os(delims[0])
-                    self.os(" Created by Leo from: ")
-                    self.os(outline_name)
-                    self.onl() ; self.onl()
-                elif delims[1] and delims[2]:
-                    self.os(delims[1])
-                    self.os(" Created by Leo from: ")
-                    self.os(outline_name)
-                    self.oblank() ; self.os(delims[2])
-                    self.onl() ; self.onl()
-                #@-<< Write a banner at the start of the output file >>
-            for part in section.parts:
-                if part.is_root:
-                    self.tangle_indent = 0 # Initialize global.
-                    self.put_part_node(part,False) # output first lws
-            self.onl() # Make sure the file ends with a cr/lf
+            self.put_root(section,outline_name)
             #@+<< unit testing fake files>>
             #@+node:sps.20100608083657.20937: *6* << unit testing fake files>>
             if g.unitTesting:
@@ -1430,6 +1491,53 @@ class baseTangleCommands:
                     os.remove(temp_name)
                 except: pass
                 #@-<< Erase the temporary file >>
+    #@+node:ekr.20140219061533.16894: *5* tangle.put_root
+    def put_root(self,section,outline_name):
+
+        '''Write the expansion of the root section to self.output_file.'''
+
+        #@+<<Get root specific attributes>>
+        #@+node:ekr.20031218072017.1152: *6* <<Get root specific attributes>>
+        # Stephen Schaefer, 9/2/02
+        # Retrieve the full complement of state for the root node
+        self.language = section.root_attributes.language
+        self.use_header_flag = section.root_attributes.use_header_flag
+        self.print_mode = section.root_attributes.print_mode
+        self.path = section.root_attributes.path
+        self.page_width = section.root_attributes.page_width
+        self.tab_width = section.root_attributes.tab_width
+        # Stephen P. Schaefer, 9/13/2002
+        self.first_lines = section.root_attributes.first_lines
+        #@-<<Get root specific attributes>>
+        #@+<<Put @first lines>>
+        #@+node:ekr.20031218072017.1153: *6* <<Put @first lines>>
+        # Stephen P. Schaefer 9/13/2002
+        if self.first_lines:
+            self.os(self.first_lines)
+        #@-<<Put @first lines>>
+        if self.use_header_flag and self.print_mode == "verbose":
+            #@+<< Write a banner at the start of the output file >>
+            #@+node:ekr.20031218072017.1154: *6* <<Write a banner at the start of the output file>>
+            # a root section must have at least one part
+            assert len(section.parts)>0
+            delims=section.parts[0].delims
+            if delims[0]:
+                self.os(delims[0])
+                self.os(" Created by Leo from: ")
+                self.os(outline_name)
+                self.onl() ; self.onl()
+            elif delims[1] and delims[2]:
+                self.os(delims[1])
+                self.os(" Created by Leo from: ")
+                self.os(outline_name)
+                self.oblank() ; self.os(delims[2])
+                self.onl() ; self.onl()
+            #@-<< Write a banner at the start of the output file >>
+        for part in section.parts:
+            if part.is_root:
+                self.tangle_indent = 0 # Initialize global.
+                self.put_part_node(part,False) # output first lws
+        self.onl() # Make sure the file ends with a cr/lf
     #@+node:ekr.20031218072017.3506: *5* put_code
     #@+at
     # This method outputs a code section, expanding section references by
@@ -1925,14 +2033,14 @@ class baseTangleCommands:
         if self.tangling and code:
             #@+<< check for duplicate code definitions >>
             #@+node:ekr.20031218072017.3533: *5* <<check for duplicate code definitions >>
-            for part in section.parts:
-                if code == part.code:
-                    s = g.angleBrackets(section.name)
-                    g.es('warning: possible duplicate definition of:',s)
+            if code in section.codes:
+                s = g.angleBrackets(section.name)
+                g.es('warning: possible duplicate definition of:',s)
             #@-<< check for duplicate code definitions >>
         if code or doc:
             part = part_node(name,code,doc,is_root_flag,False,delims_begin)
             section.parts.append(part)
+            if code: section.codes.add(code)
             section.delims = delims_end
         else: # A reference
             section.referenced = True
@@ -2963,7 +3071,10 @@ class baseTangleCommands:
     #@+node:ekr.20031218072017.3579: *4* error, pathError, warning
     def error (self,s):
         self.errors += 1
-        g.es_error(g.translateString(s))
+        if self.messages is None:
+            g.es_error(g.translateString(s))
+        else:
+            self.messages.append(s)
 
     def pathError (self,s):
         if not self.path_warning_given:
@@ -2971,7 +3082,10 @@ class baseTangleCommands:
             self.error(s)
 
     def warning (self,s):
-        g.es_error(g.translateString(s))
+        if self.messages is None:
+            g.es_error(g.translateString(s))
+        else:
+            self.messages.append(s)
     #@+node:ekr.20031218072017.3580: *4* is_end_of_directive
     # This function returns True if we are at the end of preprocessor directive.
 
@@ -3457,5 +3571,72 @@ class baseTangleCommands:
 class tangleCommands (baseTangleCommands):
     """A class that implements Leo' tangle and untangle commands."""
     pass
+#@+node:ekr.20140219061533.16895: ** class snapshotTangler
+class snapshotTangler (baseTangleCommands):
+    """A tangler that runs pass 2 on a snapshot made by tangle.pass2_snapshot.
+
+    It has no commander, so it can run in a worker process."""
+
+    def __init__ (self,d):
+
+        self.c = None
+        self.__dict__.update(d)
+        self.errors = 0
+        self.messages = []
+        self.output_file = None
+        self.path = None
+        self.section_stack = []
+        self.tangle_indent = 0
+#@+node:ekr.20140219061533.16896: ** tangleSnapshot & writeTangledFile
+# Worker processes and threads call these functions: they must not touch the gui.
+
+def tangleSnapshot (d):
+
+    """Expand all roots in d, a snapshot made by tangle.pass2_snapshot.
+
+    Return (aList,messages). aList contains (file_name,s,errors) tuples:
+    s is the encoded contents of the file; errors is the number of errors
+    seen so far."""
+
+    x = snapshotTangler(d)
+    aList = []
+    for section,file_name in zip(x.root_list,d['file_names']):
+        x.output_file = io.BytesIO()
+        x.put_root(section,d['outline_name'])
+        aList.append((file_name,x.output_file.getvalue(),x.errors),)
+        x.output_file = None
+    return aList,x.messages
+
+def writeTangledFile (data):
+
+    """Write s to file_name unless the file already contains s.
+
+    data is a tuple (file_name,s,textMode). Like the text-mode temp files of
+    put_all_roots, textMode translates newlines to os.linesep. Return
+    'unchanged', '***updating' or 'creating', or None if the file can not be
+    written."""
+
+    file_name,s,textMode = data
+    if textMode and os.linesep != '\n':
+        s = s.replace(b'\n',g.toEncodedString(os.linesep))
+    try:
+        if os.path.exists(file_name):
+            f = open(file_name,'rb')
+            try:
+                if f.read() == s:
+                    return 'unchanged'
+            finally:
+                f.close()
+            kind = '***updating'
+        else:
+            kind = 'creating'
+        f = open(file_name,'wb')
+        try:
+            f.write(s)
+        finally:
+            f.close()
+        return kind
+    except (IOError,OSError):
+        return None
 #@-others
 #@-leo
@@ -16,11 +16,16 @@ import leo.core.leoGui as leoGui # For unitTestGui.
 import doctest
 import gc
 import glob
+import json
 import os
 import cProfile as profile
 # import pstats # A Python distro bug: can fail on Ubuntu.
 # import re
+import shutil
+import subprocess
 import sys
+import tempfile
+import time
 import timeit
 import tokenize
 import unittest
@@ -691,6 +696,219 @@ class runTestExternallyHelperClass:
         if trace: g.trace('*** spawning test process',path)
         os.spawnve(os.P_NOWAIT,sys.executable,args,env)
     #@-others
+#@+node:ekr.20140219061533.16847: ** class runTestsInParallelHelperClass
+class runTestsInParallelHelperClass:
+
+    '''
+    A helper class to run unit tests in worker processes.
+
+    Each worker runs leoParallelTest.py, which opens the outline with a
+    null-gui leoBridge and runs its share of the tests. Tests that fail in a
+    worker are run again, one at a time, in this process.
+    '''
+
+    #@+others
+    #@+node:ekr.20140219061533.16848: *3*  ctor: runTestsInParallelHelperClass
+    def __init__(self,c,all,marked,workers):
+
+        self.c = c
+        self.all = all
+        self.marked = marked
+        self.workers = workers # The number of worker processes.
+        self.numberOfSlowestTests = 10 # The number of slowest tests to report.
+        self.timesKey = 'unittest/cur/times' # Keys are gnx's, values are times.
+    #@+node:ekr.20140219061533.16849: *3* runTests
+    def runTests (self):
+
+        '''Run all tests in worker processes and report the results.'''
+
+        c = self.c
+        t1 = time.time()
+        tests = self.findTests()
+        if not tests:
+            g.es_print('no %s@test or @suite nodes in %s outline' % (
+                g.choose(self.marked,'marked ',''),
+                g.choose(self.all,'entire','selected')))
+            return
+        shards = self.makeShards(tests)
+        results = self.runShards(shards)
+        failed = [z for z in tests if self.isFailure(results.get(z[0]))]
+        t2 = time.time()
+        rerun = self.rerunTests(failed) if failed else {}
+        t3 = time.time()
+        self.report(tests,results,failed,rerun,len(shards),t2-t1,t3-t2)
+        self.saveResults(results,rerun)
+        c.bodyWantsFocusNow()
+    #@+node:ekr.20140219061533.16850: *3* findTests
+    def findTests (self):
+
+        '''
+        Return a list of tests [gnx,setup_gnx] in outline order.
+        setup_gnx is the gnx of the @testsetup node in effect, or None.
+        '''
+
+        tm = self.c.testManager
+        tests,setup_gnx = [],None
+        for p in tm.findAllUnitTestNodes(self.all,self.marked):
+            if tm.isTestSetupNode(p):
+                setup_gnx = p.gnx
+            elif p.b.strip():
+                tests.append([p.gnx,setup_gnx])
+        return tests
+    #@+node:ekr.20140219061533.16851: *3* isFailure
+    def isFailure (self,result):
+
+        '''Return True if the result of a test shows an error or a failure.'''
+
+        return not result or bool(result.get('errors'))
+    #@+node:ekr.20140219061533.16852: *3* makeShards
+    def makeShards (self,tests):
+
+        '''
+        Divide tests into at most self.workers shards of about equal run time.
+
+        The times of the previous run determine the load of each test.
+        '''
+
+        c = self.c
+        times = g.enableDB and c.cacher.db.get(self.timesKey) or {}
+        default = 0.1 # Assume new tests are fast.
+        n = max(1,min(self.workers,len(tests)))
+        shards = [[] for i in range(n)]
+        loads = [0.0 for i in range(n)]
+        order = dict([(test[0],i) for i,test in enumerate(tests)])
+        # Assign the slowest tests first, each to the least-loaded shard.
+        for test in sorted(tests,key=lambda z: -times.get(z[0],default)):
+            i = loads.index(min(loads))
+            shards[i].append(test)
+            loads[i] += times.get(test[0],default)
+        # Run each shard in outline order.
+        for shard in shards:
+            shard.sort(key=lambda z: order.get(z[0]))
+        return [z for z in shards if z]
+    #@+node:ekr.20140219061533.16853: *3* report
+    def report (self,tests,results,failed,rerun,workers,t1,t2):
+
+        '''Report the slowest tests, all failures and the totals.'''
+
+        aList = sorted(results.values(),key=lambda d: -d.get('time',0))
+        if aList:
+            print('\nslowest tests...')
+            for d in aList[:self.numberOfSlowestTests]:
+                print('%6.2f sec. %s' % (d.get('time',0),d.get('h')))
+        errors = []
+        for gnx,setup_gnx in failed:
+            d = rerun.get(gnx)
+            if self.isFailure(d):
+                errors.append(d or results.get(gnx) or {'h':gnx})
+            else:
+                print('\npassed when run again: %s' % d.get('h'))
+        for d in errors:
+            print('\n%s\nFAIL: %s\n%s\n%s' % ('='*70,d.get('h'),'-'*70,
+                '\n'.join(d.get('errors') or ['not run'])))
+        g.es_print('ran %s tests in %s workers in %0.2f sec.' % (
+            len(tests),workers,t1))
+        if failed:
+            g.es_print('ran %s failed tests again in %0.2f sec.' % (
+                len(failed),t2))
+        if errors:
+            g.es_print('FAILED (failures=%s)' % len(errors),color='red')
+        else:
+            g.es_print('OK')
+    #@+node:ekr.20140219061533.16854: *3* rerunTests
+    def rerunTests (self,tests):
+
+        '''
+        Run the tests in this process, one at a time.
+        Return a dict: keys are gnx's, values are results.
+        '''
+
+        c = self.c ; tm = c.testManager
+        d = {}
+        for p in c.all_positions():
+            if p.gnx not in d:
+                d[p.gnx] = p.copy()
+        aList = []
+        for gnx,setup_gnx in tests:
+            p,setup = d.get(gnx),d.get(setup_gnx)
+            if p:
+                aList.append((p,setup and setup.b),)
+        p1 = c.p.copy()
+        changed = c.isChanged()
+        try:
+            g.unitTesting = g.app.unitTesting = True
+            results = tm.runTestNodes(aList)
+        finally:
+            c.setChanged(changed)
+            c.redraw(p1)
+            g.unitTesting = g.app.unitTesting = False
+        return dict([(z.get('gnx'),z) for z in results])
+    #@+node:ekr.20140219061533.16855: *3* runShards
+    def runShards (self,shards):
+
+        '''
+        Run each shard in a separate process.
+        Return a dict: keys are gnx's, values are results.
+        '''
+
+        c = self.c
+        leo = g.os_path_finalize_join(g.app.loadDir,'..','core','leoParallelTest.py')
+        leoDir = g.os_path_finalize_join(g.app.loadDir,'..','..')
+        env = dict(os.environ)
+        env['PYTHONPATH'] = env.get('PYTHONPATH', '') + os.pathsep + leoDir
+        theDir = tempfile.mkdtemp(prefix='leo-tests-')
+        try:
+            procs = []
+            for i,shard in enumerate(shards):
+                testsFile = os.path.join(theDir,'tests-%s.json' % i)
+                resultsFile = os.path.join(theDir,'results-%s.json' % i)
+                f = open(testsFile,'w')
+                try:
+                    json.dump(shard,f)
+                finally:
+                    f.close()
+                args = [sys.executable,leo,
+                    '--path=%s' % c.fileName(),
+                    '--tests=%s' % testsFile,
+                    '--results=%s' % resultsFile]
+                procs.append((subprocess.Popen(args,env=env),resultsFile),)
+            results = {}
+            for proc,resultsFile in procs:
+                proc.wait()
+                # A worker that crashed writes no results: all its tests fail.
+                if os.path.exists(resultsFile):
+                    f = open(resultsFile)
+                    try:
+                        for d in json.load(f):
+                            results[d.get('gnx')] = d
+                    finally:
+                        f.close()
+            return results
+        finally:
+            shutil.rmtree(theDir,ignore_errors=True)
+    #@+node:ekr.20140219061533.16856: *3* saveResults
+    def saveResults (self,results,rerun):
+
+        '''
+        Save the failures in the 'unittest/cur/fail' key of c.db, like
+        TM.doTests, and the time of each test for the next run.
+        '''
+
+        c = self.c
+        if not g.enableDB:
+            return
+        db = c.cacher.db
+        fail = []
+        for gnx in rerun:
+            d = rerun.get(gnx)
+            if self.isFailure(d):
+                fail.append((gnx,'\n'.join(d.get('errors') or [])),)
+        db['unittest/cur/fail'] = fail
+        times = db.get(self.timesKey) or {}
+        for gnx in results:
+            times[gnx] = results[gnx].get('time',0)
+        db[self.timesKey] = times
+    #@-others
 #@+node:ekr.20120220070422.10417: ** class TestManager
 class TestManager:
 
@@ -746,17 +964,9 @@ class TestManager:
                 if tm.isTestSetupNode(p):
                     setup_script = p.b
                     test = None
-                elif tm.isTestNode(p):
-                    if trace: g.trace('adding',p.h)
-                    test = tm.makeTestCase(p,setup_script)
-                elif tm.isSuiteNode(p): # @suite
-                    if trace: g.trace('adding',p.h)
-                    test = tm.makeTestSuite(p,setup_script)
-                elif tm.isTestClassNode(p):
-                    if trace: g.trace('adding',p.h)
-                    test = tm.makeTestClass(p) # A suite of tests.
                 else:
-                    test = None
+                    if trace: g.trace('adding',p.h)
+                    test = tm.makeTestFromNode(p,setup_script)
                 if test:
                     suite.addTest(test)
                     found = True
@@ -811,6 +1021,20 @@ class TestManager:
 
     '''
         return g.adjustTripleString(s,self.c.tab_width)
+    #@+node:ekr.20140219061533.16857: *5* makeTestFromNode
+    def makeTestFromNode (self,p,setup_script):
+
+        '''Return a test or suite for an @test, @suite or @testclass node.'''
+
+        tm = self
+        if tm.isTestNode(p):
+            return tm.makeTestCase(p,setup_script)
+        elif tm.isSuiteNode(p): # @suite
+            return tm.makeTestSuite(p,setup_script)
+        elif tm.isTestClassNode(p):
+            return tm.makeTestClass(p) # A suite of tests.
+        else:
+            return None
     #@+node:ekr.20051104075904.13: *5* makeTestCase
     def makeTestCase (self,p,setup_script):
 
@@ -915,6 +1139,56 @@ class TestManager:
         runner.runTests()
 
         c.bodyWantsFocusNow()
+    #@+node:ekr.20140219061533.16858: *4* TM.runTestsInParallel & runTestNodes
+    def runTestsInParallel (self,all,marked):
+
+        '''Run any kind of unit test in several worker processes.'''
+
+        c = self.c
+        if not c.fileName():
+            g.es_print('can not run tests in parallel: the outline has no file')
+            return
+        if c.isChanged():
+            # The workers read the outline from its file.
+            g.es_print('can not run tests in parallel: save %s first' % (
+                c.shortFileName()))
+            return
+        workers = c.config.getInt('unit_test_workers') or 0
+        if workers < 1:
+            try:
+                import multiprocessing
+                workers = multiprocessing.cpu_count()
+            except (ImportError,NotImplementedError):
+                workers = 2
+        runner = runTestsInParallelHelperClass(c,all,marked,workers)
+        runner.runTests()
+
+    def runTestNodes (self,aList):
+
+        '''
+        Run the tests in aList, a list of tuples (p,setup_script), one at a time.
+        Return a list of dicts describing the result and time of each test.
+        '''
+
+        c,tm = self.c,self
+        g.app.unitTestDict["fail"] = False
+        g.app.unitTestDict['c'] = c
+        g.app.unitTestDict['g'] = g
+        g.app.unitTestDict['p'] = c.p.copy()
+        results = []
+        for p,setup_script in aList:
+            d = {'gnx':p.gnx,'h':p.h,'errors':[],'time':0.0}
+            test = tm.makeTestFromNode(p,setup_script)
+            if test:
+                result = unittest.TestResult()
+                t1 = time.time()
+                test.run(result)
+                d['time'] = time.time()-t1
+                d['errors'] = [z[1] for z in result.errors + result.failures]
+            else:
+                d['errors'] = ['can not create a test for %s' % p.h]
+            results.append(d)
+        return results
     #@+node:ekr.20051104075904.14: *4* TM.runProfileOnNode
     # Called from @button profile in unitTest.leo.
 
@@ -71,6 +71,13 @@ class undoer:
 
         self.max_undo_stack_size = c.config.getInt('max_undo_stack_size') or 0
 
+        # A write-ahead journal of all changes recorded by the undoer.
+        if c.config.getBool('journal_outline_changes'):
+            import leo.core.leoJournal as leoJournal
+            self.journal = leoJournal.Journal(c)
+        else:
+            self.journal = None
+
         # Statistics comparing old and new ways (only if self.debug_undoer is on).
         self.new_mem = 0
         self.old_mem = 0
@@ -100,6 +107,7 @@ class undoer:
         self.deleteMarkedNodesData = None
         self.dirtyVnodeList = None
         self.followingSibs = None
+        self.groupVnodes = [] # Vnodes changed by undoGroup or redoGroup.
         self.inHead = None
         self.kind = None
         self.newBack = None
@@ -236,6 +244,8 @@ class undoer:
 
             # Recalculate the menu labels.
             u.setUndoTypes()
+
+        if u.journal: u.journal.recordBead(bunch)
     #@+node:ekr.20050126081529: *4* recognizeStartOfTypingWord
     def recognizeStartOfTypingWord (self,
         old_lines,old_row,old_col,old_ch, 
@@ -511,8 +521,13 @@ class undoer:
 
         # Bug fix: Leo 4.4.6: Undo/redo always set changed/dirty bits
         # because the file may have been saved.
-        u.p.setDirty(setDescendentsDirty=False)
-        u.p.setAllAncestorAtFileNodesDirty(setDescendentsDirty=False) # Bug fix: Leo 4.4.6
+        if u.groupCount > 0:
+            # undoGroup and redoGroup mark the ancestors of all nodes at once.
+            u.p.v.setDirty()
+            u.groupVnodes.append(u.p.v)
+        else:
+            u.p.setDirty(setDescendentsDirty=False)
+            u.p.setAllAncestorAtFileNodesDirty(setDescendentsDirty=False) # Bug fix: Leo 4.4.6
         u.c.setChanged(True)
     #@+node:ekr.20031218072017.3608: *3* Externally visible entries
     #@+node:ekr.20050318085432.4: *4* afterX...
@@ -756,6 +771,8 @@ class undoer:
 
         # Recalculate the menu labels.
         u.setUndoTypes()
+
+        if u.journal: u.journal.recordBead(bunch)
     #@+node:ekr.20050411193627.7: *5* afterHoist
     def afterHoist (self,p,command):
 
@@ -905,6 +922,8 @@ class undoer:
 
         # Recalculate the menu labels.
         u.setUndoTypes()
+
+        if u.journal: u.journal.recordBead(bunch)
     #@+node:ekr.20080425060424.2: *5* afterSort
     def afterSort (self,p,bunch,dirtyVnodeList):
 
@@ -919,6 +938,8 @@ class undoer:
         # Recalculate the menu labels.
         u.setUndoTypes()
 
+        if u.journal: u.journal.recordBead(bunch)
+
         # g.trace(u.undoMenuLabel,u.redoMenuLabel)
     #@+node:ekr.20050318085432.3: *4* beforeX...
     #@+node:ekr.20050315134017.7: *5* beforeChangeGroup
@@ -1430,6 +1451,8 @@ class undoer:
         bunch.yview=u.yview
         #@-<< adjust the undo stack, clearing all forward entries >>
 
+        if u.journal: u.journal.recordBody(p.v,newText)
+
         if u.per_node_undo:
             u.putIvarsToVnode(p)
 
@@ -1454,7 +1477,8 @@ class undoer:
             if trace: g.trace('cant redo',u.undoMenuLabel,u.redoMenuLabel)
             return
 
-        if not u.getBead(u.bead+1):
+        bunch = u.getBead(u.bead+1)
+        if not bunch:
             if trace: g.trace('no bead')
             return
 
@@ -1466,6 +1490,7 @@ class undoer:
             u.redoHelper()
         else:
             g.trace('no redo helper for %s %s' % (u.kind,u.undoType))
+        if u.journal: u.journal.recordBead(bunch)
 
         # Redraw and recolor.
         c.frame.body.updateEditors() # New in Leo 4.4.8.
@@ -1578,6 +1603,8 @@ class undoer:
         newSel = u.newSel
         p = u.p.copy()
 
+        if u.groupCount == 0:
+            u.groupVnodes = []
         u.groupCount += 1
 
         bunch = u.beads[u.bead] ; count = 0
@@ -1594,6 +1621,9 @@ class undoer:
                     g.trace('oops: no redo helper for %s %s' % (u.undoType,p.h))
 
         u.groupCount -= 1
+        if u.groupCount == 0:
+            c.setAllAncestorAtFileNodesDirtyInList(u.groupVnodes)
+            u.groupVnodes = []
 
         u.updateMarks('new') # Bug fix: Leo 4.4.6.
 
@@ -1819,7 +1849,8 @@ class undoer:
             if trace: g.trace('cant undo',u.undoMenuLabel,u.redoMenuLabel)
             return
 
-        if not u.getBead(u.bead):
+        bunch = u.getBead(u.bead)
+        if not bunch:
             if trace: g.trace('no bead')
             return
 
@@ -1831,6 +1862,7 @@ class undoer:
             u.undoHelper()
         else:
             g.trace('no undo helper for %s %s' % (u.kind,u.undoType))
+        if u.journal: u.journal.recordBead(bunch)
 
         # Redraw and recolor.
         c.frame.body.updateEditors() # New in Leo 4.4.8.
@@ -1959,6 +1991,8 @@ class undoer:
         oldSel = u.oldSel
         p = u.p.copy()
 
+        if u.groupCount == 0:
+            u.groupVnodes = []
         u.groupCount += 1
 
         bunch = u.beads[u.bead] ; count = 0
@@ -1979,6 +2013,9 @@ class undoer:
                     g.trace('oops: no undo helper for %s %s' % (u.undoType,p.v))
 
         u.groupCount -= 1
+        if u.groupCount == 0:
+            c.setAllAncestorAtFileNodesDirtyInList(u.groupVnodes)
+            u.groupVnodes = []
 
         u.updateMarks('old') # Bug fix: Leo 4.4.6.
 
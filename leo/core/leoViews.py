@@ -10,7 +10,6 @@ from __future__ import print_function
 #@+<< imports >>
 #@+node:ekr.20131230090121.16506: ** << imports >> (leoViews.py)
 import leo.core.leoGlobals as g
-import copy
 import time
 #@-<< imports >>
 #@+others
@@ -80,18 +79,21 @@ class ViewController:
         self.global_bare_organizer_node_list = []
             # List of organizers that have no parent organizer node.
             # This list excludes existing organizer nodes.
-        self.headlines_dict = {}
-            # Keys are vnodes; values are list of child headlines.
         self.imported_organizers_list = []
             # The list of nodes that have children on entry, such as class nodes.
         self.n_nodes_scanned = 0
             # Number of nodes scanned by demote.
+        self.organized_d = {}
+            # Keys are tuples (anchor.key(),p.key()), values are the ods organizing p.
         self.organizer_ods = []
             # List of od instances corresponding to @organizer: nodes.
         self.organizer_unls = []
             # The list of od.unl for all od instances in self.organizer_ods.
         self.root = None
             # The position of the @auto node.
+        self.sorted_organizer_unls = None
+            # A tuple (organizer_unls,n,aList) used by vc.drop_all_organizers_in_unl.
+            # aList contains organizer_unls, deepest unls first.
         self.pending = []
             # The list of nodes pending to be added to an organizer.
         self.stack = []
@@ -110,6 +112,8 @@ class ViewController:
             # This list is the "backbone" of this class:
             # - The front end (demote and its helpers) adds items to this list.
             # - The back end (move_nodes and its helpers) moves nodes using this list.
+        self.work_list_keys = set()
+            # The set of (parent.key(),p.key()) for all tuples in self.work_list.
     #@+node:ekr.20131230090121.16514: *3* vc.Entry points
     #@+node:ekr.20140125071842.10474: *4* vc.convert_at_file_to_at_auto
     def convert_at_file_to_at_auto(self,root):
@@ -587,7 +591,6 @@ class ViewController:
         unls = [s[4:].strip() for s in lines if s.startswith('unl:')]
         # g.trace('at_clones.b',at_clones.b)
         if len(gnxs) == len(unls):
-            vc.headlines_dict = {} # May be out of date.
             ok = True
             for gnx,unl in zip(gnxs,unls):
                 ok = ok and vc.create_clone_link(gnx,root,unl)
@@ -841,13 +844,17 @@ class ViewController:
         '''Compute the list of positions organized by every od.'''
         trace = False and not g.unitTesting
         vc = self
+        claimed = {}
+            # Resolve the unls of siblings having the same headline to
+            # successive siblings, not always to the first sibling.
+            # See vc.find_position_for_relative_unl.
         for od in vc.all_ods:
             if od.unls:
                 # Do a full search only for the first unl.
                 ### parent = vc.find_position_for_relative_unl(root,od.unls[0])
                 if True: ### parent:
                     for unl in od.unls:
-                        p = vc.find_position_for_relative_unl(root,unl)
+                        p = vc.find_position_for_relative_unl(root,unl,claimed)
                         ### p = vc.find_position_for_relative_unl(parent,vc.unl_tail(unl))
                         if p:
                             od.organized_nodes.append(p.copy())
@@ -880,6 +887,16 @@ class ViewController:
             for key in sorted(d.keys()):
                 g.trace('od.anchor: %s ods: [%s]' % (key.h,','.join(z.h for z in d.get(key))))
         vc.anchors_d = d
+        # Create vc.organized_d, so vc.find_organizer is a single dict lookup.
+        # The first od in vc.all_ods organizing p wins, as in the anchors_d lists.
+        organized_d = {}
+        for od in vc.all_ods:
+            anchor_key = od.anchor.key()
+            for p in od.organized_nodes:
+                key = anchor_key,p.key()
+                if key not in organized_d:
+                    organized_d[key] = od
+        vc.organized_d = organized_d
     #@+node:ekr.20140106215321.16678: *6* vc.move_nodes & helpers
     def move_nodes(self):
         '''Move nodes to their final location and delete the temp node.'''
@@ -917,7 +934,15 @@ class ViewController:
                 g.trace('%s %-20s %s' % (id(key),key.h,vc.dump_list(aList,indent=29)))
         # Move *copies* of non-organizer nodes to each organizer.
         organizers = list(d.keys())
-        existing_organizers = [z.p.copy() for z in vc.existing_ods]
+        # Use sets so each test below takes constant time.
+        # Imported positions do not change until the final deletes,
+        # so their keys are stable. Organizer positions may move:
+        # the work list contains the very same position objects.
+        existing_keys = set([z.p.key() for z in vc.existing_ods])
+        organizer_keys = set([z.key() for z in organizers])
+        organizer_ids = set([id(z) for z in organizers])
+        def is_organizer(p):
+            return id(p) in organizer_ids or p.key() in organizer_keys
         moved_existing_organizers = {} # Keys are vnodes, values are positions.
         for parent in organizers:
             aList = d.get(parent,[])
@@ -926,7 +951,7 @@ class ViewController:
                     'with %s children:' % (len(aList)),
                     '\n  '+'\n  '.join([z.h for z in aList]))
             for p in aList:
-                if p in existing_organizers:
+                if p.key() in existing_keys:
                     if trace and trace_moves:
                         g.trace('copying existing organizer:',p.h)
                         g.trace('children:',
@@ -936,7 +961,7 @@ class ViewController:
                     if old and trace_moves:
                         g.trace('*********** overwrite',p.h)
                     moved_existing_organizers[p.v] = copy
-                elif p in organizers:
+                elif is_organizer(p):
                     if trace and trace_moves:
                         g.trace('moving organizer:',p.h)
                     aList = d.get(p)
@@ -964,15 +989,23 @@ class ViewController:
         sorted_list = sorted(vc.work_list,key=sort_key)
         if trace and trace_deletes:
             g.trace('===== deleting nodes in reverse outline order...')
+        dirty = False
         for parent,p in reversed(sorted_list):
             if p.v in moved_existing_organizers:
                 if trace and trace_deletes:
                     g.trace('deleting moved existing organizer:',p.h)
-                p.doDelete()
-            elif p not in organizers:
+            elif not is_organizer(p):
                 if trace and trace_deletes:
                     g.trace('deleting non-organizer:',p.h)
-                p.doDelete()
+            else:
+                continue
+            if not dirty:
+                # All deleted nodes are in the same @auto tree,
+                # so mark the @file nodes dirty just once.
+                p.setDirty()
+                dirty = True
+            p._unlink()
+                # p.doDelete scans all following siblings.
     #@+node:ekr.20140109214515.16637: *7* vc.move_bare_organizers
     def move_bare_organizers(self,trace):
         '''Move all nodes in global_bare_organizer_node_list.'''
@@ -1016,10 +1049,8 @@ class ViewController:
             # A failed assert leads to unbounded recursion.
         # print('copy_tree_to_last_child_of',p.h,parent.h)
         root = parent.insertAsLastChild()
-        root.b,root.h = p.b,p.h
-        root.v.u = copy.deepcopy(p.v.u)
-        for child in p.children():
-            vc.copy_tree_to_last_child_of(child,root)
+        p.copyTreeFromSelfTo(root)
+            # Don't use the p.b and p.h setters: they mark nodes dirty one by one.
         return root
     #@+node:ekr.20140124111748.10635: *5* vc.update_headlines_after_read
     def update_headlines_after_read(self,root):
@@ -1042,7 +1073,6 @@ class ViewController:
         else:
             unls,heads = [],[]
         if len(unls) == len(heads):
-            vc.headlines_dict = {} # May be out of date.
             for unl,head in zip(unls,heads):
                 p = vc.find_position_for_relative_unl(root,unl)
                 if p:
@@ -1138,7 +1168,7 @@ class ViewController:
             # If this is an existing organizer, it's *position* may have
             # been moved without active.moved being set.
             data = od.parent_od.p,od.p
-            if data in vc.work_list:
+            if (data[0].key(),data[1].key()) in vc.work_list_keys:
                 if trace and verbose: g.trace(
                     '**** duplicate 1: setting moved bit.',od.h)
                 od.moved = True
@@ -1197,6 +1227,7 @@ class ViewController:
         trace = False # and not g.unitTesting
         vc = self
         vc.work_list.append(data)
+        vc.work_list_keys.add((data[0].key(),data[1].key()),)
         if trace:
             active,p = data
             g.trace('=====',tag,active.h,'==>',p.h)
@@ -1254,12 +1285,9 @@ class ViewController:
         trace = False # and not g.unitTesting
         vc = self
         anchor = parent
-        ods = vc.anchors_d.get(anchor,[])
-        for od in ods:
-            if p in od.organized_nodes:
-                if trace: g.trace('found:',od.h,'for',p.h)
-                return od
-        return None
+        od = vc.organized_d.get((anchor.key(),p.key()))
+        if od and trace: g.trace('found:',od.h,'for',p.h)
+        return od
     #@+node:ekr.20140117131738.16724: *6* vc.terminate_organizers
     def terminate_organizers(self,active,p):
         '''Terminate all organizers whose anchors are not ancestors of p.'''
@@ -1542,13 +1570,17 @@ class ViewController:
         '''Compute the list of positions organized by every od.'''
         trace = False and not g.unitTesting
         vc = self
+        claimed = {}
+            # Resolve the unls of siblings having the same headline to
+            # successive siblings, not always to the first sibling.
+            # See vc.find_position_for_relative_unl.
         for od in vc.all_ods:
             if od.unls:
                 # Do a full search only for the first unl.
                 ### parent = vc.find_position_for_relative_unl(root,od.unls[0])
                 if True: ### parent:
                     for unl in od.unls:
-                        p = vc.find_position_for_relative_unl(root,unl)
+                        p = vc.find_position_for_relative_unl(root,unl,claimed)
                         ### p = vc.find_position_for_relative_unl(parent,vc.unl_tail(unl))
                         if p:
                             od.organized_nodes.append(p.copy())
@@ -1581,6 +1613,16 @@ class ViewController:
             for key in sorted(d.keys()):
                 g.trace('od.anchor: %s ods: [%s]' % (key.h,','.join(z.h for z in d.get(key))))
         vc.anchors_d = d
+        # Create vc.organized_d, so vc.find_organizer is a single dict lookup.
+        # The first od in vc.all_ods organizing p wins, as in the anchors_d lists.
+        organized_d = {}
+        for od in vc.all_ods:
+            anchor_key = od.anchor.key()
+            for p in od.organized_nodes:
+                key = anchor_key,p.key()
+                if key not in organized_d:
+                    organized_d[key] = od
+        vc.organized_d = organized_d
     #@+node:ekr.20140104112957.16587: *4* vc.demote & helpers
     def demote(self,root):
         '''
@@ -1669,7 +1711,7 @@ class ViewController:
             # If this is an existing organizer, it's *position* may have
             # been moved without active.moved being set.
             data = od.parent_od.p,od.p
-            if data in vc.work_list:
+            if (data[0].key(),data[1].key()) in vc.work_list_keys:
                 if trace and verbose: g.trace(
                     '**** duplicate 1: setting moved bit.',od.h)
                 od.moved = True
@@ -1728,6 +1770,7 @@ class ViewController:
         trace = False # and not g.unitTesting
         vc = self
         vc.work_list.append(data)
+        vc.work_list_keys.add((data[0].key(),data[1].key()),)
         if trace:
             active,p = data
             g.trace('=====',tag,active.h,'==>',p.h)
@@ -1785,12 +1828,9 @@ class ViewController:
         trace = False # and not g.unitTesting
         vc = self
         anchor = parent
-        ods = vc.anchors_d.get(anchor,[])
-        for od in ods:
-            if p in od.organized_nodes:
-                if trace: g.trace('found:',od.h,'for',p.h)
-                return od
-        return None
+        od = vc.organized_d.get((anchor.key(),p.key()))
+        if od and trace: g.trace('found:',od.h,'for',p.h)
+        return od
     #@+node:ekr.20140117131738.16724: *5* vc.terminate_organizers
     def terminate_organizers(self,active,p):
         '''Terminate all organizers whose anchors are not ancestors of p.'''
@@ -1848,7 +1888,15 @@ class ViewController:
                 g.trace('%s %-20s %s' % (id(key),key.h,vc.dump_list(aList,indent=29)))
         # Move *copies* of non-organizer nodes to each organizer.
         organizers = list(d.keys())
-        existing_organizers = [z.p.copy() for z in vc.existing_ods]
+        # Use sets so each test below takes constant time.
+        # Imported positions do not change until the final deletes,
+        # so their keys are stable. Organizer positions may move:
+        # the work list contains the very same position objects.
+        existing_keys = set([z.p.key() for z in vc.existing_ods])
+        organizer_keys = set([z.key() for z in organizers])
+        organizer_ids = set([id(z) for z in organizers])
+        def is_organizer(p):
+            return id(p) in organizer_ids or p.key() in organizer_keys
         moved_existing_organizers = {} # Keys are vnodes, values are positions.
         for parent in organizers:
             aList = d.get(parent,[])
@@ -1857,7 +1905,7 @@ class ViewController:
                     'with %s children:' % (len(aList)),
                     '\n  '+'\n  '.join([z.h for z in aList]))
             for p in aList:
-                if p in existing_organizers:
+                if p.key() in existing_keys:
                     if trace and trace_moves:
                         g.trace('copying existing organizer:',p.h)
                         g.trace('children:',
@@ -1867,7 +1915,7 @@ class ViewController:
                     if old and trace_moves:
                         g.trace('*********** overwrite',p.h)
                     moved_existing_organizers[p.v] = copy
-                elif p in organizers:
+                elif is_organizer(p):
                     if trace and trace_moves:
                         g.trace('moving organizer:',p.h)
                     aList = d.get(p)
@@ -1895,15 +1943,23 @@ class ViewController:
         sorted_list = sorted(vc.work_list,key=sort_key)
         if trace and trace_deletes:
             g.trace('===== deleting nodes in reverse outline order...')
+        dirty = False
         for parent,p in reversed(sorted_list):
             if p.v in moved_existing_organizers:
                 if trace and trace_deletes:
                     g.trace('deleting moved existing organizer:',p.h)
-                p.doDelete()
-            elif p not in organizers:
+            elif not is_organizer(p):
                 if trace and trace_deletes:
                     g.trace('deleting non-organizer:',p.h)
-                p.doDelete()
+            else:
+                continue
+            if not dirty:
+                # All deleted nodes are in the same @auto tree,
+                # so mark the @file nodes dirty just once.
+                p.setDirty()
+                dirty = True
+            p._unlink()
+                # p.doDelete scans all following siblings.
     #@+node:ekr.20140109214515.16637: *5* vc.move_bare_organizers
     def move_bare_organizers(self,trace):
         '''Move all nodes in global_bare_organizer_node_list.'''
@@ -1947,10 +2003,8 @@ class ViewController:
             # A failed assert leads to unbounded recursion.
         # print('copy_tree_to_last_child_of',p.h,parent.h)
         root = parent.insertAsLastChild()
-        root.b,root.h = p.b,p.h
-        root.v.u = copy.deepcopy(p.v.u)
-        for child in p.children():
-            vc.copy_tree_to_last_child_of(child,root)
+        p.copyTreeFromSelfTo(root)
+            # Don't use the p.b and p.h setters: they mark nodes dirty one by one.
         return root
     #@+node:ekr.20131230090121.16515: *3* vc.Helpers
     #@+node:ekr.20140103105930.16448: *4* vc.at_auto_view_body and match_at_auto_body
@@ -2104,6 +2158,10 @@ class ViewController:
         '''Return a node matching the given absolute unl.'''
         vc = self
         aList = unl.split('-->')
+        # Try an exact match first: c.unlCache finds it in O(depth) time.
+        found,junk,p = vc.c.unlCache.find(aList)
+        if found:
+            return p
         if aList:
             first,rest = aList[0],'-->'.join(aList[1:])
             for parent in vc.c.rootPosition().self_and_siblings():
@@ -2163,10 +2221,7 @@ class ViewController:
         # This is part of the read logic, so newly-imported
         # nodes will never have the given gnx.
         vc = self
-        for p in vc.c.all_unique_positions():
-            if p.v.gnx == gnx:
-                return p
-        return None
+        return g.app.gnxIndex.findPosition(gnx,vc.c)
     #@+node:ekr.20131230090121.16518: *5* vc.find_organizers_node
     def find_at_organizers_node(self,root):
         '''
@@ -2183,10 +2238,18 @@ class ViewController:
             p.h = h
         return p
     #@+node:ekr.20131230090121.16539: *5* vc.find_position_for_relative_unl
-    def find_position_for_relative_unl(self,parent,unl):
+    def find_position_for_relative_unl(self,parent,unl,claimed=None):
         '''
         Return the node in parent's subtree matching the given unl.
         The unl is relative to the parent position.
+        
+        claimed is None or a dict. If given, successive calls whose last unl
+        part matches a headline shared by several siblings return successive
+        siblings, in outline order: the k'th claim returns the k'th sibling.
+        Claims beyond the number of siblings return the first sibling.
+        compute_all_organized_positions makes claims in the order of
+        vc.all_ods and od.unls, so organizers get duplicate nodes in the
+        order in which the @organizers tree lists them.
         '''
         # This is called from finish_create_organizers & compute_all_organized_positions.
         trace = False # and not g.unitTesting
@@ -2197,23 +2260,30 @@ class ViewController:
             if trace and trace_success:
                 g.trace('return parent for empty unl:',parent.h)
             return parent
+        cache = vc.c.unlCache
+        cache.check() # Clear the cache if any headline has changed.
         # The new, simpler way: drop components of the unl automatically.
         drop,p = [],parent # for debugging.
         # if trace: g.trace('p:',p.h,'unl:',unl)
-        for s in unl.split('-->'):
+        aList = unl.split('-->')
+        last = len(aList)-1
+        for i,s in enumerate(aList):
             found = False # The last part must match.
             if 1:
-                # Create the list of children on the fly.
-                aList = vc.headlines_dict.get(p.v)
-                if aList is None:
-                    aList = [z.h for z in p.children()]
-                    vc.headlines_dict[p.v] = aList
-                try:
-                    n = aList.index(s)
+                # c.unlCache indexes the headlines of p's children on the fly.
+                indices = cache.childIndices(p.v,s)
+                if indices:
+                    n = indices[0]
+                    if claimed is not None and i == last and len(indices) > 1:
+                        key = p.key(),s
+                        k = claimed.get(key,0)
+                        claimed[key] = k+1
+                        if k < len(indices):
+                            n = indices[k]
                     p = p.nthChild(n)
                     found = True
                     if trace and trace_loop: g.trace('match:',s)
-                except ValueError: # s not in aList.
+                else: # s is not a child's headline.
                     if trace and trace_loop: g.trace('drop:',s)
                     drop.append(s)
             else: # old code.
@@ -2447,7 +2517,12 @@ class ViewController:
         vc = self
         def unl_sort_key(s):
             return s.count('-->')
-        for s in reversed(sorted(organizer_unls,key=unl_sort_key)):
+        # Sort organizer_unls only when it changes.
+        data = vc.sorted_organizer_unls
+        if not data or data[0] is not organizer_unls or data[1] != len(organizer_unls):
+            data = vc.sorted_organizer_unls = organizer_unls,len(organizer_unls),\
+                list(reversed(sorted(organizer_unls,key=unl_sort_key)))
+        for s in data[2]:
             if unl.startswith(s):
                 s2 = vc.drop_unl_tail(s)
                 unl = s2 + unl[len(s):]
@@ -2485,9 +2560,11 @@ class ViewController:
     def unl(self,p):
         '''Return the unl corresponding to the given position.'''
         vc = self
-        return '-->'.join(reversed([
-            getattr(p.v,vc.headline_ivar,p.h)
-                for p in p.self_and_parents()]))
+        ivar = vc.headline_ivar
+        # Use p.stack: don't create a position for each ancestor.
+        aList = [v for v,n in p.stack]
+        aList.append(p.v)
+        return '-->'.join([getattr(v,ivar,v.h) for v in aList])
         # return '-->'.join(reversed([p.h for p in p.self_and_parents()]))
     #@+node:ekr.20140106215321.16680: *5* vc.source_unl
     def source_unl(self,organizer_unls,organizer_unl):
@@ -71,7 +71,9 @@ while todo:
         fn, node = item, None
         
     if node:
-        c = fn2c.setdefault(fn, controller.openLeoFile(fn))
+        if fn not in fn2c:
+            fn2c[fn] = controller.openLeoFile(fn)
+        c = fn2c[fn]
         found, dummy, p = g.recursiveUNLSearch(node.split('-->'), c)
         if not found:
             print("Could not find '%s'"%item)
@@ -103,6 +105,12 @@ while todo:
         if len(files) != 1:
             print (" FILE: %s"%real_name)
     
-        c = fn2c.setdefault(real_name, controller.openLeoFile(fn))
-        fts.drop_document(real_name)
+        # Only changed nodes are re-indexed.
+        c = fn2c.get(real_name) or controller.openLeoFile(fn)
         fts.index_nodes(c)
+        if real_name not in fn2c:
+            # Keep memory bounded: only one indexed outline is open at a time.
+            # closeLeoWindow would write the recent files list and quit Leo.
+            g.app.destroyWindow(c.frame)
+
+fts.close()
@@ -64,6 +64,7 @@ class baseNativeTreeWidget (leoFrame.leoTree):
 
         # Debugging...
         self.nodeDrawCount = 0
+        self.totalNodeDrawCount = 0 # For c.commandStats.
         self.traceCallersFlag = False # Enable traceCallers method.
 
         # Associating items with position and vnodes...
@@ -148,6 +149,7 @@ class baseNativeTreeWidget (leoFrame.leoTree):
             self.drawTopTree(p)
         finally:
             self.redrawing = False
+        self.totalNodeDrawCount += self.nodeDrawCount
         self.setItemForCurrentPosition(scroll=scroll)
         c.requestRedrawFlag= False
         if trace:
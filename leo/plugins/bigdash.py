@@ -156,7 +156,7 @@ class GlobalSearch:
         if not (q or ss.startswith("fts ")):
             return False
         if not leofts:
-            g.es("Whoosh not installed (easy_install whoosh)")
+            g.es("leofts not available (requires sqlite3)")
             return False
         print("Doing fts", qs)
         fts = self.get_fts()
@@ -180,11 +180,7 @@ class GlobalSearch:
             for c2 in g.app.commanders():
                 fn = c2.mFileName
                 print("Refreshing", fn)
-                fts.drop_document(fn)
                 fts.index_nodes(c2)
-            gc = g._gnxcache            
-            gc.clear()
-            gc.update_new_cs()
             
                 
         if q:
@@ -236,9 +232,7 @@ class GlobalSearch:
             l = l[4:]
             open_unl(l)
             return
-        gc = g._gnxcache
-        gc.update_new_cs()
-        hit = gc.get_p(l)
+        hit = g._gnxcache.get_p(l)
         if hit:
             c,p = hit
             print("found!")
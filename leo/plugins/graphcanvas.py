@@ -109,15 +109,11 @@ def onCreate (tag, keys):
     
     if c_db_key in c.db:
         gnx = c.db[c_db_key]
-        v = None
-        for i in c.all_unique_nodes():
-            if i.gnx == gnx:
-                break
-        else:
+        p = g.app.gnxIndex.findPosition(gnx,c)
+        if not p:
             return
         
-        c.graphcanvasController.loadGraph(
-            c.vnode2position(i).self_and_subtree())
+        c.graphcanvasController.loadGraph(p.self_and_subtree())
         c.graphcanvasController.loadLinked('all')
 #@+node:tbrown.20110716130512.21969: ** command graph-toggle-autoload
 @g.command('graph-toggle-autoload')
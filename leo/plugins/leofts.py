@@ -1,9 +1,16 @@
-import whoosh
-from whoosh.index import create_in, open_dir
-from whoosh.fields import *
-from whoosh.qparser import MultifieldParser
-from whoosh.analysis import RegexTokenizer, LowercaseFilter, StopFilter
+""" Full text search for Leo outlines.
+
+The index is a single sqlite3 file. Each indexed outline (a "document")
+owns its own segment of nodes and postings, so outlines can be added,
+refreshed or dropped independently. Refreshing an outline rewrites only
+the nodes that changed. Results are ranked with BM25.
+"""
+
+import hashlib
+import math
 import os
+import re
+import sqlite3
 
 g = None
 
@@ -16,14 +23,24 @@ def init ():
 
     print ("bigdash init")
     import leo.core.leoGlobals as g
-    
+
     set_leo(g)
     ok = g.app.gui.guiName() == "qt"
     g._fts = None
     g._gnxcache = GnxCache()
-    
+    g.registerHandler('save2', onSave)
+
     return ok
 
+def onSave(tag, keys):
+    """ Refresh the index for outlines that have already been indexed. """
+    c = keys.get('c')
+    if not c or not c.mFileName:
+        return
+    fts = get_fts()
+    if fts.has_document(c.mFileName):
+        fts.index_nodes(c)
+
 def get_fts():
     if g._fts is None:
         g._fts = LeoFts( g.app.homeLeoDir + "/fts_index")
@@ -35,126 +52,286 @@ def all_positions_global():
             yield (c,p)
 
 class GnxCache:
-    """ map gnx => vnode """
-    def __init__(self):
-        self.clear()
+    """ map gnx => (c, vnode), using g.app.gnxIndex """
     def update_new_cs(self):
-        for c in g.app.commanders():
-            if c.hash() not in self.cs:
-                for p in c.all_unique_positions():
-                    k = p.gnx
-                    self.ps[k] = c, p.v
-                self.cs.add(c.hash())
-        
+        pass # g.app.gnxIndex is always up to date.
+
     def get(self, gnx):
-        if not self.ps:
-            self.update_new_cs()
-        res = self.ps.get(gnx, None)                               
-        return res
+        v = g.app.gnxIndex.find(gnx)
+        if v:
+            return v.context, v
+        return None
     def get_p(self,gnx):
-        r = self.get(gnx)
-        if r:
-            c,v = r
-            for p in c.all_unique_positions():
-                if p.v is v:
-                    return c,p.copy()
-        
-        print("Not in gnx cache, slow!")
-        
-        for c,p in all_positions_global():
-            
-            if p.gnx == gnx:
-                return c,p.copy()
+        p = g.app.gnxIndex.findPosition(gnx)
+        if p:
+            return p.v.context, p
         return None
-        
+
     def clear(self):
-        self.ps = {}
-        self.cs = set()
+        pass
+
+# Like whoosh's RegexTokenizer("[a-zA-Z_]+") | LowercaseFilter() | StopFilter()
+TOKEN_RE = re.compile("[a-zA-Z_]+")
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'for', 'from',
+    'have', 'if', 'in', 'is', 'it', 'may', 'not', 'of', 'on', 'or', 'tbd',
+    'that', 'the', 'this', 'to', 'us', 'we', 'when', 'will', 'with', 'yet',
+    'you', 'your'))
+
+def tokenize(s):
+    """ Return the list of index terms in s. """
+    return [t for t in (m.group(0).lower() for m in TOKEN_RE.finditer(s))
+        if len(t) > 1 and t not in STOP_WORDS]
+
+def term_counts(s):
+    d = {}
+    for t in tokenize(s):
+        d[t] = d.get(t, 0) + 1
+    return d
+
+SCHEMA = """
+create table if not exists doc (
+    id integer primary key,
+    name text unique);
+create table if not exists node (
+    id integer primary key,
+    doc integer,
+    gnx text,
+    h text,
+    parent text,
+    hash text,
+    len integer);
+create index if not exists node_doc on node(doc);
+create table if not exists posting (
+    term text,
+    node integer,
+    tf integer);
+create index if not exists posting_term on posting(term);
+create index if not exists posting_node on posting(node);
+"""
+
+class LeoFts:
+
+    # BM25 parameters.
+    k1 = 1.2
+    b = 0.75
+    head_weight = 3 # A term in a headline counts this many times.
 
-class LeoFts:    
     def __init__(self, idx_dir):
         self.idx_dir = idx_dir
         if not os.path.exists(idx_dir):
             os.mkdir(idx_dir)
-            self.create()
-        else:
-            self.ix = open_dir(idx_dir)
-    
-    def schema(self):
-        my_analyzer = RegexTokenizer("[a-zA-Z_]+") | LowercaseFilter() | StopFilter()
-        schema = Schema(h=TEXT(stored=True, analyzer=my_analyzer), gnx=ID(stored=True), b=TEXT(analyzer=my_analyzer), parent=ID(stored=True),
-                        doc=ID(stored=True))
-        return schema
-        
+        self.path = os.path.join(idx_dir, "fts.sqlite")
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(SCHEMA)
+
     def create(self):
-        
-        schema = self.schema()
-        self.ix = ix = create_in(self.idx_dir, schema)
-        
-        
+        """ Create an empty index. """
+        self.db.executescript("""
+            drop table if exists posting;
+            drop table if exists node;
+            drop table if exists doc;
+        """)
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def doc_id(self, docfile, create=False):
+        row = self.db.execute("select id from doc where name = ?", (docfile,)).fetchone()
+        if row:
+            return row[0]
+        if create:
+            return self.db.execute("insert into doc(name) values (?)", (docfile,)).lastrowid
+        return None
+
+    def has_document(self, docfile):
+        return self.doc_id(docfile) is not None
+
     def index_nodes(self, c):
-        writer = self.ix.writer()
+        """ Add c's outline to the index, or refresh it.
+
+        Only nodes that have changed since the outline was last indexed
+        are rewritten. Memory use is bounded by the size of one outline.
+        """
+        db = self.db
         doc = c.mFileName
+        docid = self.doc_id(doc, create=True)
+        old = {}
+        for nid, gnx, h in db.execute("select id, gnx, hash from node where doc = ?", (docid,)):
+            old[gnx] = nid, h
         for p in c.all_unique_positions():
-            #print "pushing",p
             if p.hasParent():
                 par = p.parent().get_UNL()
             else:
                 par = c.mFileName
-            
-            writer.add_document(h=p.h, b=p.b, gnx=unicode(p.gnx), parent=par, doc=doc)
-            
-        writer.commit()
-        g._gnxcache.clear()
+            text = '\n'.join([p.h, par, p.b])
+            h = hashlib.md5(g.toEncodedString(text, 'utf-8')).hexdigest()
+            data = old.pop(p.gnx, None)
+            if data:
+                nid, oldh = data
+                if oldh == h:
+                    continue
+                self.drop_nodes([nid])
+            self.add_node(docid, p, par, h)
+        # Remove deleted nodes.
+        self.drop_nodes([nid for nid, h in old.values()])
+        db.commit()
+
+    def add_node(self, docid, p, parent, h):
+        counts = term_counts(p.b)
+        for t, n in term_counts(p.h).items():
+            counts[t] = counts.get(t, 0) + n * self.head_weight
+        nid = self.db.execute(
+            "insert into node(doc, gnx, h, parent, hash, len) values (?,?,?,?,?,?)",
+            (docid, p.gnx, p.h, parent, h, sum(counts.values()))).lastrowid
+        self.db.executemany("insert into posting(term, node, tf) values (?,?,?)",
+            [(t, nid, n) for t, n in counts.items()])
+
+    def drop_nodes(self, nids):
+        for nid in nids:
+            self.db.execute("delete from posting where node = ?", (nid,))
+            self.db.execute("delete from node where id = ?", (nid,))
 
     def drop_document(self, docfile):
-        writer = self.ix.writer()
         print("Drop index", docfile)
-        writer.delete_by_term("doc", docfile)
-        writer.commit()
-        
+        docid = self.doc_id(docfile)
+        if docid is None:
+            return
+        db = self.db
+        db.execute("delete from posting where node in (select id from node where doc = ?)", (docid,))
+        db.execute("delete from node where doc = ?", (docid,))
+        db.execute("delete from doc where id = ?", (docid,))
+        db.commit()
+
     def statistics(self):
         r = {}
-        with self.ix.searcher() as s:
-            r['documents'] = list(s.lexicon("doc"))
+        r['documents'] = [name for (name,) in self.db.execute("select name from doc order by name")]
         print("stats",r)
         return r
-        
-        
-    def search(self, searchstring, limit=30):        
-                
+
+    def parse_query(self, searchstring):
+        """ Return (required, excluded) lists of terms.
+
+        All terms are required, except terms prefixed by '-' or 'NOT'.
+        A term ending in '*' matches all terms with that prefix.
+        """
+        required, excluded = [], []
+        negate = False
+        for word in searchstring.split():
+            if word == 'NOT':
+                negate = True
+                continue
+            if word in ('AND', 'OR'):
+                continue
+            if word.startswith('-'):
+                negate, word = True, word[1:]
+            prefix = word.endswith('*')
+            terms = tokenize(word)
+            if terms:
+                if prefix:
+                    terms[-1] += '*'
+                (excluded if negate else required).extend(terms)
+            negate = False
+        return required, excluded
+
+    def postings(self, term):
+        """ Return a dict of node ids to term frequencies for term. """
+        if term.endswith('*'):
+            pat = term[:-1].replace('%', '').replace('_', '\\_') + '%'
+            rows = self.db.execute(
+                "select node, sum(tf) from posting where term like ? escape '\\' group by node", (pat,))
+        else:
+            rows = self.db.execute("select node, tf from posting where term = ?", (term,))
+        return dict(rows.fetchall())
+
+    def search(self, searchstring, limit=30):
+
         res = []
-        g._gnxcache.update_new_cs()
-        with self.ix.searcher() as searcher:
-            #print (list(searcher.lexicon("b")))
-            query = MultifieldParser(["h", "b"], schema=self.schema()).parse(searchstring)
-            results = searcher.search(query, limit=limit)
-            print (results)
-            for r in results:
-                rr = r.fields()
-                
-                gnx = rr["gnx"]
-                tup = g._gnxcache.get(gnx)
-                if tup:
-                    rr['f'] = True
-                    cont = tup[1].b
-                    
-                    hl = r.highlights("b", text = cont)
-                    rr["highlight"] = hl
-                    
-                else:
-                    rr['f'] = False
-                res.append(rr)
-                
+        required, excluded = self.parse_query(searchstring)
+        if not required:
+            return res
+        # Intersect the posting lists, shortest first.
+        lists = sorted([self.postings(t) for t in required], key=len)
+        nids = set(lists[0])
+        for post in lists[1:]:
+            nids.intersection_update(post)
+        for term in excluded:
+            nids.difference_update(self.postings(term))
+        # Rank with BM25.
+        n_nodes, total = self.db.execute("select count(*), sum(len) from node").fetchone()
+        avgdl = float(total or 1) / max(1, n_nodes)
+        lens = self.node_lens(list(nids))
+        k1, b = self.k1, self.b
+        scores = dict((nid, 0.0) for nid in nids)
+        for post in lists:
+            idf = math.log(1 + (n_nodes - len(post) + 0.5) / (len(post) + 0.5))
+            for nid in nids:
+                tf = post[nid]
+                dl = lens.get(nid, avgdl)
+                scores[nid] += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))
+        best = sorted(scores, key=scores.get, reverse=True)[:limit]
+        data = self.node_data(best)
+        terms = [t.rstrip('*') for t in required]
+        for nid in best:
+            rr = data[nid]
+            tup = g._gnxcache.get(rr["gnx"])
+            if tup:
+                rr['f'] = True
+                cont = tup[1].b
+                rr["highlight"] = highlights(cont, terms)
+            else:
+                rr['f'] = False
+            res.append(rr)
+
         return res
-            
+
+    def node_lens(self, ids):
+        d = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i+500]
+            rows = self.db.execute("select id, len from node where id in (%s)" %
+                ','.join('?' * len(chunk)), chunk)
+            d.update(rows.fetchall())
+        return d
+
+    def node_data(self, ids):
+        d = {}
+        if not ids:
+            return d
+        rows = self.db.execute(
+            "select node.id, node.h, node.gnx, node.parent, doc.name from node, doc "
+            "where doc.id = node.doc and node.id in (%s)" % ','.join('?' * len(ids)), ids)
+        for nid, h, gnx, parent, doc in rows:
+            d[nid] = {'h': h, 'gnx': gnx, 'parent': parent, 'doc': doc}
+        return d
+
     def close(self):
-        self.ix.close()
-        
+        self.db.close()
+
+def highlights(text, terms, top=3):
+    """ Return html showing the lines of text that contain terms. """
+    if not terms:
+        return ''
+    pat = re.compile(r'\b(%s)' % '|'.join(re.escape(t) for t in terms), re.IGNORECASE)
+    res = []
+    for line in text.splitlines():
+        # Odd-numbered pieces are the matches. Escape the pieces, not the
+        # line, so matches never split or contain html entities.
+        pieces = pat.split(line)
+        if len(pieces) > 1:
+            res.append(''.join(
+                ('<b class="match">%s</b>' if i % 2 else '%s') % escape(piece)
+                    for i, piece in enumerate(pieces)))
+            if len(res) >= top:
+                break
+    return '...'.join(res)
+
+def escape(s):
+    return s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
 def main():
     fts = LeoFts("c:/t/ltest")
     fts.create()
-    
-    
+
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
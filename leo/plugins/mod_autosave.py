@@ -12,6 +12,18 @@ This plugin is active only if::
 
     @bool mod_autosave_active = True
 
+If the following setting is True, autosave never writes the .leo file or any
+external file::
+
+    @bool mod_autosave_background = False
+
+Instead, autosave takes a snapshot of the outline in the idle-time hook and a
+worker thread writes the snapshot, including the full text of all @<file>
+trees, to ~/.leo/autosave. Saving the outline deletes the autosave file. If
+the autosave file is newer than the outline when the outline is next opened,
+the recover-autosave command pastes the autosaved outline as the last
+top-level node.
+
  """
 #@-<< docstring >>
 
@@ -22,8 +34,11 @@ This plugin is active only if::
 #@+node:ekr.20060108123141: ** << imports >>
 import leo.core.leoGlobals as g
 
+import hashlib
 import os
+import threading
 import time
+import xml.sax.saxutils
 #@-<< imports >>
 #@+<< version history >>
 #@+node:ekr.20060108123141.1: ** << version history >>
@@ -39,9 +54,10 @@ import time
 #     - Don't use .ini file.  Use Leo settings, as described in the docstring.
 #     - Separate the code into onCreate (handles settings) and onIdle.
 #     - Use the global gDict to maintain per-commander values.
+# 1.1 EKR: Added @bool mod_autosave_background and the recover-autosave command.
 #@-<< version history >>
 
-__version__ = "1.0" # EKR: a complete rewrite using only Leo settings.
+__version__ = "1.1"
 
 # The global settings dict.
 gDict = {} # Keys are commanders, values are settings dicts.
@@ -55,6 +71,8 @@ def init ():
     if ok:
         # Register the handlers...
         g.registerHandler('after-create-leo-frame',onCreate)
+        g.registerHandler('open2',onOpen)
+        g.registerHandler('save2',onSave)
         g.plugin_signon( __name__ )
 
     return ok
@@ -75,12 +93,18 @@ def onCreate(tag, keywords):
 
     active = c.config.getBool('mod_autosave_active',default=False)
     interval = c.config.getInt('mod_autosave_interval')
+    background = c.config.getBool('mod_autosave_background',default=False)
 
     if active:
         # Create an entry in the global settings dict.
         d = {
             'last':time.time(),
             'interval':interval,
+            'background':background,
+            'generation':0, # Incremented by each save.
+            'lock':threading.Lock(),
+            'status':None, # Set by the worker thread.
+            'thread':None,
         }
         gDict[c.hash()] = d
         g.es("auto save enabled every %s sec." % (
@@ -102,6 +126,9 @@ def onIdle (tag,keywords):
     if g.unitTesting: return # 2011/02/28
     d = gDict.get(c.hash())
     if not d: return
+    if d.get('background'):
+        onIdleBackground(c,d)
+        return
     last = d.get('last')
     interval = d.get('interval')
     if time.time()-last >= interval:
@@ -135,5 +162,193 @@ def onIdle (tag,keywords):
         gDict[c.hash()] = d
     elif trace:
         g.trace('not time',c.shortFileName())
+#@+node:ekr.20140219061533.16780: ** onIdleBackground
+def onIdleBackground (c,d):
+
+    """
+    Snapshot the outline and start a thread to write the snapshot.
+
+    Only the snapshot happens in the gui thread. It never blocks.
+    """
+
+    status = d.get('status')
+    if status:
+        # Report the worker's results from the gui thread.
+        d['status'] = None
+        g.es(status,color="orange")
+    if time.time()-d.get('last') < d.get('interval'):
+        return
+    thread = d.get('thread')
+    if thread and thread.is_alive():
+        return # Try again at the next idle time.
+    d['last'] = time.time()
+    if not c.mFileName or not c.changed:
+        return
+    snapshot = takeSnapshot(c)
+    thread = threading.Thread(target=writeSnapshot,
+        args=(snapshot,autosaveFileName(c),d,d.get('generation')))
+    thread.daemon = True
+    d['thread'] = thread
+    thread.start()
+#@+node:ekr.20140219061533.16781: ** onOpen
+def onOpen (tag,keywords):
+
+    """Tell the user about an autosave file that is newer than the outline."""
+
+    c = keywords.get('c')
+    if g.app.killed or not c or not c.exists or not c.mFileName: return
+    if g.unitTesting: return
+    fn = autosaveFileName(c)
+    if (
+        g.os_path_exists(fn) and g.os_path_exists(c.mFileName) and
+        g.os_path_getmtime(fn) > g.os_path_getmtime(c.mFileName)
+    ):
+        g.es("autosave file is newer than %s" % c.shortFileName(),color="orange")
+        g.es("use recover-autosave to recover it",color="orange")
+#@+node:ekr.20140219061533.16782: ** onSave
+def onSave (tag,keywords):
+
+    """Delete the autosave file: the outline itself is up to date."""
+
+    c = keywords.get('c')
+    if g.app.killed or not c or not c.exists or not c.mFileName: return
+    d = gDict.get(c.hash())
+    if not d or not d.get('background'): return
+    lock = d.get('lock')
+    lock.acquire()
+    try:
+        # Any snapshot taken before this save is obsolete.
+        d['generation'] += 1
+        fn = autosaveFileName(c)
+        if g.os_path_exists(fn):
+            os.remove(fn)
+    finally:
+        lock.release()
+#@+node:ekr.20140219061533.16783: ** recover-autosave
+@g.command('recover-autosave')
+def recoverAutosave (event):
+
+    """Paste the autosaved outline as the last top-level node."""
+
+    c = event['c']
+    if not c or not c.mFileName: return
+    fn = autosaveFileName(c)
+    if not g.os_path_exists(fn):
+        g.es("no autosave file for %s" % c.shortFileName(),color="blue")
+        return
+    f = open(fn,'rb')
+    try:
+        s = g.toUnicode(f.read(),'utf-8')
+    finally:
+        f.close()
+    c.selectPosition(c.lastTopLevel())
+    c.p.contract()
+    p = c.fileCommands.getLeoOutlineFromClipboard(s,reassignIndices=True)
+    if p:
+        c.setChanged(True)
+        c.redraw(p)
+        g.es("recovered %s" % fn,color="blue")
+#@+node:ekr.20140219061533.16784: ** Snapshots
+#@+node:ekr.20140219061533.16785: *3* autosaveFileName
+def autosaveFileName (c):
+
+    """Return the name of c's autosave file."""
+
+    path = g.os_path_normcase(g.os_path_abspath(c.mFileName))
+    key = hashlib.md5(g.toEncodedString(path,'utf-8')).hexdigest()[:8]
+    return g.os_path_finalize_join(g.app.homeLeoDir,'autosave',
+        '%s-%s.leo' % (g.shortFileName(c.mFileName),key))
+#@+node:ekr.20140219061533.16786: *3* takeSnapshot
+def takeSnapshot (c):
+
+    """
+    Return an immutable snapshot of c's outline.
+
+    Strings are immutable, so the snapshot copies no text.
+    """
+
+    nodes = {}
+    for v in c.all_unique_nodes():
+        nodes[v.gnx] = (v.h,v.b,tuple([z.gnx for z in v.children]))
+    roots = tuple([z.gnx for z in c.hiddenRootNode.children])
+    return c.shortFileName(),time.time(),roots,nodes
+#@+node:ekr.20140219061533.16787: *3* snapshotToString
+def snapshotToString (snapshot):
+
+    """
+    Return the snapshot as a Leo outline in clipboard format.
+
+    All trees are written in full, so the outline contains the text of all
+    @<file> trees.
+    """
+
+    name,t,roots,nodes = snapshot
+    escape = xml.sax.saxutils.escape
+    result = [
+        '<?xml version="1.0" encoding="utf-8"?>\n',
+        '<leo_file xmlns:leo="http://www.leo-editor.org/2011/leo" >\n',
+        '<leo_header file_format="2"/>\n',
+        '<vnodes>\n',
+    ]
+    seen = set()
+    def putVnode(gnx):
+        if gnx in seen:
+            result.append('<v t="%s"></v>\n' % gnx) # A clone.
+            return
+        seen.add(gnx)
+        h,b,children = nodes[gnx]
+        result.append('<v t="%s"><vh>%s</vh>' % (gnx,escape(h or '')))
+        if children:
+            result.append('\n')
+            for child in children:
+                putVnode(child)
+        result.append('</v>\n')
+    # Put all roots in a single top-level node.
+    top = 'autosave.%s.0' % time.strftime('%Y%m%d%H%M%S',time.localtime(t))
+    result.append('<v t="%s"><vh>%s</vh>\n' % (
+        top,escape('Autosave: %s %s' % (name,time.ctime(t)))))
+    for gnx in roots:
+        putVnode(gnx)
+    result.append('</v>\n</vnodes>\n<tnodes>\n')
+    for gnx in sorted(seen):
+        b = nodes[gnx][1]
+        result.append('<t tx="%s">%s</t>\n' % (gnx,escape(b) if b else ''))
+    result.append('</tnodes>\n</leo_file>\n')
+    return ''.join(result)
+#@+node:ekr.20140219061533.16788: *3* writeSnapshot
+def writeSnapshot (snapshot,fn,d,generation):
+
+    """
+    Write the snapshot to fn. Called in a worker thread.
+
+    Do not touch the outline or the gui here.
+    """
+
+    try:
+        s = snapshotToString(snapshot)
+        theDir = g.os_path_dirname(fn)
+        if not g.os_path_exists(theDir):
+            os.makedirs(theDir)
+        tmp = fn + '.tmp'
+        f = open(tmp,'wb')
+        try:
+            f.write(g.toEncodedString(s,'utf-8'))
+        finally:
+            f.close()
+        lock = d.get('lock')
+        lock.acquire()
+        try:
+            if generation == d.get('generation'):
+                if g.os_path_exists(fn):
+                    os.remove(fn) # Required on Windows.
+                os.rename(tmp,fn)
+                d['status'] = "Autosave: %s" % time.ctime()
+            else:
+                # The outline was saved after the snapshot.
+                os.remove(tmp)
+        finally:
+            lock.release()
+    except Exception:
+        d['status'] = "Autosave failed: %s" % fn
 #@-others
 #@-leo
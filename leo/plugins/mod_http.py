@@ -27,6 +27,21 @@ To enable this plugin put this into your file::
         @int  http_port = 8130
         @string rst_http_attributename = 'rst_http_attribute'
 
+By default, a separate server thread serves the pages, so serving pages never
+delays Leo itself. The server thread serves a snapshot of the open outlines,
+taken when outlines are opened, created or saved: pages show the outline as it
+was last saved. The server caches the rendered pages and sends an ETag with
+each page, so browsers can revalidate pages cheaply. Connections are kept
+alive between requests. Bookmarking requests (see below) still run in Leo's
+main thread. The following settings control the server thread::
+
+    @bool http_threaded = True
+    @int  http_cache_size = 1000
+
+http_cache_size is the number of rendered pages the server caches. Set
+http_threaded to False to serve pages from Leo's idle-time hook instead,
+without snapshots.
+
 **Note**: IP address 127.0.0.1 is accessible by all users logged into your
 local machine. That means while Leo and mod_http is running anyone logged into
 your machine will be able to browse all your leo outlines and add bookmarks.
@@ -79,7 +94,7 @@ depending on settings - set ``dom.allow_scripts_to_close_windows`` to true in
 # Adapted and extended from the Python Cookbook:
 # http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/259148
 
-__version__ = "0.99"
+__version__ = "1.00"
 
 # This encoding must match the character encoding used in your browser.
 # If it does not, non-ascii characters will look very strange.
@@ -92,14 +107,25 @@ import leo.core.leoGlobals as g
 import asynchat
 import asyncore
 import cgi
+import collections
+import copy
+import hashlib
 import json
+import threading
 
 if g.isPython3:
     import http.server
     SimpleHTTPRequestHandler = http.server.SimpleHTTPRequestHandler
+    BaseHTTPRequestHandler = http.server.BaseHTTPRequestHandler
+    HTTPServer = http.server.HTTPServer
+    import socketserver as SocketServer
 else:
+    import BaseHTTPServer
     import SimpleHTTPServer
+    import SocketServer
     SimpleHTTPRequestHandler = SimpleHTTPServer.SimpleHTTPRequestHandler
+    BaseHTTPRequestHandler = BaseHTTPServer.BaseHTTPRequestHandler
+    HTTPServer = BaseHTTPServer.HTTPServer
     
 if g.isPython3:
     import io
@@ -144,10 +170,19 @@ from xml.sax.saxutils import quoteattr
 # - Removed the old @page line from the docstring.
 # 0.98 EKR: Handle unicode characters properly.
 # 0.99 Lauri Ojansivu <lauri.ojansivu@gmail.com>: Many change for better html generation.
+# 1.00 EKR: Added the threaded server:
+# - A server thread serves pages from a snapshot of the open outlines.
+# - Rendered pages are cached. Pages have ETags; connections are kept alive.
+# - @bool http_threaded = False restores the asyncore server.
 #@-<< version history >>
 
 sockets_to_close = []
 
+main_thread_requests = collections.deque()
+    # Requests that the server thread must not handle itself.
+    # doMainThreadRequests handles them at idle time.
+threaded_server = None
+
 #@+<< config >>
 #@+node:bwmulder.20050326191345: ** << config >>
 class config:
@@ -155,6 +190,8 @@ class config:
     http_timeout = 0
     http_ip = '127.0.0.1'
     http_port = 8080
+    http_threaded = True
+    http_cache_size = 1000
     rst2_http_attributename = 'rst_http_attribute'
 #@-<< config >>
 #@+others
@@ -167,15 +204,23 @@ def init ():
     else:
         getGlobalConfiguration()
         if config.http_active:
-            
+            global threaded_server
             try:
-                s=Server(config.http_ip,config.http_port,RequestHandler)
+                if config.http_threaded:
+                    threaded_server = ThreadedServer(config.http_ip,config.http_port)
+                else:
+                    s=Server(config.http_ip,config.http_port,RequestHandler)
             except socket.error as e:
                 g.es("mod_http server initialization failed (%s:%s): %s" % (config.http_ip, config.http_port, e))
                 return False
-                    
-            asyncore.read = a_read
-            g.registerHandler("idle", plugin_wrapper)
+            
+            if threaded_server:
+                threaded_server.start()
+                g.registerHandler(("new","open2","save2","close-frame"),onRefreshSnapshot)
+                g.registerHandler("idle",doMainThreadRequests)
+            else:
+                asyncore.read = a_read
+                g.registerHandler("idle", plugin_wrapper)
     
             g.es("http serving enabled at %s:%s, version %s" % (
                 config.http_ip, config.http_port, __version__), color="purple")
@@ -463,24 +508,9 @@ class leo_interface(object):
         """
         result = []
         if node:
-            cnode = node
-            parent = cnode.parent()
-            while parent:
-                i = 0
-                child = parent.firstChild()
-                while child != cnode:
-                    child = child.next()
-                    i += 1
-                result.append(str(i))
-                cnode = parent
-                parent = cnode.parent()
-            i = 0
-            previous = cnode.back()
-            while previous:
-                i += 1
-                previous = previous.back()
-            result.append(str(i))
-            result.reverse()
+            # The position's stack already contains the child indices.
+            result = [str(n) for v,n in node.stack]
+            result.append(str(node._childIndex))
         return result
     #@+node:EKR.20040517080250.26: *3* get_leo_node
     def get_leo_node(self, path):
@@ -494,7 +524,7 @@ class leo_interface(object):
             Return None if that node can not be identified that way.
         """
         # Identify the window
-        for w in g.app.windowList:
+        for w in self.get_leo_windows():
             if w.shortFileName() == path[0]:
                 break
         else:
@@ -528,8 +558,7 @@ class leo_interface(object):
         f.write("<h2>Windowlist</h2>\n")
         f.write("<hr />\n") # horizontal rule
         f.write("<ul>\n")
-        a = g.app # get the singleton application instance.
-        windows = a.windowList # get the list of all open frames.
+        windows = self.get_leo_windows() # get the list of all open frames.
         for w in windows:
             f.write("<li>")
             shortfilename = w.shortFileName()
@@ -540,6 +569,12 @@ class leo_interface(object):
         f.write("</ul>\n")
         f.write("<hr />\n")
         return f
+    #@+node:ekr.20140219061533.16908: *3* get_leo_windows
+    def get_leo_windows(self):
+        
+        """Return the list of windows whose outlines can be served."""
+        
+        return g.app.windowList
     #@+node:bwmulder.20050319135316: *3* node_reference
     def node_reference(self, vnode):
         """
@@ -873,6 +908,322 @@ class Server(asyncore.dispatcher):
         # on the incoming connexion
         self.handler(conn,addr,self)
     #@-others
+#@+node:ekr.20140219061533.16909: ** class snapshotNode
+class snapshotNode(object):
+    """
+    A copy of one node of an outline, made in Leo's main thread.
+
+    snapshotNodes never change. They have the parts of the position api that
+    leo_interface uses, so the server thread can render them safely.
+    """
+    #@+others
+    #@+node:ekr.20140219061533.16910: *3* __init__
+    def __init__(self, v, window, parent, childIndex):
+
+        self.b = v.b
+        self.gnx = v.gnx
+        self.h = v.h
+        self.children = []
+        self.window = window
+        self._childIndex = childIndex
+        self._etag = None
+        self._next = None
+        self._parent = parent
+
+        # get_http_attribute(node) uses node.v.unknownAttributes.
+        self.v = self
+        self.unknownAttributes = {}
+        name = config.rst2_http_attributename
+        attrs = getattr(v,'unknownAttributes',None)
+        if attrs and name in attrs:
+            self.unknownAttributes[name] = copy.deepcopy(attrs[name])
+    #@+node:ekr.20140219061533.16911: *3* etag
+    def etag(self):
+        """
+        Return a hash of everything format_leo_node writes for this node:
+        its headline, body and http attribute, its links and its path.
+        """
+        if self._etag is None:
+            threadNext = self.threadNext()
+            aList = [
+                self.window.fileName,
+                '/'.join(self.nameparts()),
+                self.gnx,self.h,self.b,
+                repr(get_http_attribute(self)),
+                threadNext and '/'.join(threadNext.nameparts()) or '',
+                self._next and 'next' or '',
+            ]
+            aList.extend([node.h for node,n in self.stack])
+            aList.append('children')
+            aList.extend([child.h for child in self.children])
+            s = '\0'.join(aList)
+            self._etag = hashlib.md5(g.toEncodedString(s,'utf-8')).hexdigest()
+        return self._etag
+    #@+node:ekr.20140219061533.16912: *3* nameparts
+    def nameparts(self):
+        """Return the list of sibling numbers leading to this node."""
+        result = [str(n) for node,n in self.stack]
+        result.append(str(self._childIndex))
+        return result
+    #@+node:ekr.20140219061533.16913: *3* position api
+    def firstChild(self):
+        return self.children and self.children[0] or None
+
+    def next(self):
+        return self._next
+
+    def nthChild(self, n):
+        if 0 <= n < len(self.children):
+            return self.children[n]
+        else:
+            return None
+
+    def parent(self):
+        return self._parent
+
+    def threadNext(self):
+        if self.children:
+            return self.children[0]
+        node = self
+        while node:
+            if node._next:
+                return node._next
+            node = node._parent
+        return None
+
+    def _get_stack(self):
+        # Like position.stack: (ancestor,childIndex) pairs, outermost first.
+        aList = []
+        node = self._parent
+        while node:
+            aList.append((node,node._childIndex),)
+            node = node._parent
+        aList.reverse()
+        return aList
+
+    stack = property(_get_stack)
+    #@-others
+#@+node:ekr.20140219061533.16914: ** class snapshotWindow
+class snapshotWindow(object):
+    """A copy of all the nodes of one outline, made in Leo's main thread."""
+    #@+others
+    #@+node:ekr.20140219061533.16915: *3* __init__
+    def __init__(self, c):
+
+        self.c = self
+            # leo_interface uses window.c.rootVnode().
+        self.fileName = c.shortFileName()
+        self._etag = None
+        self.roots = self.copyNodes(c.hiddenRootNode.children,None)
+    #@+node:ekr.20140219061533.16916: *3* copyNodes
+    def copyNodes(self, vnodes, parent):
+        """Return the list of snapshotNodes for vnodes, the children of parent."""
+        aList = []
+        for i,v in enumerate(vnodes):
+            node = snapshotNode(v,self,parent,i)
+            node.children = self.copyNodes(v.children,node)
+            if aList:
+                aList[-1]._next = node
+            aList.append(node)
+        return aList
+    #@+node:ekr.20140219061533.16917: *3* etag
+    def etag(self):
+        """Return a hash of everything format_leo_node writes for the top-level page."""
+        if self._etag is None:
+            aList = [self.fileName,'top level']
+            aList.extend([node.h for node in self.roots])
+            s = '\0'.join(aList)
+            self._etag = hashlib.md5(g.toEncodedString(s,'utf-8')).hexdigest()
+        return self._etag
+    #@+node:ekr.20140219061533.16918: *3* rootVnode & shortFileName
+    def rootVnode(self):
+        return self.roots and self.roots[0] or None
+
+    def shortFileName(self):
+        return self.fileName
+    #@-others
+#@+node:ekr.20140219061533.16919: ** class ThreadedRequestHandler
+class ThreadedRequestHandler(BaseHTTPRequestHandler, leo_interface):
+    """
+    Handle requests in the threads of a ThreadedServer.
+
+    Pages come from the server's snapshot and its cache of rendered pages.
+    Bookmarking requests, which change outlines, run in Leo's main thread.
+    """
+    
+    protocol_version = 'HTTP/1.1'
+        # Keep connections alive.
+    timeout = 30
+        # Close connections that are idle for this many seconds.
+    wbufsize = -1
+        # Send the headers and the page together: separate writes delay
+        # replies on keep-alive connections.
+
+    #@+others
+    #@+node:ekr.20140219061533.16920: *3* do_GET & do_HEAD
+    def do_GET(self):
+
+        self.send_page(head=False)
+
+    def do_HEAD(self):
+
+        self.send_page(head=True)
+    #@+node:ekr.20140219061533.16921: *3* do_main_thread_request
+    def do_main_thread_request(self):
+        """
+        Ask Leo's main thread to handle this request with LeoActions.
+        Return the page, or None if the request failed or timed out.
+        """
+        bunch = g.Bunch(done=threading.Event(),handler=self,result=None)
+        main_thread_requests.append(bunch)
+        bunch.done.wait(self.timeout)
+        return bunch.result
+    #@+node:ekr.20140219061533.16922: *3* get_leo_windows
+    def get_leo_windows(self):
+
+        """Return the windows of the server's snapshot."""
+
+        return self.server.windows
+    #@+node:ekr.20140219061533.16923: *3* log_message
+    def log_message(self, format, *args):
+
+        """Don't log requests: g.es is not thread-safe."""
+
+        pass
+    #@+node:ekr.20140219061533.16924: *3* send_page
+    def send_page(self, head):
+        """
+        Send the page for self.path, or an empty reply if the browser's copy,
+        given by the If-None-Match header, is up to date.
+        """
+        etag = None
+        path = self.split_leo_path(self.path)
+        try:
+            if path == '/':
+                s = self.get_leo_windowlist().getvalue()
+            elif path[0] == '_' or (len(path) == 1 and path[0] == 'favicon.ico'):
+                s = self.do_main_thread_request()
+                if s is None:
+                    self.send_error(503, "Request failed")
+                    return
+            else:
+                window, node = self.get_leo_node(path)
+                if window is None:
+                    self.send_error(404, "File not found")
+                    return
+                etag = (node or window).etag()
+                s = self.server.get_page(etag,
+                    lambda: self.format_leo_node(window,node).getvalue())
+        except (nodeNotFound, noLeoNodePath, ValueError):
+            self.send_error(404, "Node not found")
+            return
+        if etag:
+            etag = '"%s"' % etag
+            tags = [z.strip() for z in (self.headers.get('If-None-Match') or '').split(',')]
+            if '*' in tags or etag in [z[2:] if z.startswith('W/') else z for z in tags]:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+        s = g.toEncodedString(s,browser_encoding)
+        self.send_response(200)
+        self.send_header("Content-type", "text/html; charset=%s" % browser_encoding)
+        self.send_header("Content-Length", str(len(s)))
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        if not head:
+            self.wfile.write(s)
+    #@-others
+#@+node:ekr.20140219061533.16925: ** class ThreadedServer
+class ThreadedServer(SocketServer.ThreadingMixIn, HTTPServer):
+    """
+    An http server that runs in its own thread and handles each connection
+    in a separate thread.
+    """
+    
+    allow_reuse_address = True
+    daemon_threads = True
+
+    #@+others
+    #@+node:ekr.20140219061533.16926: *3* __init__
+    def __init__(self, ip, port):
+
+        HTTPServer.__init__(self, (ip, port), ThreadedRequestHandler)
+        self.cache = collections.OrderedDict()
+            # Keys are etags, values are rendered pages.
+            # The least recently used pages come first.
+        self.lock = threading.Lock()
+            # Protects self.cache: each request runs in its own thread.
+        self.snapshots = []
+            # A list of (c,snapshotWindow) pairs, in window order.
+        self.thread = None
+        self.windows = []
+            # The snapshot: a list of snapshotWindows.
+        self.refresh()
+    #@+node:ekr.20140219061533.16927: *3* get_page
+    def get_page(self, etag, render):
+        """
+        Return the cached page whose hash is etag,
+        calling render() to create the page if it isn't cached.
+        """
+        with self.lock:
+            s = self.cache.pop(etag,None)
+            if s is not None:
+                self.cache[etag] = s # Now the most recently used page.
+                return s
+        s = render()
+        with self.lock:
+            self.cache[etag] = s
+            while len(self.cache) > max(1,config.http_cache_size):
+                self.cache.popitem(last=False)
+        return s
+    #@+node:ekr.20140219061533.16928: *3* refresh
+    def refresh(self, c=None):
+        """
+        Replace the snapshot of c's outline by a new copy, adding it if need
+        be. Copy all open outlines if c is None.
+
+        Must be called in Leo's main thread.
+        """
+        if c is None:
+            snapshots = [(w.c,snapshotWindow(w.c)) for w in g.app.windowList]
+        else:
+            snapshots,found = [],False
+            for c2,window in self.snapshots:
+                if c2 == c:
+                    window,found = snapshotWindow(c),True
+                snapshots.append((c2,window))
+            if not found:
+                snapshots.append((c,snapshotWindow(c)))
+        self.set_snapshots(snapshots)
+    #@+node:ekr.20140219061533.16950: *3* remove
+    def remove(self, c):
+        """
+        Remove the snapshot of c's outline.
+
+        Must be called in Leo's main thread.
+        """
+        self.set_snapshots([z for z in self.snapshots if z[0] != c])
+    #@+node:ekr.20140219061533.16951: *3* set_snapshots
+    def set_snapshots(self, snapshots):
+        """
+        Set self.snapshots and self.windows.
+
+        Request threads see either the old or the new list of windows,
+        never a list under construction.
+        """
+        self.snapshots = snapshots
+        self.windows = [window for c,window in snapshots]
+    #@+node:ekr.20140219061533.16929: *3* start
+    def start(self):
+
+        """Start serving in a separate thread."""
+
+        self.thread = t = threading.Thread(target=self.serve_forever)
+        t.daemon = True
+        t.start()
+    #@-others
 #@+node:tbrown.20110930093028.34530: ** class LeoActions
 class LeoActions:
     """A place to collect other URL based actions like saving
@@ -1196,6 +1547,35 @@ def plugin_wrapper(tag, keywords):
     first = True
     while loop(config.http_timeout):
         pass
+#@+node:ekr.20140219061533.16930: ** doMainThreadRequests
+def doMainThreadRequests(tag, keywords):
+    """Handle the requests that the server threads pass to Leo's main thread."""
+
+    if g.app.killed: return
+
+    # Only this thread removes requests.
+    while main_thread_requests:
+        bunch = main_thread_requests.popleft()
+        try:
+            actions = LeoActions(bunch.handler)
+            if bunch.handler.path == '/favicon.ico':
+                f = actions.get_favicon()
+            else:
+                f = actions.get_response()
+            bunch.result = f and f.getvalue()
+        except Exception:
+            g.es_exception()
+        bunch.done.set()
+#@+node:ekr.20140219061533.16931: ** onRefreshSnapshot
+def onRefreshSnapshot(tag, keywords):
+    """Refresh the threaded server's snapshot when outlines change."""
+
+    c = keywords.get('c')
+    if c and threaded_server and not g.app.killed:
+        if tag == 'close-frame':
+            threaded_server.remove(c)
+        else:
+            threaded_server.refresh(c)
 #@+node:EKR.20040517080250.46: ** asynchore_overrides
 #@+node:EKR.20040517080250.47: *3* a_read
 def a_read(obj):
@@ -1227,6 +1607,16 @@ def getConfiguration(c):
     if newactive is not None:
         config.http_active = newactive
 
+    # threaded.
+    newthreaded = c.config.getBool("http_threaded")
+    if newthreaded is not None:
+        config.http_threaded = newthreaded
+
+    # cache size.
+    newcachesize = c.config.getInt("http_cache_size")
+    if newcachesize is not None:
+        config.http_cache_size = newcachesize
+
     # attribute name.
     new_rst2_http_attributename = c.config.getString("rst2_http_attributename")
     if new_rst2_http_attributename:
@@ -1256,6 +1646,16 @@ def getGlobalConfiguration():
     if newactive is not None:
         config.http_active = newactive
 
+    # threaded.
+    newthreaded = g.app.config.getBool("http_threaded")
+    if newthreaded is not None:
+        config.http_threaded = newthreaded
+
+    # cache size.
+    newcachesize = g.app.config.getInt("http_cache_size")
+    if newcachesize is not None:
+        config.http_cache_size = newcachesize
+
     # attribute name.
     new_rst2_http_attributename = g.app.config.getString("rst2_http_attributename")
     if new_rst2_http_attributename:
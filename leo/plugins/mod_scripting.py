@@ -802,10 +802,7 @@ class scriptingController:
         
         '''Fix bug 1193819: Find the node with the given gnx.'''
 
-        for p in self.c.all_positions():
-            if p.gnx == gnx:
-                return p
-        return None
+        return g.app.gnxIndex.findPosition(gnx,self.c)
     #@+node:ekr.20080813064908.4: *4* getArgs
     def getArgs (self,h):
         args = []
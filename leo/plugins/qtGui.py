@@ -9990,6 +9990,7 @@ class jEditColorizer:
     def __init__(self,c,colorizer,highlighter,w):
 
         # Basic data...
+        self.body = c.frame.body
         self.c = c
         self.colorizer = colorizer
         self.highlighter = highlighter # a QSyntaxHighlighter
@@ -11791,6 +11792,7 @@ class jEditColorizer:
         # Update the counts.
         self.recolorCount += 1
         self.totalChars += len(s)
+        self.body.totalChars += len(s) # For c.commandStats: outlives this colorer.
 
         if self.colorizer.changingText:
             if trace and returns: g.trace('changingText')
@@ -79,6 +79,7 @@ from PyQt4 import QtGui
 from PyQt4.QtCore import Qt
 
 import fnmatch, re
+import threading
 
 from leo.plugins import threadutil
     # Bug fix. See: https://groups.google.com/forum/?fromgroups=#!topic/leo-editor/PAZloEsuk7g
@@ -95,6 +96,7 @@ def init ():
 
     if ok:
         g.registerHandler('after-create-leo-frame',onCreate)
+        g.registerHandler('childrenModified',onChildrenModified)
         g.plugin_signon(__name__)
 
     return ok
@@ -106,6 +108,15 @@ def onCreate (tag, keys):
 
     install_qt_quicksearch_tab(c)
 
+#@+node:ekr.20140219061533.16753: ** onChildrenModified
+def onChildrenModified (tag, keys):
+
+    # Nodes have been inserted, deleted, moved or cloned.
+    # Undo and redo change the cache's key instead.
+    for v in keys.get('nodes') or []:
+        cache = getattr(v.context,'quickSearchCache',None)
+        if cache:
+            cache.invalidate()
 #@+node:tbrown.20111011152601.48461: ** show_unittest_failures
 def show_unittest_failures(event):
     c = event.get('c')
@@ -117,12 +128,7 @@ def show_unittest_failures(event):
     nav.scon.clear()
     if fails:
         for gnx, stack in fails:
-            pos = None
-            # sucks
-            for p in c.all_positions():
-                if p.gnx == gnx:
-                    pos = p.copy()
-                    break
+            pos = g.app.gnxIndex.findPosition(gnx,c)
     
             def mkcb(pos, stack):
                 def focus():            
@@ -373,6 +379,132 @@ class LeoQuickSearchWidget(QtGui.QWidget):
         
 
     #@-others
+#@+node:ekr.20140219061533.16754: ** class QuickSearchCache
+class QuickSearchCache:
+
+    """ A per-commander store of the headlines and bodies of all vnodes.
+
+    Lowercased copies of headlines and bodies are recomputed only when
+    the text changes. Each vnode appears once, so clones match once.
+    When a query extends the previous query, only the previous hits are
+    searched again.
+
+    Both the gui thread and the live search worker thread search the
+    cache, so all methods that use or change the cache take self.lock.
+    """
+
+    #@+others
+    #@+node:ekr.20140219061533.16755: *3* __init__
+    def __init__(self,c):
+
+        self.c = c
+        self.entries = []
+            # Lists [v,h,b,lower_h,lower_b] in outline order.
+            # h and b are the headline and body for which lower_h and lower_b were computed.
+        self.key = None # The undo state when self.entries was computed.
+        self.last = None # (query,headline hits,body hits) for the last glob query.
+            # body hits is None if bodies were not searched.
+        self.lock = threading.Lock()
+        self.stale = True # True: nodes may have been inserted or deleted.
+    #@+node:ekr.20140219061533.16756: *3* body & head
+    def body(self,e):
+
+        b = e[0].b
+        if b is not e[2]:
+            e[2] = b
+            e[4] = b.lower()
+        return e[4]
+
+    def head(self,e):
+
+        h = e[0].h
+        if h is not e[1]:
+            e[1] = h
+            e[3] = h.lower()
+        return e[3]
+    #@+node:ekr.20140219061533.16955: *3* invalidate
+    def invalidate(self):
+
+        """ Recompute the list of vnodes before the next search. """
+
+        with self.lock:
+            self.stale = True
+    #@+node:ekr.20140219061533.16757: *3* refresh
+    def refresh(self):
+
+        """ Recompute the list of vnodes if the outline may have changed.
+
+        The caller must hold self.lock.
+        """
+
+        u = self.c.undoer
+        key = len(u.beads),u.bead
+        if self.stale or key != self.key:
+            d = dict([(id(e[0]),e) for e in self.entries])
+            self.entries = [d.get(id(v)) or [v,None,None,'','']
+                for v in self.c.all_unique_nodes()]
+            self.key = key
+            self.last = None
+            self.stale = False
+    #@+node:ekr.20140219061533.16758: *3* search & helper
+    def search(self, pat, bodies=True):
+
+        """ Return (hm,bm,bpat): the lists of vnodes whose headline or body
+        matches pat, and the compiled body pattern.
+
+        bm is empty unless bodies is True.
+        """
+
+        with self.lock:
+            return self.searchHelper(pat, bodies)
+
+    def searchHelper(self, pat, bodies):
+
+        hpat,bpat,flags = patterns(pat)
+        bpat = re.compile(bpat,flags)
+        self.refresh()
+        if pat.startswith('r:'):
+            hpat = re.compile(hpat,flags)
+            hm = [e for e in self.entries if hpat.match(e[0].h)]
+            if bodies:
+                bm = [e for e in self.entries if bpat.search(e[0].b)]
+            else:
+                bm = []
+            self.last = None
+            return [e[0] for e in hm],[e[0] for e in bm],bpat
+        query = pat.lower()
+        last = self.last
+        if last and query.startswith(last[0]) and '[' not in last[0]:
+            # The new hits are a subset of the last hits.
+            hm,bm = last[1],last[2]
+        else:
+            hm = bm = self.entries
+        if bm is None:
+            bm = self.entries # The last search did not search bodies.
+        if '*' in query or '?' in query or '[' in query:
+            hpat,bpat2,flags = patterns(query)
+            hpat,bpat2 = re.compile(hpat),re.compile(bpat2)
+            hm = [e for e in hm if hpat.match(self.head(e))]
+            if bodies:
+                bm = [e for e in bm if bpat2.search(self.body(e))]
+        else:
+            hm = [e for e in hm if query in self.head(e)]
+            if bodies:
+                bm = [e for e in bm if query in self.body(e)]
+        if not bodies:
+            bm = None
+        self.last = query,hm,bm
+        return [e[0] for e in hm],[e[0] for e in bm or []],bpat
+    #@-others
+#@+node:ekr.20140219061533.16759: ** getCache
+def getCache(c):
+
+    """ Return the QuickSearchCache for c, creating it if need be. """
+
+    cache = getattr(c,'quickSearchCache',None)
+    if not cache:
+        cache = c.quickSearchCache = QuickSearchCache(c)
+    return cache
 #@+node:ekr.20111014074810.15659: ** matchLines
 def matchlines(b, miter):
 
@@ -383,6 +515,20 @@ def matchlines(b, miter):
         res.append((li, (m.start(), m.end() )))
     return res
 
+#@+node:ekr.20140219061533.16760: ** patterns
+def patterns(pat):
+
+    """ Return (hpat,bpat,flags) for the headline and body searches for pat. """
+
+    if not pat.startswith('r:'):
+        hpat = fnmatch.translate('*'+ pat + '*').replace(r"\Z(?ms)","")
+        bpat = fnmatch.translate(pat).rstrip('$').replace(r"\Z(?ms)","")
+        flags = re.IGNORECASE
+    else:
+        hpat = pat[2:]
+        bpat = pat[2:]
+        flags = 0
+    return hpat,bpat,flags
 #@+node:ville.20090314215508.12: ** QuickSearchController
 class QuickSearchController:
     
@@ -394,6 +540,10 @@ class QuickSearchController:
         self.c = c
         self.lw = w = listWidget # A QListWidget.
         self.its = {} # Keys are id(w),values are tuples (p,pos)
+        self.cache = getCache(c)
+        self.chunkSize = 100 # The number of matches to show at once.
+        self.generation = 0 # Incremented whenever the list is cleared.
+        self.pending = [] # Matches not yet shown: tuples (v,bpat).
         self.worker = threadutil.UnitWorker()
 
         self.frozen = False    
@@ -426,10 +576,8 @@ class QuickSearchController:
                 return
             if self.frozen: 
                 return
-            hm,bm = lst[-1]
-            self.clear()
-            self.addHeadlineMatches(hm)
-            self.addBodyMatches(bm)
+            hm,bm,bpat = lst[-1]
+            self.showMatches(hm,bm,bpat)
 
             
         self.throttler = threadutil.NowOrLater(throttledDump)        
@@ -490,10 +638,36 @@ class QuickSearchController:
             f.setBold(True)
             it.setFont(f)
             self.its[id(it)] = (p,None)
+    #@+node:ekr.20140219061533.16761: *3* addPending
+    def addPending(self, generation, n=None):
+
+        """ Add the next n pending matches to the list. """
+
+        if generation != self.generation:
+            return
+        n = n or self.chunkSize
+        chunk = self.pending[:n]
+        del self.pending[:n]
+        hm,bm = leoNodes.poslist(),leoNodes.poslist()
+        for v,bpat in chunk:
+            p = self.c.vnode2position(v)
+            if not p:
+                continue # The node has been deleted.
+            if bpat:
+                p.matchiter = bpat.finditer(p.b)
+                bm.append(p)
+            else:
+                hm.append(p)
+        self.addHeadlineMatches(hm)
+        self.addBodyMatches(bm)
+        if self.pending:
+            threadutil.later(lambda: self.addPending(generation))
     #@+node:ekr.20111015194452.15691: *3* clear
     def clear(self):
 
         self.its = {}
+        self.pending = []
+        self.generation += 1
         self.lw.clear()
 
     #@+node:ekr.20111015194452.15693: *3* doNodeHistory
@@ -523,44 +697,32 @@ class QuickSearchController:
 
         self.clear()
 
-        if not pat.startswith('r:'):
-            hpat = fnmatch.translate('*'+ pat + '*').replace(r"\Z(?ms)","")
-            bpat = fnmatch.translate(pat).rstrip('$').replace(r"\Z(?ms)","")
-            flags = re.IGNORECASE
-        else:
-            hpat = pat[2:]
-            bpat = pat[2:]
-            flags = 0
-
-        hm = self.c.find_h(hpat, flags)
-        self.addHeadlineMatches(hm)
-        bm = self.c.find_b(bpat, flags)
-        self.addBodyMatches(bm)
+        hm,bm,bpat = self.cache.search(pat)
+        self.pending = [(v,None) for v in hm] + [(v,bpat) for v in bm]
+        self.addPending(self.generation,n=len(self.pending))
 
         self.lw.insertItem(0, "%d hits"%self.lw.count())
     #@+node:ville.20121118193144.3620: *3* bgSearch
     def bgSearch(self, pat):
 
-        #self.clear()
+        # Runs in the worker thread.
+        # Live search matches only headlines: the Return key searches bodies.
 
         if self.frozen:
             return
             
-        if not pat.startswith('r:'):
-            hpat = fnmatch.translate('*'+ pat + '*').replace(r"\Z(?ms)","")
-            bpat = fnmatch.translate(pat).rstrip('$').replace(r"\Z(?ms)","")
-            flags = re.IGNORECASE
-        else:
-            hpat = pat[2:]
-            bpat = pat[2:]
-            flags = 0
-
-        hm = self.c.find_h(hpat, flags)
-        #self.addHeadlineMatches(hm)
-        #bm = self.c.find_b(bpat, flags)
-        #self.addBodyMatches(bm)
-        return hm, []
-        #self.lw.insertItem(0, "%d hits"%self.lw.count())
+        return self.cache.search(pat, bodies=False)
+    #@+node:ekr.20140219061533.16762: *3* showMatches
+    def showMatches(self, hm, bm, bpat):
+
+        """ Show the matching vnodes, a chunk at a time.
+
+        hm and bm are lists of vnodes whose headlines or bodies match.
+        """
+
+        self.clear()
+        self.pending = [(v,None) for v in hm] + [(v,bpat) for v in bm]
+        self.addPending(self.generation)
     #@+node:ekr.20111015194452.15687: *3* doShowMarked
     def doShowMarked(self):
 
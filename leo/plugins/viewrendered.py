@@ -163,6 +163,14 @@ Settings
   Suitable extensions can be seen here: 
   http://pythonhosted.org/Markdown/extensions/index.html
 
+- ``@int view-rendered-delay = 300``
+  The time, in milliseconds, to wait after the last change to the body
+  before rendering reStructuredText or markdown.
+
+Rendering reStructuredText and markdown happens in a separate process if the
+concurrent.futures module is available. Rendered html is cached, so
+returning to a node, or undoing a change, does not render the text again.
+
 Acknowledgments
 ================
 
@@ -185,7 +193,14 @@ import leo.core.leoGlobals as g
 import PyQt4.QtCore as QtCore
 import leo.plugins.qtGui as qtGui
 g.assertUi('qt')
+import hashlib
 import os
+import leo.plugins.viewrendered_worker as viewrendered_worker
+
+try:
+    import concurrent.futures as futures
+except ImportError:
+    futures = None # Python 2 without the futures backport.
 
 # docutils = g.importExtension('docutils',pluginName='viewrendered.py',verbose=False)
 try:
@@ -537,6 +552,15 @@ class ViewRenderedController(QtGui.QWidget):
         # self.auto_hide    = c.config.getBool('view-rendered-auto-hide',False)
         self.background_color = c.config.getColor('rendering-pane-background-color') or 'white'
         self.node_changed = True
+        # Rendering in a worker process...
+        self.executor = None # A futures.ProcessPoolExecutor, created when needed.
+        self.future = None # The future for the latest render.
+        self.future_data = None # (key,gnx) for self.future.
+        self.pending_render = None # (key,kind,s,path,gnx) for the next render.
+        self.render_cache = {} # Keys are (kind,hash,path), values are html.
+        self.render_delay = c.config.getInt('view-rendered-delay') or 300
+        self.poll_timer = self.create_timer(50,self.poll_render)
+        self.render_timer = self.create_timer(None,self.start_render)
         
         # Init.
         self.create_dispatch_dict()
@@ -558,6 +582,20 @@ class ViewRenderedController(QtGui.QWidget):
             'svg':          pc.update_svg,
             'url':          pc.update_url,
         }
+    #@+node:ekr.20140219061533.16812: *4* create_timer
+    def create_timer (self,delay,callback):
+
+        '''Return a QTimer that calls callback.
+
+        delay is None for single-shot timers, or the timer's interval in msec.'''
+
+        timer = QtCore.QTimer(self)
+        if delay is None:
+            timer.setSingleShot(True)
+        else:
+            timer.setInterval(delay)
+        timer.connect(timer,QtCore.SIGNAL("timeout()"),callback)
+        return timer
     #@+node:tbrown.20110621120042.22676: *3* closeEvent
     def closeEvent(self, event):
         
@@ -608,6 +646,14 @@ class ViewRenderedController(QtGui.QWidget):
         g.unregisterHandler('select2',pc.update)
         g.unregisterHandler('idle',pc.update)
         pc.active = False
+        pc.pending_render = None
+        pc.render_timer.stop()
+        pc.poll_timer.stop()
+        pc.future = None
+        if pc.executor:
+            # Don't let the worker process outlive the pane.
+            pc.executor.shutdown(wait=False)
+            pc.executor = None
     #@+node:ekr.20110321072702.14508: *3* lock/unlock
     def lock (self):
         g.note('rendering pane locked')
@@ -844,43 +890,12 @@ class ViewRenderedController(QtGui.QWidget):
             path = g.scanAllAtPathDirectives(c,p) or c.getNodePath(p)
             if not os.path.isdir(path):
                 path = os.path.dirname(path)
-            if os.path.isdir(path):
-                os.chdir(path)
-            try:
-                msg = '' # The error message from docutils.
-                if pc.title:
-                    s = pc.underline(pc.title) + s
-                    pc.title = None
-                mdext = c.config.getString('view-rendered-md-extensions') or 'extra'
-                mdext = [x.strip() for x in mdext.split(',')]
-                s = markdown(s, mdext)
-                s = g.toUnicode(s) # 2011/03/15
-                show = True
-            except SystemMessage as sm:
-                # g.trace(sm,sm.args)
-                msg = sm.args[0]
-                if 'SEVERE' in msg or 'FATAL' in msg:
-                    s = 'MD error:\n%s\n\n%s' % (msg,s)
-
-        sb = w.verticalScrollBar()
-        if sb:
-            d = pc.scrollbar_pos_dict
-            if pc.node_changed:
-                # Set the scrollbar.
-                pos = d.get(p.v,sb.sliderPosition())
-                sb.setSliderPosition(pos)
-            else:
-                # Save the scrollbars
-                d[p.v] = pos = sb.sliderPosition()
-        if pc.default_kind in ('big','rst','html', 'md'):
-            w.setHtml(s)
-            if pc.default_kind == 'big':
-                w.zoomIn(4) # Doesn't work.
+            if pc.title:
+                s = pc.underline(pc.title) + s
+                pc.title = None
+            pc.render_html('md',s,path)
         else:
-            w.setPlainText(s) 
-        if sb and pos:
-            # Restore the scrollbars
-            sb.setSliderPosition(pos)
+            pc.set_html(s)
     #@+node:ekr.20110320120020.14481: *4* update_movie
     def update_movie (self,s,keywords):
         
@@ -954,23 +969,100 @@ class ViewRenderedController(QtGui.QWidget):
             path = g.scanAllAtPathDirectives(c,p) or c.getNodePath(p)
             if not os.path.isdir(path):
                 path = os.path.dirname(path)
-            if os.path.isdir(path):
-                os.chdir(path)
-            try:
-                msg = '' # The error message from docutils.
-                if pc.title:
-                    s = pc.underline(pc.title) + s
-                    pc.title = None
-                # Call docutils to get the string.
-                s = publish_string(s,writer_name='html')
-                s = g.toUnicode(s) # 2011/03/15
-                show = True
-            except SystemMessage as sm:
-                # g.trace(sm,sm.args)
-                msg = sm.args[0]
-                if 'SEVERE' in msg or 'FATAL' in msg:
-                    s = 'RST error:\n%s\n\n%s' % (msg,s)
+            if pc.title:
+                s = pc.underline(pc.title) + s
+                pc.title = None
+            pc.render_html('rst',s,path)
+        else:
+            pc.set_html(s)
+    #@+node:ekr.20140219061533.16813: *4* Rendering in a worker process
+    #@+node:ekr.20140219061533.16814: *5* render_html
+    def render_html (self,kind,s,path):
+
+        '''Render s, reStructuredText or markdown, as html.
+
+        Cached html is shown immediately. Otherwise, the text is rendered
+        in a worker process after the body has not changed for
+        self.render_delay msec.'''
 
+        pc = self
+        key = kind,hashlib.md5(g.toEncodedString(s,'utf-8')).hexdigest(),path
+        html = pc.render_cache.get(key)
+        if html is not None:
+            pc.pending_render = None
+            pc.render_timer.stop()
+            pc.set_html(html)
+        elif futures:
+            # Replace any previous render that has not started.
+            pc.pending_render = key,kind,s,path,pc.gnx
+            pc.render_timer.start(0 if pc.node_changed else pc.render_delay)
+        else:
+            html = viewrendered_worker.render(kind,s,path,pc.get_md_extensions())
+            pc.cache_html(key,html)
+            pc.set_html(html)
+    #@+node:ekr.20140219061533.16815: *5* start_render
+    def start_render (self):
+
+        '''Start the pending render in the worker process.'''
+
+        pc = self
+        data = pc.pending_render
+        pc.pending_render = None
+        if not data:
+            return
+        key,kind,s,path,gnx = data
+        if pc.future:
+            pc.future.cancel() # Has no effect if the render has started.
+        if not pc.executor:
+            pc.executor = futures.ProcessPoolExecutor(max_workers=1)
+        pc.future = pc.executor.submit(viewrendered_worker.render,
+            kind,s,path,pc.get_md_extensions())
+        pc.future_data = key,gnx
+        pc.poll_timer.start()
+    #@+node:ekr.20140219061533.16816: *5* poll_render
+    def poll_render (self):
+
+        '''Show the html when the worker process has finished rendering it.'''
+
+        pc = self
+        future = pc.future
+        if not future:
+            pc.poll_timer.stop()
+            return
+        if not future.done():
+            return
+        pc.poll_timer.stop()
+        pc.future = None
+        key,gnx = pc.future_data
+        try:
+            html = future.result()
+        except Exception as e:
+            html = '<pre>Rendering failed:\n%s</pre>' % e
+        else:
+            pc.cache_html(key,html)
+        # Show only the latest rendering of the selected node.
+        if gnx == pc.gnx and not pc.pending_render and pc.active and not pc.locked:
+            pc.set_html(html)
+    #@+node:ekr.20140219061533.16817: *5* cache_html
+    def cache_html (self,key,html):
+
+        d = self.render_cache
+        if len(d) > 100:
+            d.clear()
+        d[key] = html
+    #@+node:ekr.20140219061533.16818: *5* get_md_extensions
+    def get_md_extensions (self):
+
+        mdext = self.c.config.getString('view-rendered-md-extensions') or 'extra'
+        return [x.strip() for x in mdext.split(',')]
+    #@+node:ekr.20140219061533.16819: *5* set_html
+    def set_html (self,s):
+
+        '''Show s in the text widget, preserving its scroll position.'''
+
+        pc = self ; p = pc.c.p
+        w = pc.ensure_text_widget()
+        pos = None
         sb = w.verticalScrollBar()
         if sb:
             d = pc.scrollbar_pos_dict
@@ -0,0 +1,63 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20140219061533.16809: * @file viewrendered_worker.py
+'''
+Rendering functions used by viewrendered.py.
+
+viewrendered.py calls these functions in a worker process. This module must
+not import Qt or Leo's gui code: worker processes import this module.
+'''
+
+#@+<< imports >>
+#@+node:ekr.20140219061533.16810: ** << imports >> (viewrendered_worker.py)
+import os
+
+try:
+    from docutils.core import publish_string
+    from docutils.utils import SystemMessage
+    got_docutils = True
+except (ImportError,SyntaxError):
+    got_docutils = False
+    class SystemMessage(Exception):
+        pass
+
+try:
+    from markdown import markdown
+    got_markdown = True
+except ImportError:
+    got_markdown = False
+#@-<< imports >>
+
+#@+others
+#@+node:ekr.20140219061533.16811: ** render
+def render (kind,s,path,mdext):
+
+    '''
+    Return the html for s, reStructuredText or markdown.
+
+    kind:  'md' for markdown, otherwise reStructuredText.
+    path:  The directory containing the node, used for relative includes.
+    mdext: A list of markdown extensions.
+    '''
+
+    # viewrendered.py also calls this function in Leo's own process,
+    # so restore the working directory.
+    cwd = os.getcwd()
+    if path and os.path.isdir(path):
+        os.chdir(path)
+    label = 'MD' if kind == 'md' else 'RST'
+    try:
+        if kind == 'md':
+            s = markdown(s,mdext)
+        else:
+            s = publish_string(s,writer_name='html')
+        if isinstance(s,bytes):
+            s = s.decode('utf-8','replace')
+    except SystemMessage as sm:
+        msg = sm.args[0]
+        if 'SEVERE' in msg or 'FATAL' in msg:
+            s = '%s error:\n%s\n\n%s' % (label,msg,s)
+    finally:
+        os.chdir(cwd)
+    return s
+#@-others
+#@-leo